@@ -0,0 +1,61 @@
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+# cli start time: each command line builds its parser in a fresh interpreter, as the sinara entry point does
+
+repo_root = Path(__file__).resolve().parent.parent
+heavy_modules = ["docker", "requests", "tqdm"]
+command_lines = [
+    ["sinara", "--help"],
+    ["sinara", "volume", "list"],
+    ["sinara", "model", "list"],
+    ["sinara", "server", "list"]
+]
+
+measure_code = """
+import sys, json, time, argparse, importlib
+argv, package, heavy_modules = json.loads(sys.argv[1])
+start = time.perf_counter()
+sys.argv = argv
+command_handler = importlib.import_module(f"{package}.parts.command_handler")
+parser = argparse.ArgumentParser(prog=argv[0])
+subject_parser = parser.add_subparsers(title='subject', dest='subject')
+command_handler.CommandHandler.add_command_handlers(parser, subject_parser)
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "imported": [m for m in heavy_modules if m in sys.modules]}))
+"""
+
+def measure(argv, runs):
+    results = []
+    for _ in range(runs):
+        payload = json.dumps([argv, repo_root.name, heavy_modules])
+        output = subprocess.run([sys.executable, "-c", measure_code, payload], cwd=repo_root.parent,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(r["elapsed"] for r in results), sorted(set(m for r in results for m in r["imported"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time to build the sinara cli parser")
+    parser.add_argument('--runs', type=int, default=5, help='Runs per command line, the best one is reported (default: %(default)s)')
+    parser.add_argument('--budgetMs', type=float, default=300, help='Fail if parser build takes longer (default: %(default)s)')
+    args = parser.parse_args()
+
+    failed = False
+    for argv in command_lines:
+        elapsed, imported = measure(argv, args.runs)
+        # only the requested subject may load docker and friends, and not before a command runs
+        status = "ok"
+        if imported:
+            status = f"imports {', '.join(imported)}"
+            failed = True
+        elif elapsed * 1000 > args.budgetMs:
+            status = f"over {args.budgetMs:.0f}ms budget"
+            failed = True
+        print(f"{' '.join(argv):<24} {elapsed * 1000:8.1f}ms  {status}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,37 @@
-from .server import SinaraServer
-from .model import SinaraModel
-from .volume import SinaraVolume
+import sys
+from importlib import import_module
 
 class CommandHandler:
 
+    # subject -> (module, handler class, help), modules are imported only for the requested subject
+    subject_handlers = {
+        'server': ('.server', 'SinaraServer', 'SinaraML Server commands'),
+        'model': ('.model', 'SinaraModel', 'sinara model subject'),
+        'volume': ('.volume', 'SinaraVolume', 'sinara volume subject')
+    }
+
+    @staticmethod
+    def get_requested_subject(argv):
+        # root options may take values, so the subject is the first argument naming a known subject
+        for arg in argv[1:]:
+            if arg in CommandHandler.subject_handlers:
+                return arg
+        return None
+
+    @staticmethod
+    def get_subject_handler(subject):
+        module_name, class_name, _ = CommandHandler.subject_handlers[subject]
+        module = import_module(module_name, package=__package__)
+        return getattr(module, class_name)
+
     @staticmethod
     def add_command_handlers(root_parser, subject_parser):
         print('ml_ops_organization: personal')
-        SinaraServer.add_command_handlers(root_parser, subject_parser)
-        SinaraModel.add_command_handlers(root_parser, subject_parser)
-        SinaraVolume.add_command_handlers(root_parser, subject_parser)
\ No newline at end of file
+        requested_subject = CommandHandler.get_requested_subject(sys.argv)
+        for subject, (_, _, subject_help) in CommandHandler.subject_handlers.items():
+            if subject == requested_subject:
+                handler = CommandHandler.get_subject_handler(subject)
+                handler.add_command_handlers(root_parser, subject_parser)
+            else:
+                # placeholder keeps the subject visible in help without importing docker, requests, etc.
+                subject_parser.add_parser(subject, help=subject_help)
@@ -4,13 +4,18 @@ import urllib
 import time
 import socket
 import os
+import sys
 import json
+import subprocess
 from pathlib import Path
 import shutil
 import logging
 from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import math
 import platform
+import io
+import threading
 
 class fc:
     HEADER = '\033[95m'
@@ -25,6 +30,26 @@ class fc:
     WHITE   = '\033[37m'
     RESET   = '\033[39m'
 
+class IterStreamReader(io.RawIOBase):
+    # file object over an iterator of byte chunks, e.g. a docker archive stream, so tarfile can read it without a temporary file
+    def __init__(self, stream):
+        self.stream = iter(stream)
+        self.leftover = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.leftover:
+            try:
+                self.leftover = next(self.stream)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.leftover))
+        buffer[:size] = self.leftover[:size]
+        self.leftover = self.leftover[size:]
+        return size
+
 def get_bentoservice_profile_name(bentoservice_dir):
     profile = None
     profile_file = os.path.join(bentoservice_dir, 'bentoservice_profile.json')
@@ -34,33 +59,95 @@ def get_bentoservice_profile_name(bentoservice_dir):
             profile = profile_data['bentoservice_profile']['name']
     return profile
 
-def replace_bentoservice_model_server_image(dockerfile_path, model_server_image):
+def get_dockerfile_with_model_server_image(dockerfile_content, model_server_image):
     insert_marker = 'from '
+    marker_index = [idx for idx, s in enumerate(dockerfile_content) if insert_marker in s.lower()][0]
+    insert_index = marker_index + 1
+    dockerfile_content = list(dockerfile_content)
+    del dockerfile_content[0]
+    dockerfile_content.insert(0, f"FROM {model_server_image}\n")
+    return dockerfile_content
+
+def get_dockerfile_without_deps_install(dockerfile_content):
+    strs_to_remove = ["RUN ./bentoml-init.sh restore_conda_env\n", "RUN ./bentoml-init.sh install_pip_packages\n"]
+    return [x for x in dockerfile_content if x not in strs_to_remove]
+
+def replace_bentoservice_model_server_image(dockerfile_path, model_server_image):
     with open(dockerfile_path, 'r+') as docker_file:
-        dockerfile_content = docker_file.readlines()
-        marker_index = [idx for idx, s in enumerate(dockerfile_content) if insert_marker in s.lower()][0]
-        insert_index = marker_index + 1
-        del dockerfile_content[0]
-        dockerfile_content.insert(0, f"FROM {model_server_image}\n")
+        dockerfile_content = get_dockerfile_with_model_server_image(docker_file.readlines(), model_server_image)
         docker_file.seek(0)
         docker_file.writelines(dockerfile_content)
         docker_file.truncate()
 
 def remove_bentoservice_deps_install(dockerfile_path):
-    strs_to_remove = ["RUN ./bentoml-init.sh restore_conda_env\n", "RUN ./bentoml-init.sh install_pip_packages\n"]
     with open(dockerfile_path, 'r+') as docker_file:
-        dockerfile_content = docker_file.readlines()
-        dockerfile_content[:] = [x for x in dockerfile_content if x not in strs_to_remove]
+        dockerfile_content = get_dockerfile_without_deps_install(docker_file.readlines())
         docker_file.seek(0)
         docker_file.writelines(dockerfile_content)
         docker_file.truncate()
 
+hash_buffer_size = 8 * 1024 * 1024
+
+def compute_file_digests(file_name, algorithms=("md5",)):
+    # one read pass for all digests, hashlib releases the GIL on large buffers
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    buffer = bytearray(hash_buffer_size)
+    view = memoryview(buffer)
+    with open(file_name, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            for h in hashes:
+                h.update(view[:size])
+    return {algorithm: h.hexdigest() for algorithm, h in zip(algorithms, hashes)}
+
 def compute_md5(file_name):
-    hash_md5 = hashlib.md5()
-    with open(file_name, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    return compute_file_digests(file_name)["md5"]
+
+def _get_file_digests_cache_path():
+    from .config_manager import SinaraGlobalConfigManager
+    gcm = SinaraGlobalConfigManager()
+    return Path(gcm.cache_folder) / "file_digests.json"
+
+def _get_file_digests_cache_key(file_name):
+    st = os.stat(file_name)
+    return f"{os.path.abspath(file_name)}:{st.st_size}:{st.st_mtime_ns}:{st.st_dev}:{st.st_ino}"
+
+def compute_files_digests(file_names, algorithms=("md5",), use_cache=True, cached_only=False):
+    # cache entries are keyed by path, size, mtime and inode, so a replaced or modified file is hashed again,
+    # cached_only returns digests of cached files only and hashes nothing
+    cache_path = _get_file_digests_cache_path()
+    cache = _load_json_cache(cache_path) if use_cache else {}
+    keys = {file_name: _get_file_digests_cache_key(file_name) for file_name in file_names}
+    result = {}
+    to_compute = []
+    for file_name in file_names:
+        cached = cache.get(keys[file_name])
+        if cached and all([algorithm in cached for algorithm in algorithms]):
+            result[file_name] = cached
+        else:
+            to_compute.append(file_name)
+    if cached_only:
+        return result
+
+    with ThreadPoolExecutor(max_workers=min(len(to_compute), cpu_count()) or 1) as executor:
+        for file_name, digests in zip(to_compute, executor.map(lambda f: compute_file_digests(f, algorithms), to_compute)):
+            result[file_name] = digests
+
+    if use_cache and to_compute:
+        # entries of files that no longer exist are dropped
+        cache = {key: value for key, value in cache.items() if os.path.exists(key.rsplit(":", 4)[0])}
+        cache.update({keys[file_name]: result[file_name] for file_name in to_compute})
+        _save_json_cache(cache_path, cache)
+    return result
+
+def save_files_digests(files_digests):
+    # digests computed elsewhere, e.g. while files were streamed, are added to the digests cache
+    cache_path = _get_file_digests_cache_path()
+    cache = _load_json_cache(cache_path)
+    cache.update({_get_file_digests_cache_key(file_name): digests for file_name, digests in files_digests.items()})
+    _save_json_cache(cache_path, cache)
 
 def ip_address_is_valid(ip_address):
     ip_v4_seg  = r'(?:25[0-5]|(?:2[0-4]|1{0,1}[0-9]){0,1}[0-9])'
@@ -144,6 +231,152 @@ def delete_folder_contents(dest_folder):
         elif path.is_dir():
             shutil.rmtree(path)
 
+def trash_folder_contents(dest_folder):
+    # contents are moved away with renames on the same filesystem and purged later, the folder itself is kept
+    dest_folder = Path(dest_folder)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    trash_path = dest_folder.parent / f".sinara-trash-{dest_folder.name}-{timestamp}"
+    try:
+        folder_stat = dest_folder.stat()
+        os.rename(dest_folder, trash_path)
+        dest_folder.mkdir()
+        os.chmod(dest_folder, folder_stat.st_mode & 0o7777)
+        try:
+            os.chown(dest_folder, folder_stat.st_uid, folder_stat.st_gid)
+        except PermissionError:
+            pass
+    except OSError:
+        # folder is a mount point or its parent is read only, move the entries into a hidden folder inside it
+        trash_path = dest_folder / f".sinara-trash-{timestamp}"
+        trash_path.mkdir(exist_ok=True)
+        with os.scandir(dest_folder) as entries:
+            for entry in list(entries):
+                if entry.name != trash_path.name:
+                    os.rename(entry.path, trash_path / entry.name)
+    return str(trash_path)
+
+def _purge_folder_files(folder):
+    deleted = 0
+    subfolders = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                        deleted += 1
+                except OSError as e:
+                    logging.debug(e)
+    except OSError as e:
+        logging.debug(e)
+    return deleted, subfolders
+
+def _save_purge_status(status_path, status):
+    tmp_status_path = Path(status_path).with_suffix(".tmp")
+    with open(tmp_status_path, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp_status_path, status_path)
+
+def purge_folders(paths, status_path=None):
+    status = {"pid": os.getpid(), "start_time": _get_process_start_time(os.getpid()), "paths": paths, "deleted_files": 0}
+    last_report = 0
+    with ThreadPoolExecutor(max_workers=min(32, cpu_count() * 4)) as executor:
+        for path in paths:
+            # files are unlinked level by level in parallel, then the emptied folders are removed bottom up
+            folders = []
+            level = [path]
+            while level:
+                folders.extend(level)
+                next_level = []
+                for deleted, subfolders in executor.map(_purge_folder_files, level):
+                    status["deleted_files"] += deleted
+                    next_level.extend(subfolders)
+                level = next_level
+                if status_path and time.time() - last_report > 1:
+                    _save_purge_status(status_path, status)
+                    last_report = time.time()
+            for folder in reversed(folders):
+                try:
+                    os.rmdir(folder)
+                except OSError as e:
+                    logging.debug(e)
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)
+    if status_path:
+        Path(status_path).unlink(missing_ok=True)
+    return status["deleted_files"]
+
+def _pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _get_process_start_time(pid):
+    # clock ticks since boot, tells the process from a later one reusing its pid; None without procfs
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _purge_is_alive(status):
+    if not _pid_is_alive(status["pid"]):
+        return False
+    return status.get("start_time") is None or _get_process_start_time(status["pid"]) == status["start_time"]
+
+def get_purge_statuses():
+    from .config_manager import SinaraGlobalConfigManager
+    gcm = SinaraGlobalConfigManager()
+    statuses = []
+    for status_path in Path(gcm.purge_status_folder).glob("*.json"):
+        try:
+            with open(status_path, "r") as f:
+                status = json.load(f)
+            status["alive"] = _purge_is_alive(status)
+            status["status_path"] = str(status_path)
+            statuses.append(status)
+        except Exception as e:
+            logging.debug(e)
+    return statuses
+
+def purge_folders_in_background(paths):
+    from .config_manager import SinaraGlobalConfigManager
+    gcm = SinaraGlobalConfigManager()
+    Path(gcm.purge_status_folder).mkdir(parents=True, exist_ok=True)
+    # purges interrupted by a reboot or a kill are resumed by the next worker
+    for status in get_purge_statuses():
+        if not status["alive"]:
+            paths = paths + [p for p in status["paths"] if os.path.exists(p)]
+            Path(status["status_path"]).unlink(missing_ok=True)
+    if not paths:
+        return
+
+    # the worker is a new interpreter detached from the cli, a fork could inherit locks held by cli threads;
+    # the cli waits until the worker saved its status, so the purge is never seen as interrupted
+    worker_code = "import sys, json, importlib; sys.path[:0] = json.loads(sys.argv[1]); " \
+                  "importlib.import_module(sys.argv[2])._run_purge_worker(json.loads(sys.argv[3]))"
+    worker = subprocess.Popen([sys.executable, "-c", worker_code, json.dumps(sys.path), __name__, json.dumps(paths)],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=True)
+    worker.stdout.readline()
+    worker.stdout.close()
+
+def _run_purge_worker(paths):
+    from .config_manager import SinaraGlobalConfigManager
+    gcm = SinaraGlobalConfigManager()
+    status_path = Path(gcm.purge_status_folder) / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+    _save_purge_status(status_path, {"pid": os.getpid(), "start_time": _get_process_start_time(os.getpid()),
+                                     "paths": paths, "deleted_files": 0})
+    print("started", flush=True)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 1)
+    purge_folders(paths, status_path)
+
 def get_cli_version():
     try:
         from ._version import __version__
@@ -161,25 +394,101 @@ def convert_size(size_bytes):
    s = round(size_bytes / p, 2)
    return "%s %s" % (s, size_name[i])
 
+def parse_size(size):
+    # docker style sizes: 1024, '512m', '8g', '2gb'
+    if size is None:
+        return None
+    if isinstance(size, (int, float)):
+        return int(size)
+    size_units = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+    m = re.match(r"^\s*([0-9.]+)\s*([bkmgt]?)b?\s*$", str(size).lower())
+    if not m:
+        raise ValueError(f"invalid size value {size}")
+    unit = m.group(2) or "b"
+    return int(float(m.group(1)) * size_units[unit])
+
 def platform_is_wsl():
     platform_release = platform.uname().release
     if platform_release.endswith("-Microsoft") or platform_release.endswith("microsoft-standard-WSL2"):
         return True
     return False
 
-def get_folder_size(root):
-    def _get_sizes(folder):
-        for path, dirs, files in os.walk(folder):
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            for file in files:
-                full_path = os.path.join(path, file)
+folder_size_cache_ttl = 6 * 3600
+
+def _get_folder_size_cache_path(root):
+    from .config_manager import SinaraGlobalConfigManager
+    gcm = SinaraGlobalConfigManager()
+    root_hash = hashlib.md5(str(root).encode("utf-8")).hexdigest()
+    return Path(gcm.cache_folder) / "folder_size" / f"{root_hash}.json"
+
+def _load_json_cache(cache_path):
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_json_cache(cache_path, cache):
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_cache_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_cache_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_cache_path, cache_path)
+    except Exception as e:
+        logging.debug(e)
+
+def _scan_folder(folder, cache, scanned, now):
+    try:
+        folder_mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return 0, []
+    # cache entry: [folder mtime, size of files directly in folder, subfolders, scan time]
+    # folder mtime changes when entries are added, removed or renamed, ttl catches files modified in place,
+    # so files growing in place are reported late; use_cache=False where sizes must be exact
+    cached = cache.get(folder)
+    if cached and cached[0] == folder_mtime and now - cached[3] < folder_size_cache_ttl:
+        scanned[folder] = cached
+        return cached[1], cached[2]
+
+    files_size = 0
+    subfolders = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
                 try:
-                    yield (os.path.getsize(full_path), full_path)
-                except Exception:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith('.'):
+                            subfolders.append(entry.path)
+                    elif entry.is_file():
+                        files_size += entry.stat().st_size
+                except OSError:
                     pass
-                
+    except OSError:
+        return 0, []
+    scanned[folder] = [folder_mtime, files_size, subfolders, now]
+    return files_size, subfolders
+
+def get_folder_size(root, use_cache=True):
+    root = str(root)
+    cache_path = _get_folder_size_cache_path(root) if use_cache else None
+    cache = _load_json_cache(cache_path) if use_cache else {}
+    scanned = {}
+    now = time.time()
+
     total_size = 0
-    for (size, name) in _get_sizes(root):
-        total_size += size
-    
+    # scandir and stat release the GIL, so subtrees are walked in parallel threads
+    with ThreadPoolExecutor(max_workers=min(32, cpu_count() * 4)) as executor:
+        pending = {executor.submit(_scan_folder, root, cache, scanned, now)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files_size, subfolders = future.result()
+                total_size += files_size
+                for subfolder in subfolders:
+                    pending.add(executor.submit(_scan_folder, subfolder, cache, scanned, now))
+
+    if use_cache:
+        # only folders seen in this run are kept, removed subtrees drop out of the cache
+        _save_json_cache(cache_path, scanned)
     return total_size
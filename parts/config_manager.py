@@ -2,7 +2,6 @@ from pathlib import Path
 import os
 import configparser
 import json
-import shutil
 
 class SinaraGlobalConfigManager():
     def __init__(self, ensure_folders=False):
@@ -10,6 +9,9 @@ class SinaraGlobalConfigManager():
         self.servers_folder = Path(self.config_folder) /  "servers"
         self.trash_bin_folder = Path(self.config_folder) / "trash_bin"
         self.trashed_servers_folder = Path(self.trash_bin_folder) / "servers"
+        self.purge_status_folder = Path(self.trash_bin_folder) / "purge"
+        self.cache_folder = Path(self.config_folder) / "cache"
+        self.backups_folder = Path(self.config_folder) / "backups"
 
         if ensure_folders:
             self.ensure_config_folder()
@@ -64,6 +66,6 @@ class SinaraServerConfigManager(SinaraGlobalConfigManager):
         from datetime import datetime
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
         server_folder_trashed = Path(self.trashed_servers_folder) / f"{self.server_name}.{timestamp}"
-        shutil.copytree(self.server_folder, server_folder_trashed, dirs_exist_ok=False)
-        shutil.rmtree(self.server_folder)
+        # same filesystem as the servers folder, a rename is enough
+        os.rename(self.server_folder, server_folder_trashed)
         return Path(server_folder_trashed) / "server.json"
@@ -1,16 +1,24 @@
-import docker
-from docker import errors
 import tarfile
 import io
 from pathlib import Path
 import logging
-import tqdm
 from time import sleep
-import requests
 import json
+import re
 from urllib.parse import urlparse
 
+# docker sdk, tqdm and requests take most of the cli start time, they are imported on first use
+docker = None
+errors = None
+
+def import_docker():
+    global docker, errors
+    if docker is None:
+        import docker
+        from docker import errors
+
 def get_docker_client():
+    import_docker()
     retries = 3
     
     while retries:
@@ -32,16 +40,23 @@ def docker_volume_exists(volume_name):
         pass
     return False
 
-def ensure_docker_volume(volume_name, already_exists_msg):
+def ensure_docker_volume(volume_name, already_exists_msg, driver_opts=None):
     if not docker_volume_exists(volume_name):
-        docker_volume_create(volume_name)
+        docker_volume_create(volume_name, driver_opts)
     else:
         print(already_exists_msg)
 
 
-def docker_volume_create(volume_name):
+def docker_volume_create(volume_name, driver_opts=None):
+    client = get_docker_client()
+    client.volumes.create(name=volume_name, driver="local", driver_opts=driver_opts)
+
+def docker_get_volume_options(volume_name):
     client = get_docker_client()
-    client.volumes.create(name=volume_name)
+    try:
+        return client.volumes.get(volume_name).attrs.get("Options") or {}
+    except errors.NotFound:
+        return {}
 
 
 def docker_volume_remove(volume_name):
@@ -104,6 +119,24 @@ def docker_container_pause(container_name):
     container = client.containers.get(container_name)
     container.pause()
 
+def docker_container_unpause(container_name):
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    container.unpause()
+
+def docker_container_paused(container_name):
+    client = get_docker_client()
+    if docker_container_exists(container_name):
+        container = client.containers.get(container_name)
+        if container.status.lower() == "paused":
+            return True
+    return False
+
+def docker_container_rename(container_name, new_name):
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    container.rename(new_name)
+
 def docker_container_remove(container_name):
     try:
         client = get_docker_client()
@@ -112,6 +145,12 @@ def docker_container_remove(container_name):
     except errors.NotFound as e:
         logging.debug(e)
     
+def docker_container_commit(container_name, repository, tag, message=None):
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    # mounted volumes and host folders are not part of the container layer
+    return container.commit(repository=repository, tag=tag, message=message)
+
 def docker_container_exec(container_name, command):
     client = get_docker_client()
     container = client.containers.get(container_name)
@@ -147,19 +186,57 @@ def docker_copy_from_container(container_name, src_path, dest_path):
                 tar_file.extract(member, dest_path)
     Path.unlink(archive_file_path)
 
-def docker_build_image(**kwargs):
+def docker_get_archive(container_name, src_path):
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    stream, stat = container.get_archive(src_path)
+    return stream
+
+def docker_read_file(container_name, file_path):
+    # content of a single file in a container, None if it doesn't exist
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    try:
+        stream, stat = container.get_archive(file_path)
+    except errors.NotFound:
+        return None
+    with tarfile.open(fileobj=io.BytesIO(b"".join(stream)), mode="r") as tar:
+        member = tar.next()
+        return tar.extractfile(member).read() if member and member.isreg() else None
+
+def docker_put_archive(container_name, dest_path, data):
+    # data may be a generator, it is sent with chunked transfer encoding
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    return container.put_archive(dest_path, data)
+
+def docker_build_image(log_prefix=None, **kwargs):
     if "decode" not in kwargs:
         kwargs_with_logging = dict(kwargs, decode=True)
     else:
         kwargs_with_logging = dict(kwargs)
     client = get_docker_client()
+    build_error = None
     for data in client.api.build(**kwargs_with_logging):
         if "stream" in data:
-            print(data["stream"])
+            if log_prefix is None:
+                print(data["stream"])
+            else:
+                # lines of concurrent builds are told apart by the prefix
+                for line in data["stream"].splitlines():
+                    if line.strip():
+                        print(f"{log_prefix}{line}")
+        if "error" in data:
+            build_error = data["error"]
+            print(build_error)
+    return build_error
     
-def docker_pull_image(image):
+def docker_pull_image(image, progress_position=None):
+    import tqdm
     client = get_docker_client()
-    with tqdm.tqdm(unit=" b") as progress_bar:
+    # named progress bars at fixed positions when several images are pulled at once
+    progress_desc = image if progress_position is not None else None
+    with tqdm.tqdm(unit=" b", desc=progress_desc, position=progress_position) as progress_bar:
         layers = {}
         try:
             for data in client.api.pull(image, stream=True, decode=True):
@@ -211,6 +288,8 @@ def doker_pull_image_alt(image):
                 client.api.load_image(f, False)
 
 def _download_image(url, filepath):
+    import requests
+    import tqdm
     print(f"Downloading {url}")
     # Streaming, so we can iterate over the response.
     response = requests.get(url, stream=True)
@@ -242,6 +321,7 @@ def docker_get_container_labels(container_name):
     return container.labels
     
 def docker_get_latest_image_version(image_name, repo_name="buslovaev"):
+    import requests
     registry_host = "hub.docker.com"
     next_url = f"/v2/repositories/{repo_name}/{image_name}/tags?page=1&page_size=50"
     # fallback to latest version if no version tag is found in repo
@@ -293,6 +373,18 @@ def docker_get_container_mounts(container_name):
     container = client.containers.get(container_name)
     return client.api.inspect_container(container.id)['Mounts']
 
+def docker_get_mapped_host_ports():
+    # host ports of all containers, created but not started ones included
+    client = get_docker_client()
+    ports = set()
+    for container in client.containers.list(all=True, ignore_removed=True):
+        port_bindings = container.attrs.get("HostConfig", {}).get("PortBindings") or {}
+        for bindings in port_bindings.values():
+            for binding in bindings or []:
+                if binding.get("HostPort"):
+                    ports.add(int(binding["HostPort"]))
+    return ports
+
 def docker_list_containers(label_key, sparse_output=True):
     client = get_docker_client()
     return client.containers.list(all=True, ignore_removed=True, sparse=sparse_output, filters={"label": label_key})
@@ -301,6 +393,15 @@ def docker_list_volumes():
     client = get_docker_client()
     return client.df()["Volumes"]
 
+def docker_list_volumes_without_size():
+    client = get_docker_client()
+    return client.api.volumes()["Volumes"] or []
+
+def docker_get_image_top_layer_size(image_name):
+    client = get_docker_client()
+    history = client.api.history(image_name)
+    return history[0]["Size"] if history else 0
+
 def docker_image_exists(image_name):
     client = get_docker_client()
     try:
@@ -308,3 +409,90 @@ def docker_image_exists(image_name):
     except errors.ImageNotFound:
         return False
     return True
+
+def docker_inspect_container(container_name):
+    client = get_docker_client()
+    return client.api.inspect_container(container_name)
+
+def docker_container_stats(container_name, stream=True):
+    client = get_docker_client()
+    container = client.containers.get(container_name)
+    return client.api.stats(container.id, stream=stream, decode=True)
+
+def _parse_image_reference(image):
+    registry = "registry-1.docker.io"
+    repository = image
+    tag = "latest"
+    parts = image.split("/")
+    if len(parts) > 1 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+        registry = parts[0]
+        repository = "/".join(parts[1:])
+    if "@" in repository:
+        repository, tag = repository.split("@", 1)
+    elif ":" in repository.split("/")[-1]:
+        repository, tag = repository.rsplit(":", 1)
+    if registry == "registry-1.docker.io" and "/" not in repository:
+        repository = f"library/{repository}"
+    return registry, repository, tag
+
+def _get_registry_token(auth_header, repository):
+    import requests
+    # Bearer realm="https://auth.docker.io/token",service="registry.docker.io",scope="repository:x:pull"
+    auth_params = dict(re.findall(r'(\w+)="([^"]*)"', auth_header))
+    if "realm" not in auth_params:
+        return None
+    params = {"scope": auth_params.get("scope", f"repository:{repository}:pull")}
+    if "service" in auth_params:
+        params["service"] = auth_params["service"]
+    response = requests.get(auth_params["realm"], params=params, timeout=30)
+    response.raise_for_status()
+    token_data = response.json()
+    return token_data.get("token") or token_data.get("access_token")
+
+def docker_get_registry_manifest_digest(image):
+    import requests
+    registry, repository, tag = _parse_image_reference(image)
+    manifest_url = f"https://{registry}/v2/{repository}/manifests/{tag}"
+    headers = {
+        "Accept": ", ".join([
+            "application/vnd.oci.image.index.v1+json",
+            "application/vnd.docker.distribution.manifest.list.v2+json",
+            "application/vnd.docker.distribution.manifest.v2+json",
+            "application/vnd.oci.image.manifest.v1+json"
+        ])
+    }
+    try:
+        response = requests.head(manifest_url, headers=headers, timeout=30)
+        if response.status_code == 401 and "WWW-Authenticate" in response.headers:
+            token = _get_registry_token(response.headers["WWW-Authenticate"], repository)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+                response = requests.head(manifest_url, headers=headers, timeout=30)
+        if response.status_code >= 400:
+            raise Exception(f"Bad status {response.status_code} response from {registry}")
+        return response.headers.get("Docker-Content-Digest")
+    except Exception as e:
+        logging.debug(e)
+        logging.warning(f"Cannot get manifest digest for {image}")
+    return None
+
+def docker_get_image_repo_digests(image_name):
+    client = get_docker_client()
+    try:
+        image = client.images.get(image_name)
+    except errors.ImageNotFound:
+        return []
+    return [digest.split("@")[-1] for digest in image.attrs.get("RepoDigests", [])]
+
+def docker_image_tag(image_name, repository, tag):
+    client = get_docker_client()
+    image = client.images.get(image_name)
+    return image.tag(repository, tag=tag)
+
+def docker_get_image_labels(image_name):
+    client = get_docker_client()
+    try:
+        image = client.images.get(image_name)
+    except errors.ImageNotFound:
+        return {}
+    return image.labels or {}
@@ -1,10 +1,10 @@
 from pathlib import Path
 import shutil
-import zipfile
-import tempfile
-from docker import types
-import glob
-import requests
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tabulate import tabulate
 from time import sleep
 from .docker_utils import docker_container_create, \
                           docker_container_exists, \
@@ -16,13 +16,20 @@ from .docker_utils import docker_container_create, \
                           docker_build_image, \
                           docker_list_containers, \
                           docker_image_exists, \
-                          docker_get_latest_image_version
-
-from .common_utils import compute_md5, \
-                          get_expanded_path, \
-                          replace_bentoservice_model_server_image, \
+                          docker_get_latest_image_version, \
+                          docker_get_registry_manifest_digest, \
+                          docker_get_image_repo_digests, \
+                          docker_get_image_labels
+
+from .common_utils import get_expanded_path, \
+                          get_system_cpu_count, \
+                          get_system_memory_size, \
+                          fc, \
+                          get_dockerfile_with_model_server_image, \
                           get_bentoservice_profile_name, \
-                          remove_bentoservice_deps_install
+                          get_dockerfile_without_deps_install
+from .model_context import SinaraModelContext
+from .model_cache import SinaraModelCache
 
 bentoservice_profiles_supported = {
     'SinaraOnnxBentoService': 'onnx',
@@ -36,6 +43,9 @@ class SinaraModel():
     server_container_name = 'personal_public_desktop'
     model_container_name = 'sinara-model'
     dockerhub_registry_api_base = "https://registry.hub.docker.com/v2/repositories/"
+    fingerprint_label = "sinaraml.model.fingerprint"
+    # memory reserved for one concurrent model image build
+    build_memory_size = 2 * 1024 * 1024 * 1024
 
     @staticmethod
     def add_command_handlers(root_parser, subject_parser):
@@ -49,8 +59,12 @@ class SinaraModel():
     def add_containerize_handler(root_parser):
         model_containerize_parser = root_parser.add_parser('containerize', help='containerize sinara bento service into a docker image')
         model_containerize_parser.add_argument('--instanceName', default=SinaraModel.server_container_name, help='Custom model container name to start (default: %(default)s)')
-        model_containerize_parser.add_argument('--bentoservicePath', help='Path to bentoservice inside sinara server')
+        model_containerize_parser.add_argument('--bentoservicePath', nargs='+', help='Paths to bentoservices inside sinara server')
+        model_containerize_parser.add_argument('--manifest', help='Path to json file with bentoservices to containerize')
         model_containerize_parser.add_argument('--dockerRegistry', help='Docker registry url of a model image')
+        model_containerize_parser.add_argument('--fastDigest', action='store_true', help='Also save blake2b checksums of artifacts next to md5 ones')
+        model_containerize_parser.add_argument('--forceBuild', action='store_true', help='Build model image even if an image with the same inputs exists')
+        model_containerize_parser.add_argument('--buildJobs', type=int, help='Number of model images built at once (default: by host cpu count and memory)')
         model_containerize_parser.set_defaults(func=SinaraModel.containerize)
 
     @staticmethod
@@ -60,33 +74,9 @@ class SinaraModel():
         model_extract_artifacts_parser.add_argument('--extractTo', help='Folder on host, were to place extracted artifacts')
         model_extract_artifacts_parser.set_defaults(func=SinaraModel.extract_artifacts)
 
-    @staticmethod
-    def save_extra_info(bentoservice_dir, image_tag):
-        file_paths = glob.glob(f'{bentoservice_dir}/*/artifacts/*')
-        if len(file_paths) > 0:
-            first_artifact_path = Path(file_paths[0])
-            bento_service_class = first_artifact_path.parts[-3]
-            bentoservice_artifacts_dir = Path(bentoservice_dir) / bento_service_class / 'artifacts'
-            checksum_dir = bentoservice_artifacts_dir / 'checksum'
-            artifacts_list_path = checksum_dir / 'artifacts_list.txt'
-            checksum_dir.mkdir(parents=True, exist_ok=True)
-
-            artifacts_list_path.touch(exist_ok=True)
-            with artifacts_list_path.open(mode='w') as artifacts_list_file:
-                for file_path in file_paths:
-                    file_p = Path(file_path)
-                    artifacts_list_file.write(f'{file_p.stem}\n')
-                    md5_path = bentoservice_artifacts_dir / 'checksum' / f'{file_p.stem}.md5'
-                    with md5_path.open(mode='w') as md5_file:
-                        md5_file.write(compute_md5(file_path))
-
-        docker_image_info_path = bentoservice_artifacts_dir / 'checksum' / 'docker_image_info.txt'
-        docker_image_info_path.touch(exist_ok=True)
-        with docker_image_info_path.open(mode='w') as docker_image_info_file:
-            docker_image_info_file.write(image_tag)
-
     @staticmethod
     def get_image_tags_from_dockerhub(image_name):
+        import requests
         http_exception = None
         req = None
         image_list_url = f"{SinaraModel.dockerhub_registry_api_base}/{image_name}/tags"
@@ -131,11 +121,6 @@ class SinaraModel():
     def get_run_id_from_path(_path):
         return Path(_path).parts[-2]
     
-    @staticmethod
-    def get_bentoserice_cache_dir(bentoservice_name):
-        tmp_dir = tempfile.gettempdir()
-        return Path(tmp_dir) / Path(bentoservice_name).parts[-1]
-    
     @staticmethod
     def get_model_name(save_info_path):
         with open(save_info_path, 'r') as save_info_file:
@@ -176,65 +161,183 @@ class SinaraModel():
         return f"{platform_image_name}:{versioned_tag}"
         
     @staticmethod
-    def containerize(args):
-        sinara_containers = docker_list_containers("sinaraml.platform")
-        for sinara_container in sinara_containers:
-            container_name = sinara_container.attrs["Names"][0][1:]
-            if container_name == 'jovyan-single-use' and args.instanceName == 'personal_public_desktop':
-                args.instanceName = container_name
-
-        args_dict = vars(args)
-        if not args.bentoservicePath:
-            while not args.bentoservicePath:
-                args_dict['bentoservicePath'] = get_expanded_path( input("Please, enter ENTITY_PATH for your bentoservice: ") )
-
-        model_image_tag = SinaraModel.get_run_id_from_path(args.bentoservicePath)
+    def reuse_model_image(model_image_name_full, fingerprint):
+        if docker_get_image_labels(model_image_name_full).get(SinaraModel.fingerprint_label) == fingerprint:
+            print(f"Model image {model_image_name_full} is up to date, build skipped")
+            return "up to date"
+        return None
 
-        if not args.dockerRegistry:
-            while not args.dockerRegistry:
-                args_dict['dockerRegistry'] = input("Please, enter Docker registry address for your model image: ")
+    @staticmethod
+    def get_build_jobs():
+        # docker builds of model images are bound by cpu and by memory of pip and conda installs
+        by_memory = get_system_memory_size() // SinaraModel.build_memory_size
+        return max(1, min(get_system_cpu_count() // 2, by_memory))
 
-        bentoservice_cache_dir = SinaraModel.get_bentoserice_cache_dir(args.bentoservicePath)
+    @staticmethod
+    def load_bentoservices_manifest(manifest_path):
+        # {"dockerRegistry": "...", "bentoservices": ["<path>", {"bentoservicePath": "<path>", "dockerRegistry": "..."}]}
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        bentoservices = []
+        for bentoservice in manifest.get("bentoservices", []):
+            if isinstance(bentoservice, str):
+                bentoservice = {"bentoservicePath": bentoservice}
+            if not bentoservice.get("bentoservicePath"):
+                raise Exception(f"Each bentoservice in manifest {manifest_path} must have bentoservicePath")
+            bentoservices.append((bentoservice["bentoservicePath"], bentoservice.get("dockerRegistry") or manifest.get("dockerRegistry")))
+        return bentoservices
 
-        if bentoservice_cache_dir.exists():
-            shutil.rmtree(bentoservice_cache_dir)
-        bentoservice_cache_dir.mkdir(parents=True, exist_ok=True)
-        docker_copy_from_container(args.instanceName, src_path=args.bentoservicePath, dest_path=bentoservice_cache_dir)
-        model_zip_path = bentoservice_cache_dir / "model.zip"
-        success_file_path = bentoservice_cache_dir / "_SUCCESS"
+    @staticmethod
+    def prepare_model_image(job, instance_name, sinara_container, fast_digest, force_build):
+        start_time = time.time()
+        # unchanged bentoservices are taken from the cache, changed ones reuse their unchanged artifacts
+        bentoservice_cache_dir = SinaraModelCache.get_entry(instance_name, job["bentoservicePath"])
+        job["cache_dir"] = bentoservice_cache_dir
+        job["timings"]["fetch"] = time.time() - start_time
+
+        start_time = time.time()
         save_info_path = bentoservice_cache_dir / "save_info.txt"
-        bentoservice_dockerfile_path = bentoservice_cache_dir / "Dockerfile"
-
-        with zipfile.ZipFile(model_zip_path, 'r') as model_zip:
-            model_zip.extractall(path=bentoservice_cache_dir)
-
-        Path(model_zip_path).unlink(missing_ok=True)
-        Path(success_file_path).unlink(missing_ok=True)
+        context_entries = SinaraModelContext.get_context_entries(bentoservice_cache_dir)
 
         model_image_name = SinaraModel.get_model_name(save_info_path)
-        model_image_name_full = f"{args.dockerRegistry}/{model_image_name}:{model_image_tag}"
-        SinaraModel.save_extra_info(bentoservice_cache_dir, model_image_name_full)
-        
+        model_image_tag = SinaraModel.get_run_id_from_path(job["bentoservicePath"])
+        model_image_name_full = f"{job['dockerRegistry']}/{model_image_name}:{model_image_tag}"
+        job["image"] = model_image_name_full
+        dockerfile_content = SinaraModelContext.read_entry(context_entries, "Dockerfile").decode("utf-8").splitlines(keepends=True)
+
         bentoservice_profile = get_bentoservice_profile_name(bentoservice_cache_dir)
         if bentoservice_profile:
             if bentoservice_profile not in bentoservice_profiles_supported.keys():
                 raise Exception(f'Unsupported bentoservice profile "{bentoservice_profile}" in bentoservice found. Supported: {", ".join(bentoservice_profiles_supported.keys())}')
             print(f'Using bentoservice profile: {bentoservice_profile}')
             if bentoservice_profile == 'SinaraOnnxBentoService':
-                remove_bentoservice_deps_install(bentoservice_dockerfile_path)
-        
+                dockerfile_content = get_dockerfile_without_deps_install(dockerfile_content)
+
         model_image_base = SinaraModel.get_model_image_base(save_info_path, sinara_container, bentoservice_profile)
-        replace_bentoservice_model_server_image(bentoservice_dockerfile_path, model_image_base)
-                
-        print(f"Building model image {model_image_name_full}")
-        docker_build_image(path=str(bentoservice_cache_dir), tag=model_image_name_full, pull=True, forcerm=True, rm=True, quiet=False)
-        if docker_image_exists(model_image_name_full):
-            print(f"Model image {model_image_name_full} built successfully")
+        dockerfile_content = get_dockerfile_with_model_server_image(dockerfile_content, model_image_base)
+        SinaraModelContext.set_entry_data(context_entries, "Dockerfile", "".join(dockerfile_content).encode("utf-8"))
+
+        # md5 is what model server images check, blake2b is an optional faster digest next to it;
+        # artifacts hashed by earlier builds are known, the others are hashed while the context is sent
+        algorithms = ("md5", "blake2b") if fast_digest else ("md5",)
+        file_names = [name for name, entry in context_entries.items() if "data" not in entry]
+        job["artifacts_digests"] = SinaraModelCache.get_files_digests(bentoservice_cache_dir, file_names, algorithms, cached_only=True)
+        job["cached_digests"] = set(job["artifacts_digests"])
+
+        # the build is skipped when an image with the same inputs and the same base image digest exists
+        base_image_digest = docker_get_registry_manifest_digest(model_image_base)
+        fingerprint = None
+        if base_image_digest:
+            content_digests = SinaraModelCache.get_content_digests(bentoservice_cache_dir, file_names)
+            fingerprint = SinaraModelContext.get_fingerprint(context_entries, content_digests, model_image_name_full, base_image_digest, algorithms)
+            if not force_build:
+                job["status"] = SinaraModel.reuse_model_image(model_image_name_full, fingerprint)
+        if job["status"]:
+            job["timings"]["prepare"] = time.time() - start_time
+            return
+
+        job["build_args"] = {
+            "fileobj": SinaraModelContext.generate_context_tar(context_entries, model_image_name_full, algorithms, job["artifacts_digests"]),
+            "custom_context": True,
+            "tag": model_image_name_full,
+            "labels": {SinaraModel.fingerprint_label: fingerprint} if fingerprint else None,
+            "pull": not base_image_digest or base_image_digest not in docker_get_image_repo_digests(model_image_base),
+            "forcerm": True,
+            "rm": True,
+            "quiet": False
+        }
+        job["timings"]["prepare"] = time.time() - start_time
+
+    @staticmethod
+    def build_model_image(job, log_prefix=None):
+        start_time = time.time()
+        print(f"Building model image {job['image']}")
+        job["details"] = docker_build_image(log_prefix=log_prefix, **job["build_args"])
+        job["timings"]["build"] = time.time() - start_time
+        hashed_digests = {name: digests for name, digests in job["artifacts_digests"].items() if name not in job["cached_digests"]}
+        if hashed_digests:
+            SinaraModelCache.save_files_digests(job["cache_dir"], hashed_digests)
+        if docker_image_exists(job["image"]):
+            job["status"] = "built"
+            print(f"Model image {job['image']} built successfully")
         else:
-            print(f"Failed to build model image {model_image_name_full}")
+            job["status"] = "failed"
+            print(f"Failed to build model image {job['image']}")
+
+    @staticmethod
+    def print_containerize_summary(jobs):
+        rows = []
+        for job in jobs:
+            status = job["status"]
+            if status == "failed":
+                status = f"{fc.RED}{status}{fc.RESET}"
+            timings = [job["timings"].get(stage) for stage in ["fetch", "prepare", "build"]]
+            rows.append([job["bentoservicePath"], job.get("image") or "", status] +
+                        ["" if t is None else f"{round(t, 1)}s" for t in timings] +
+                        [f"{round(sum([t for t in timings if t]), 1)}s", (job.get("details") or "").strip()])
+        print(tabulate(rows, ["bentoservice", "image", "status", "fetch", "prepare", "build", "total", "details"]))
+
+    @staticmethod
+    def containerize(args):
+        sinara_containers = docker_list_containers("sinaraml.platform")
+        for sinara_container in sinara_containers:
+            container_name = sinara_container.attrs["Names"][0][1:]
+            if container_name == 'jovyan-single-use' and args.instanceName == 'personal_public_desktop':
+                args.instanceName = container_name
+
+        bentoservices = [(bentoservice_path, None) for bentoservice_path in args.bentoservicePath or []]
+        if args.manifest:
+            bentoservices.extend(SinaraModel.load_bentoservices_manifest(args.manifest))
+        while not bentoservices:
+            bentoservice_path = get_expanded_path( input("Please, enter ENTITY_PATH for your bentoservice: ") )
+            if bentoservice_path:
+                bentoservices.append((bentoservice_path, None))
+
+        args_dict = vars(args)
+        if not args.dockerRegistry and not all([docker_registry for bentoservice_path, docker_registry in bentoservices]):
+            while not args.dockerRegistry:
+                args_dict['dockerRegistry'] = input("Please, enter Docker registry address for your model image: ")
+
+        jobs = []
+        for bentoservice_path, docker_registry in bentoservices:
+            if bentoservice_path not in [job["bentoservicePath"] for job in jobs]:
+                jobs.append({"bentoservicePath": bentoservice_path, "dockerRegistry": docker_registry or args.dockerRegistry,
+                             "status": None, "timings": {}})
+
+        # bentoservices are fetched, unpacked and hashed concurrently, prepared ones wait for one of the build slots,
+        # the prepare pool is twice the build slots, so at most that many prepared builds are queued
+        build_jobs = args.buildJobs or SinaraModel.get_build_jobs()
+        build_slots = threading.Semaphore(build_jobs)
+        batch_mode = len(jobs) > 1
+
+        def containerize_job(job):
+            try:
+                SinaraModel.prepare_model_image(job, args.instanceName, sinara_container, args.fastDigest, args.forceBuild)
+                if not job["status"]:
+                    with build_slots:
+                        log_prefix = f"[{job['image']}] " if batch_mode else None
+                        SinaraModel.build_model_image(job, log_prefix)
+            except Exception as e:
+                if not batch_mode:
+                    raise
+                job["status"] = "failed"
+                job["details"] = str(e)
+                print(f"{fc.RED}Failed to containerize {job['bentoservicePath']}: {e}{fc.RESET}")
+            return job
+
+        if batch_mode:
+            print(f"Containerizing {len(jobs)} bentoservices with {build_jobs} concurrent builds")
+        with ThreadPoolExecutor(max_workers=min(len(jobs), build_jobs * 2)) as executor:
+            for future in [executor.submit(containerize_job, job) for job in jobs]:
+                future.result()
+
+        SinaraModelCache.evict(keep_entry_dirs=[job["cache_dir"] for job in jobs if job.get("cache_dir")])
+        if batch_mode:
+            SinaraModel.print_containerize_summary(jobs)
 
     @staticmethod
     def start(args):
+        from docker import types
         args_dict = vars(args)
         gpu_requests = []
         model_type = -1
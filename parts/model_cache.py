@@ -0,0 +1,236 @@
+import io
+import os
+import json
+import time
+import shutil
+import threading
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+from pathlib import Path
+
+from .docker_utils import docker_get_archive, docker_read_file
+from .common_utils import IterStreamReader, compute_files_digests, save_files_digests, convert_size
+from .config_manager import SinaraGlobalConfigManager
+
+class SinaraModelCacheException(Exception):
+    pass
+
+class SinaraModelCache:
+
+    # bentoservice cache layout:
+    #   objects/<sha256[:2]>/<sha256> - extracted model.zip members, named by the sha256 of their content
+    #   entries/<key>/ - bentoservice trees of hardlinks to objects, key is a hash of bentoservice path,
+    #                    _SUCCESS and save_info.txt, entry folder mtime is its last use
+    chunk_size = 4 * 1024 * 1024
+    manifest_name = ".sinara-manifest.json"
+    fingerprint_files = ["_SUCCESS", "save_info.txt"]
+    default_size_limit_gb = 20
+
+    @staticmethod
+    def get_cache_folder():
+        return Path(SinaraGlobalConfigManager().cache_folder) / "bentoservices"
+
+    @staticmethod
+    def get_size_limit():
+        org_json_path = Path(Path(__file__).parent.parent, "mlops_organization.json")
+        with open(org_json_path) as f:
+            org_json = json.load(f)
+        model_part = org_json["cli_bodies"][0].get("parts", {}).get("model", {})
+        return int(model_part.get("cache_size_limit_gb", SinaraModelCache.default_size_limit_gb) * 1024 * 1024 * 1024)
+
+    @staticmethod
+    def get_key(container_name, bentoservice_path):
+        fingerprint = hashlib.sha256(bentoservice_path.encode("utf-8"))
+        found = False
+        for file_name in SinaraModelCache.fingerprint_files:
+            content = docker_read_file(container_name, f"{bentoservice_path.rstrip('/')}/{file_name}")
+            found = found or content is not None
+            fingerprint.update(b"\0" + (content or b""))
+        # without _SUCCESS and save_info.txt there is nothing to tell bentoservice versions apart
+        if not found:
+            return None
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def get_object_path(cache_folder, object_id):
+        return cache_folder / "objects" / object_id[:2] / object_id
+
+    @staticmethod
+    def get_entry_path(entry_dir, name):
+        path = os.path.normpath(os.path.join(entry_dir, name))
+        if not path.startswith(os.path.join(str(entry_dir), "")):
+            raise SinaraModelCacheException(f"Invalid file name {name} in bentoservice")
+        return Path(path)
+
+    @staticmethod
+    def link_object(object_path, file_path):
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(object_path, file_path)
+        except OSError:
+            shutil.copyfile(object_path, file_path)
+
+    @staticmethod
+    def extract_object(cache_folder, model_zip, info):
+        # member is hashed while it is extracted, objects with the same content already in the cache are kept
+        tmp_path = cache_folder / "objects" / f"{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        content_hash = hashlib.sha256()
+        try:
+            with model_zip.open(info) as src, open(tmp_path, "wb") as dst:
+                while True:
+                    chunk = src.read(SinaraModelCache.chunk_size)
+                    if not chunk:
+                        break
+                    content_hash.update(chunk)
+                    dst.write(chunk)
+            object_path = SinaraModelCache.get_object_path(cache_folder, content_hash.hexdigest())
+            if object_path.exists():
+                return object_path, False
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, object_path)
+            return object_path, True
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def store_model_zip(cache_folder, model_zip_path, entry_dir, stats):
+        # members already in the cache from previous versions of the bentoservice are only linked
+        manifest = {}
+        with zipfile.ZipFile(model_zip_path, "r") as model_zip:
+            for info in model_zip.infolist():
+                if info.is_dir():
+                    continue
+                object_path, stored = SinaraModelCache.extract_object(cache_folder, model_zip, info)
+                if stored:
+                    stats["stored_files"] += 1
+                    stats["stored_bytes"] += info.file_size
+                else:
+                    stats["reused_files"] += 1
+                    stats["reused_bytes"] += info.file_size
+                file_path = SinaraModelCache.get_entry_path(entry_dir, info.filename)
+                # zip members replace bentoservice files with the same name as extracting the zip over them did
+                file_path.unlink(missing_ok=True)
+                SinaraModelCache.link_object(object_path, file_path)
+                manifest[info.filename] = str(object_path)
+        with open(Path(entry_dir) / SinaraModelCache.manifest_name, "w") as f:
+            json.dump(manifest, f)
+
+    @staticmethod
+    def add_entry(cache_folder, key, container_name, bentoservice_path):
+        entry_dir = cache_folder / "entries" / key
+        tmp_entry_dir = entry_dir.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+        tmp_entry_dir.mkdir(parents=True)
+        stats = {"reused_files": 0, "reused_bytes": 0, "stored_files": 0, "stored_bytes": 0}
+        model_zip_path = None
+        try:
+            # bentoservice files are written straight from the docker archive stream, model.zip is spooled
+            # next to the cache since zip members can only be read with random access
+            stream = docker_get_archive(container_name, bentoservice_path)
+            with tarfile.open(fileobj=io.BufferedReader(IterStreamReader(stream), buffer_size=SinaraModelCache.chunk_size), mode="r|") as tar:
+                for member in tar:
+                    # docker archives start with the basename of the copied folder, it is the entry folder itself
+                    parts = member.name.split("/", 1)
+                    if not member.isreg() or len(parts) == 1:
+                        continue
+                    if parts[1] == "model.zip":
+                        fd, model_zip_path = tempfile.mkstemp(suffix=".zip", dir=cache_folder)
+                        dst = os.fdopen(fd, "wb")
+                    else:
+                        file_path = SinaraModelCache.get_entry_path(tmp_entry_dir, parts[1])
+                        file_path.parent.mkdir(parents=True, exist_ok=True)
+                        dst = open(file_path, "wb")
+                    with tar.extractfile(member) as src, dst:
+                        shutil.copyfileobj(src, dst, SinaraModelCache.chunk_size)
+            if not model_zip_path:
+                raise SinaraModelCacheException(f"model.zip is not found in {bentoservice_path}")
+            SinaraModelCache.store_model_zip(cache_folder, model_zip_path, tmp_entry_dir, stats)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(tmp_entry_dir, entry_dir)
+        finally:
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+            if model_zip_path:
+                Path(model_zip_path).unlink(missing_ok=True)
+        return entry_dir, stats
+
+    @staticmethod
+    def get_entry(container_name, bentoservice_path):
+        cache_folder = SinaraModelCache.get_cache_folder()
+        cache_folder.mkdir(parents=True, exist_ok=True)
+        key = SinaraModelCache.get_key(container_name, bentoservice_path)
+        entry_dir = cache_folder / "entries" / key if key else None
+        if entry_dir and entry_dir.exists():
+            os.utime(entry_dir)
+            print(f"Using cached bentoservice {bentoservice_path}")
+            return entry_dir
+        if not key:
+            key = hashlib.sha256(f"{bentoservice_path}\0{time.time()}".encode("utf-8")).hexdigest()
+        entry_dir, stats = SinaraModelCache.add_entry(cache_folder, key, container_name, bentoservice_path)
+        print(f"Cached bentoservice {bentoservice_path}: {stats['stored_files']} new files stored ({convert_size(stats['stored_bytes'])}), " \
+              f"{stats['reused_files']} unchanged files reused ({convert_size(stats['reused_bytes'])})")
+        return entry_dir
+
+    @staticmethod
+    def load_manifest(entry_dir):
+        with open(Path(entry_dir) / SinaraModelCache.manifest_name, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def get_object_paths(entry_dir, names):
+        manifest = SinaraModelCache.load_manifest(entry_dir)
+        return {name: manifest.get(name, str(Path(entry_dir) / name)) for name in names}
+
+    @staticmethod
+    def get_files_digests(entry_dir, names, algorithms, cached_only=False):
+        # digests are computed for object paths, so the persistent digest cache also hits for other entries linking them
+        object_paths = SinaraModelCache.get_object_paths(entry_dir, names)
+        digests = compute_files_digests(list(object_paths.values()), algorithms, cached_only=cached_only)
+        return {name: digests[object_path] for name, object_path in object_paths.items() if object_path in digests}
+
+    @staticmethod
+    def save_files_digests(entry_dir, files_digests):
+        object_paths = SinaraModelCache.get_object_paths(entry_dir, files_digests.keys())
+        save_files_digests({object_paths[name]: digests for name, digests in files_digests.items()})
+
+    @staticmethod
+    def get_content_digests(entry_dir, names):
+        # model.zip members are named by the sha256 of their content, so only the other bentoservice files,
+        # which are small, are hashed here
+        manifest = SinaraModelCache.load_manifest(entry_dir)
+        other_names = [name for name in names if name not in manifest]
+        other_digests = SinaraModelCache.get_files_digests(entry_dir, other_names, ("md5",))
+        return {name: f"sha256:{Path(manifest[name]).name}" if name in manifest else f"md5:{other_digests[name]['md5']}"
+                for name in names}
+
+    @staticmethod
+    def get_cache_size(cache_folder):
+        # hardlinked files are counted once
+        inodes = {}
+        for root, dirs, files in os.walk(cache_folder):
+            for file_name in files:
+                st = os.lstat(os.path.join(root, file_name))
+                inodes[(st.st_dev, st.st_ino)] = st.st_size
+        return sum(inodes.values())
+
+    @staticmethod
+    def remove_unused_objects(cache_folder):
+        for object_path in (cache_folder / "objects").glob("*/*"):
+            if object_path.stat().st_nlink == 1 and not object_path.name.endswith(".tmp"):
+                object_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def evict(keep_entry_dirs=None):
+        # least recently used entries are removed until the cache fits its size limit
+        cache_folder = SinaraModelCache.get_cache_folder()
+        size_limit = SinaraModelCache.get_size_limit()
+        entries = sorted([p for p in (cache_folder / "entries").glob("*") if p.is_dir() and not p.name.endswith(".tmp") and p not in (keep_entry_dirs or [])],
+                         key=lambda p: p.stat().st_mtime)
+        cache_size = SinaraModelCache.get_cache_size(cache_folder)
+        while cache_size > size_limit and entries:
+            entry_dir = entries.pop(0)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            SinaraModelCache.remove_unused_objects(cache_folder)
+            cache_size = SinaraModelCache.get_cache_size(cache_folder)
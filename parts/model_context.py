@@ -0,0 +1,156 @@
+import io
+import os
+import time
+import hashlib
+import tarfile
+from pathlib import Path
+
+class SinaraModelContextException(Exception):
+    pass
+
+class SinaraModelContext:
+
+    chunk_size = 4 * 1024 * 1024
+    # files of the bentoservice folder which are not a part of the model image
+    skipped_files = ["model.zip", "_SUCCESS", ".sinara-manifest.json"]
+    file_mode = 0o644
+    folder_mode = 0o755
+
+    @staticmethod
+    def get_context_entries(bentoservice_dir):
+        # entries: {name in context: {"size", "mtime", "open"}}
+        entries = {}
+        for root, dirs, files in os.walk(bentoservice_dir):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                name = Path(os.path.relpath(file_path, bentoservice_dir)).as_posix()
+                if name in SinaraModelContext.skipped_files:
+                    continue
+                st = os.stat(file_path)
+                entries[name] = {"size": st.st_size, "mtime": int(st.st_mtime),
+                                 "open": lambda file_path=file_path: open(file_path, "rb")}
+        return entries
+
+    @staticmethod
+    def set_entry_data(entries, name, data):
+        entries[name] = {"size": len(data), "mtime": int(time.time()), "data": data,
+                         "open": lambda: io.BytesIO(data)}
+
+    @staticmethod
+    def read_entry(entries, name):
+        if name not in entries:
+            raise SinaraModelContextException(f"{name} is not found in bentoservice")
+        with entries[name]["open"]() as f:
+            return f.read()
+
+    @staticmethod
+    def get_excluded_entries(entries):
+        # .dockerignore is applied here as docker_build_image does it for a folder context
+        from docker.utils.build import PatternMatcher
+        if ".dockerignore" not in entries:
+            return []
+        lines = SinaraModelContext.read_entry(entries, ".dockerignore").decode("utf-8").splitlines()
+        patterns = [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+        patterns.append("!Dockerfile")
+        pm = PatternMatcher(patterns)
+        return [name for name in entries if pm.matches(name)]
+
+    @staticmethod
+    def get_artifacts(names):
+        # artifacts are files of <bentoservice class>/artifacts, checksums are saved for them
+        artifacts = sorted([name for name in names if len(name.split("/")) == 3 and name.split("/")[1] == "artifacts"])
+        if not artifacts:
+            return None, []
+        bento_service_class = artifacts[0].split("/")[0]
+        return bento_service_class, [name for name in artifacts if name.startswith(f"{bento_service_class}/")]
+
+    @staticmethod
+    def get_fingerprint(entries, content_digests, image_tag, base_image_digest, algorithms):
+        # everything a model image is built from: context files, the image tag and checksums written into it
+        # and the base image, equal fingerprints mean equal images; the tag is a part of the image content
+        # through docker_image_info.txt, so images are only reused under their own name
+        fingerprint = hashlib.sha256(f"{image_tag}\0{base_image_digest}\0{','.join(algorithms)}\n".encode("utf-8"))
+        excluded = set(SinaraModelContext.get_excluded_entries(entries))
+        for name in sorted(entries):
+            if name in excluded:
+                continue
+            entry = entries[name]
+            digest = f"md5:{hashlib.md5(entry['data']).hexdigest()}" if "data" in entry else content_digests[name]
+            fingerprint.update(f"{name}\0{entry['size']}\0{digest}\n".encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def get_tar_header(name, size, mtime, is_dir=False):
+        info = tarfile.TarInfo(name)
+        info.mtime = mtime
+        if is_dir:
+            info.type = tarfile.DIRTYPE
+            info.mode = SinaraModelContext.folder_mode
+        else:
+            info.size = size
+            info.mode = SinaraModelContext.file_mode
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    @staticmethod
+    def generate_entry(name, entry, folders, hashes=None):
+        parent = Path(name).parent
+        for folder in reversed([parent] + list(parent.parents)):
+            folder_name = folder.as_posix()
+            if folder_name != "." and folder_name not in folders:
+                folders.add(folder_name)
+                yield SinaraModelContext.get_tar_header(folder_name, 0, entry["mtime"], is_dir=True)
+        yield SinaraModelContext.get_tar_header(name, entry["size"], entry["mtime"])
+        sent = 0
+        with entry["open"]() as f:
+            while sent < entry["size"]:
+                chunk = f.read(min(SinaraModelContext.chunk_size, entry["size"] - sent))
+                if not chunk:
+                    break
+                for h in hashes or []:
+                    h.update(chunk)
+                yield chunk
+                sent += len(chunk)
+        if sent != entry["size"]:
+            raise SinaraModelContextException(f"{name} changed while sending build context")
+        padding = -sent % tarfile.BLOCKSIZE
+        if padding:
+            yield tarfile.NUL * padding
+
+    @staticmethod
+    def generate_context_tar(entries, image_tag, algorithms=("md5",), artifacts_digests=None):
+        # build context tar is sent to docker as it is generated, artifacts without known digests
+        # are hashed on the way and checksum files are appended after them, their digests are added
+        # to artifacts_digests
+        excluded = set(SinaraModelContext.get_excluded_entries(entries))
+        bento_service_class, artifacts = SinaraModelContext.get_artifacts([name for name in entries if name not in excluded])
+        checksum_dir = f"{bento_service_class}/artifacts/checksum"
+        if bento_service_class:
+            excluded.update([f"{checksum_dir}/artifacts_list.txt", f"{checksum_dir}/docker_image_info.txt"])
+            excluded.update([f"{checksum_dir}/{Path(name).stem}.{algorithm}" for name in artifacts for algorithm in algorithms])
+
+        folders = set()
+        if artifacts_digests is None:
+            artifacts_digests = {}
+        artifacts_hashes = {}
+        for name, entry in entries.items():
+            if name in excluded:
+                continue
+            hashes = None
+            if name in artifacts and name not in artifacts_digests:
+                hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+                artifacts_hashes[name] = hashes
+            yield from SinaraModelContext.generate_entry(name, entry, folders, hashes)
+        for name, hashes in artifacts_hashes.items():
+            artifacts_digests[name] = {algorithm: h.hexdigest() for algorithm, h in zip(algorithms, hashes)}
+
+        if bento_service_class:
+            checksum_files = {f"{checksum_dir}/artifacts_list.txt": "".join([f"{Path(name).stem}\n" for name in artifacts])}
+            for name in artifacts:
+                for algorithm in algorithms:
+                    checksum_files[f"{checksum_dir}/{Path(name).stem}.{algorithm}"] = artifacts_digests[name][algorithm]
+            checksum_files[f"{checksum_dir}/docker_image_info.txt"] = image_tag
+            for name, content in checksum_files.items():
+                data = content.encode("utf-8")
+                entry = {"size": len(data), "mtime": int(time.time()), "open": lambda data=data: io.BytesIO(data)}
+                yield from SinaraModelContext.generate_entry(name, entry, folders)
+        yield tarfile.NUL * tarfile.BLOCKSIZE * 2
@@ -1,34 +1,51 @@
 import os
 import sys
-from docker import types
 import socket
 import re
 import time
 import datetime
 import json
 import subprocess
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .docker_utils import ensure_docker_volume, \
                           docker_volume_remove, \
                           docker_container_create, \
                           docker_container_exists, \
+                          docker_container_running, \
+                          docker_container_rename, \
+                          docker_inspect_container, \
+                          docker_container_paused, \
+                          docker_container_unpause, \
                           docker_container_start, \
                           docker_container_stop, \
                           docker_container_remove, \
                           docker_container_exec, \
+                          docker_container_commit, \
+                          docker_get_image_top_layer_size, \
                           docker_pull_image, \
+                          docker_image_exists, \
+                          docker_image_tag, \
+                          docker_get_image_repo_digests, \
+                          docker_get_registry_manifest_digest, \
                           docker_get_port_on_host, \
                           docker_get_container_labels, \
                           docker_get_latest_image_version, \
                           docker_get_container_mounts, \
+                          docker_get_volume_options, \
                           docker_list_containers, \
+                          docker_get_mapped_host_ports, \
                           docker_copy_to_container
 from .common_utils import get_public_ip, \
                           get_expanded_path, \
                           get_system_cpu_count, \
                           get_system_memory_size, \
                           get_cli_version, \
-                          delete_folder_contents, \
+                          trash_folder_contents, \
+                          purge_folders_in_background, \
+                          get_purge_statuses, \
+                          convert_size, \
                           fc
 from .sinara_platform import SinaraPlatform
 from .config_manager import SinaraServerConfigManager, SinaraGlobalConfigManager
@@ -37,11 +54,16 @@ class SinaraServer():
 
     subject = 'server'
     container_name = 'personal_public_desktop'
+    pkg_cache_volume = 'sinara-pkg-cache'
+    pkg_cache_mount_point = '/opt/sinara-pkg-cache'
     sinara_images = [['buslovaev/sinara-notebook', 'buslovaev/sinara-cv'], ['buslovaev/sinara-notebook-exp', 'buslovaev/sinara-cv-exp']]
     server_types = ["ml", "cv"]
     root_parser = None
     subject_parser = None
     create_parser = None
+    # host ports handed out to servers being created by this process, they are not bound until the server starts
+    ports_lock = threading.Lock()
+    reserved_ports = set()
     start_parser = None
     remove_parser = None
 
@@ -58,6 +80,12 @@ class SinaraServer():
         SinaraServer.add_remove_handler(server_subparsers)
         SinaraServer.add_update_handler(server_subparsers)
         SinaraServer.add_list_handler(server_subparsers)
+        SinaraServer.add_stats_handler(server_subparsers)
+        SinaraServer.add_idle_policy_handler(server_subparsers)
+        SinaraServer.add_idle_check_handler(server_subparsers)
+        SinaraServer.add_apply_handler(server_subparsers)
+        SinaraServer.add_upgrade_handler(server_subparsers)
+        SinaraServer.add_freeze_handler(server_subparsers)
 
     @staticmethod
     def add_create_handler(server_cmd_parser):
@@ -67,8 +95,8 @@ class SinaraServer():
         SinaraServer.create_parser.add_argument('--createFolders', action='store_false', help='Create work, data, tmp folders in basic mode automatically if not exists, or else folders must be created manually (default: %(default)s)')
         SinaraServer.create_parser.add_argument('--useCustomFolders', action='store_true', help='Use custom work, data, raw and tmp folders in basic mode. Folders must exist (default: %(default)s)')
         SinaraServer.create_parser.add_argument('--gpuEnabled', choices=["y", "n"], help='y - Enables docker container to use Nvidia GPU, n - disable GPU')
-        SinaraServer.create_parser.add_argument('--memLimit', default=str(SinaraServer.get_memory_size_limit()), type=str, help='Maximum amount of memory for server container (default: %(default)s)')
-        SinaraServer.create_parser.add_argument('--cpuLimit', default=SinaraServer.get_cpu_cores_limit(), type=int, help='Number of CPU cores to use for server container (default: %(default)s)')
+        SinaraServer.create_parser.add_argument('--memLimit', type=str, help='Maximum amount of memory for server container (default: host memory minus 2Gb reserved for host)')
+        SinaraServer.create_parser.add_argument('--cpuLimit', type=int, help='Number of CPU cores to use for server container (default: host cores minus 1 reserved for host)')
         SinaraServer.create_parser.add_argument('--jovyanRootPath', type=str, help='Path to parent folder for data, work, raw and tmp (only used in basic mode with --createFolders)')
         SinaraServer.create_parser.add_argument('--jovyanDataPath', type=str, help='Path to data fodler on host (only used in basic mode)')
         SinaraServer.create_parser.add_argument('--jovyanWorkPath', type=str, help='Path to work folder on host (only used in basic mode)')
@@ -80,10 +108,12 @@ class SinaraServer():
         #SinaraServer.create_parser.add_argument('--platform', default=SinaraPlatform.Desktop, choices=list(SinaraPlatform), type=SinaraPlatform, help='Server platform - host where the server is run')
         SinaraServer.create_parser.add_argument('--experimental', action='store_true', help='Use experimiental server images')
         SinaraServer.create_parser.add_argument('--image', type=str, help='Custom server image name')
-        SinaraServer.create_parser.add_argument('--shmSize', type=str, default=str(SinaraServer.get_default_shm_size()), help='Docker shared memory size option (default: %(default)s)')
+        SinaraServer.create_parser.add_argument('--shmSize', type=str, help='Docker shared memory size option (default: 1/6 of host memory)')
         SinaraServer.create_parser.add_argument('--fromConfig', type=str, help='Create a server using server.json config')
         SinaraServer.create_parser.add_argument('--project', type=str, choices=SinaraServer.server_types, help='DEPRECATED: use --serverType. Project type for server (default: %(default)s)')
         SinaraServer.create_parser.add_argument('--serverType', type=str, choices=SinaraServer.server_types, help='SinaraML Server type (default: %(default)s)')
+        SinaraServer.create_parser.add_argument('--pkgCache', action='store_true', help=f'Mount host-wide {SinaraServer.pkg_cache_volume} volume for pip and conda package caches shared by all servers')
+        SinaraServer.create_parser.add_argument('--manifest', type=str, help='Name of the servers manifest which manages this server (set by "sinara server apply")')
         SinaraServer.create_parser.set_defaults(func=SinaraServer.create)
 
     @staticmethod
@@ -108,8 +138,9 @@ class SinaraServer():
     @staticmethod
     def add_update_handler(root_parser):
         server_remove_parser = root_parser.add_parser('update', help='update docker image of a sinara server')
-        server_remove_parser.add_argument('--image', choices=["ml", "cv"], help='ml - update ml image, cv - update CV image')
+        server_remove_parser.add_argument('--image', nargs='+', choices=["ml", "cv"], help='ml - update ml image, cv - update CV image, several images are updated concurrently')
         server_remove_parser.add_argument('--experimental', action='store_true', help='Update expermiental server images')
+        server_remove_parser.add_argument('--all', action='store_true', help='Update all ml and cv images, both normal and experimental')
         server_remove_parser.set_defaults(func=SinaraServer.update)
 
     @staticmethod
@@ -119,7 +150,59 @@ class SinaraServer():
         server_list_parser.set_defaults(func=SinaraServer.list)
 
     @staticmethod
-    def _is_port_free(port):
+    def add_stats_handler(root_parser):
+        server_stats_parser = root_parser.add_parser('stats', help='show live resource usage of sinara servers')
+        server_stats_parser.add_argument('--instanceName', default=SinaraServer.container_name, help='sinara server container name (default: %(default)s)')
+        server_stats_parser.add_argument('--all', action='store_true', help='Show stats for all running sinara servers')
+        server_stats_parser.add_argument('--interval', default=2, type=float, help='Refresh interval in seconds (default: %(default)s)')
+        server_stats_parser.add_argument('--json', action='store_true', help='Emit stats as JSON lines instead of a live table')
+        server_stats_parser.set_defaults(func=SinaraServer.stats)
+
+    @staticmethod
+    def add_idle_policy_handler(root_parser):
+        server_idle_policy_parser = root_parser.add_parser('idle-policy', help='set or disable idle policy of a sinara server')
+        server_idle_policy_parser.add_argument('--instanceName', default=SinaraServer.container_name, help='sinara server container name (default: %(default)s)')
+        server_idle_policy_parser.add_argument('--idleMinutes', default=60, type=int, help='Minutes without jupyter activity before the server is treated as idle (default: %(default)s)')
+        server_idle_policy_parser.add_argument('--idleAction', default='pause', choices=["pause", "stop"], help='What to do with an idle server (default: %(default)s)')
+        server_idle_policy_parser.add_argument('--cpuThreshold', default=5.0, type=float, help='Server CPU usage percent below which it can be treated as idle (default: %(default)s)')
+        server_idle_policy_parser.add_argument('--disable', action='store_true', help='Disable idle policy for the server')
+        server_idle_policy_parser.set_defaults(func=SinaraServer.idle_policy)
+
+    @staticmethod
+    def add_idle_check_handler(root_parser):
+        server_idle_check_parser = root_parser.add_parser('idle-check', help='pause or stop idle sinara servers according to their idle policy')
+        server_idle_check_parser.add_argument('--instanceName', default=SinaraServer.container_name, help='sinara server container name (default: %(default)s)')
+        server_idle_check_parser.add_argument('--all', action='store_true', help='Check all sinara servers with idle policy')
+        server_idle_check_parser.add_argument('--watch', type=int, help='Keep checking all sinara servers every WATCH minutes')
+        server_idle_check_parser.add_argument('--dryRun', action='store_true', help='Only report idle servers without pausing or stopping them')
+        server_idle_check_parser.set_defaults(func=SinaraServer.idle_check)
+
+    @staticmethod
+    def add_apply_handler(root_parser):
+        server_apply_parser = root_parser.add_parser('apply', help='create, update or remove sinara servers to match a servers manifest')
+        server_apply_parser.add_argument('-f', '--file', required=True, type=str, help='Path to servers manifest json file')
+        server_apply_parser.add_argument('--plan', action='store_true', help='Only show changes and docker engine calls without applying them')
+        server_apply_parser.add_argument('--parallel', default=4, type=int, help='Number of servers to reconcile in parallel (default: %(default)s)')
+        server_apply_parser.set_defaults(func=SinaraServer.apply)
+
+    @staticmethod
+    def add_upgrade_handler(root_parser):
+        server_upgrade_parser = root_parser.add_parser('upgrade', help='recreate sinara server on a newer image keeping volumes, ports and config')
+        server_upgrade_parser.add_argument('--instanceName', default=SinaraServer.container_name, help='sinara server container name (default: %(default)s)')
+        server_upgrade_parser.add_argument('--image', type=str, help='Target server image (default: latest version of the current server image)')
+        server_upgrade_parser.set_defaults(func=SinaraServer.upgrade)
+
+    @staticmethod
+    def add_freeze_handler(root_parser):
+        server_freeze_parser = root_parser.add_parser('freeze', help='save packages installed into a sinara server as an image used to recreate it')
+        server_freeze_parser.add_argument('--instanceName', default=SinaraServer.container_name, help='sinara server container name (default: %(default)s)')
+        server_freeze_parser.add_argument('--tag', type=str, help='Frozen image name with tag (default: sinara-frozen-<instanceName>:<timestamp>)')
+        server_freeze_parser.set_defaults(func=SinaraServer.freeze)
+
+    @staticmethod
+    def _is_port_free(port, used_ports=()):
+        if port in used_ports:
+            return False
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         result = sock.connect_ex(('127.0.0.1', port))
         sock.close()
@@ -128,37 +211,41 @@ class SinaraServer():
         return True
     
     @staticmethod
-    def get_free_port(port):
-        while not SinaraServer._is_port_free(port):
+    def get_free_port(port, used_ports=()):
+        while not SinaraServer._is_port_free(port, used_ports):
             port += 1
         return port
     
     @staticmethod
-    def get_spark_ui_ports_mapping():
+    def get_spark_ui_ports_mapping(used_ports=()):
         spark_ui_start_port = 4040
         port_count = 20
         sparkui_end_port = spark_ui_start_port + port_count
         result = {}
         free_host_port = spark_ui_start_port-1
         for container_port in range(spark_ui_start_port, sparkui_end_port+1):
-            free_host_port = SinaraServer.get_free_port(port=free_host_port+1)
+            free_host_port = SinaraServer.get_free_port(port=free_host_port+1, used_ports=used_ports)
             result[str(container_port)] = str(free_host_port)
         return result
     
     @staticmethod
-    def get_jupyter_ui_ports_mapping():
+    def get_jupyter_ui_ports_mapping(used_ports=()):
         result = {}
         jupyter_ui_start_port = 8888
-        free_host_port = SinaraServer.get_free_port(port=jupyter_ui_start_port)
+        free_host_port = SinaraServer.get_free_port(port=jupyter_ui_start_port, used_ports=used_ports)
         result['8888'] = str(free_host_port)
         return result
 
     @staticmethod
     def get_ports_mapping():
-        result = {}
-        spark_ui_ports = SinaraServer.get_spark_ui_ports_mapping()
-        jupyter_ui_ports = SinaraServer.get_jupyter_ui_ports_mapping()
-        result = {**spark_ui_ports, **jupyter_ui_ports}
+        # ports are allocated one server at a time, skipping ports mapped by existing containers, even stopped ones,
+        # and ports given to servers created in parallel which are not bound yet
+        with SinaraServer.ports_lock:
+            used_ports = docker_get_mapped_host_ports() | SinaraServer.reserved_ports
+            spark_ui_ports = SinaraServer.get_spark_ui_ports_mapping(used_ports)
+            jupyter_ui_ports = SinaraServer.get_jupyter_ui_ports_mapping(used_ports)
+            result = {**spark_ui_ports, **jupyter_ui_ports}
+            SinaraServer.reserved_ports.update([int(port) for port in result.values()])
         return result
     
     @staticmethod
@@ -213,8 +300,20 @@ class SinaraServer():
         if exit_code:
             print("Failed to set proxy settings for sudo users, apt / apt-get might not work properly")
 
+    @staticmethod
+    def ensure_resource_limits(args):
+        # host limits are computed here and not at parser build time to keep cli startup fast
+        if not args.memLimit:
+            args.memLimit = str(SinaraServer.get_memory_size_limit())
+        if not args.cpuLimit:
+            args.cpuLimit = SinaraServer.get_cpu_cores_limit()
+        if not args.shmSize:
+            args.shmSize = str(SinaraServer.get_default_shm_size())
+
     @staticmethod
     def create(args):
+        from docker import types
+
         if args.fromConfig:
             print(f"Using config {args.fromConfig} to create the sinara server")
             with open(args.fromConfig, "r") as cfg:
@@ -223,6 +322,7 @@ class SinaraServer():
             subprocess.run(f"sinara {server_script_args}", shell=True, env=dict(os.environ), check=True)
             return
 
+        SinaraServer.ensure_resource_limits(args)
         gpu_requests = []
         sinara_image_num = 0
 
@@ -263,6 +363,14 @@ class SinaraServer():
         elif args.runMode == "b":
             docker_volumes = SinaraServer._prepare_basic_mode(args)
 
+        pkg_cache_env = {}
+        if args.pkgCache:
+            docker_volumes.append(SinaraServer._prepare_pkg_cache())
+            pkg_cache_env = {
+                "PIP_CACHE_DIR": f"{SinaraServer.pkg_cache_mount_point}/pip",
+                "CONDA_PKGS_DIRS": f"{SinaraServer.pkg_cache_mount_point}/conda"
+            }
+
         server_cmd = "start-notebook.sh --ip=0.0.0.0 --port=8888 --NotebookApp.default_url=/lab --ServerApp.allow_password_change=False"
         if args.insecure:
             server_cmd = f"{server_cmd} --NotebookApp.token='' --NotebookApp.password=''"
@@ -295,7 +403,8 @@ class SinaraServer():
                 "SINARA_SERVER_CORES": int(args.cpuLimit),
                 "SINARA_ORG": org_json,
                 "SINARA_PLATFORM": str(args.platform),
-                "SINARA_IMAGE_TYPE": SinaraServer.get_image_type(args)
+                "SINARA_IMAGE_TYPE": SinaraServer.get_image_type(args),
+                **pkg_cache_env
             },
             "labels": {
                 "sinaraml.platform": str(args.platform),
@@ -307,27 +416,57 @@ class SinaraServer():
             "device_requests": gpu_requests # '--gpus all' flag equivalent in python docker client
         }
 
+        if args.manifest:
+            server_params["labels"]["sinaraml.manifest"] = str(args.manifest)
+
         docker_container_create(**server_params)
         SinaraServer.save_server_config(server_params, args, cm)
         print(f"Sinara server {args.instanceName} is created")
 
+    @staticmethod
+    def get_volume_placement():
+        # mount name -> host folder, e.g. {"tmp": "/mnt/scratch", "data": "/mnt/nvme"}
+        org_json_path = Path(Path(__file__).parent.parent, "mlops_organization.json")
+        with open(org_json_path) as f:
+            org_json = json.load(f)
+        return org_json["cli_bodies"][0].get("parts", {}).get("server", {}).get("volume_placement") or {}
+
+    @staticmethod
+    def get_volume_driver_opts(volume_placement, mount, volume_name):
+        if not volume_placement.get(mount):
+            return None
+        # local driver bind options keep the volume a docker volume, but store its data in the placement folder
+        device = os.path.join(get_expanded_path(volume_placement[mount]), volume_name)
+        os.makedirs(device, exist_ok=True)
+        return {"type": "none", "o": "bind", "device": device}
+
     @staticmethod
     def _prepare_quick_mode(args):
         data_volume = f"jovyan-data-{args.instanceName}"
         work_volume = f"jovyan-work-{args.instanceName}"
         tmp_volume =  f"jovyan-tmp-{args.instanceName}"
         raw_volume =  f"jovyan-raw-{args.instanceName}"
+        volume_placement = SinaraServer.get_volume_placement()
 
-        ensure_docker_volume(data_volume, already_exists_msg="Docker volume with jovyan data is found")
-        ensure_docker_volume(work_volume, already_exists_msg="Docker volume with jovyan work is found")
-        ensure_docker_volume(tmp_volume, already_exists_msg="Docker volume with jovyan tmp data is found")
-        ensure_docker_volume(raw_volume, already_exists_msg="Docker volume with jovyan raw data is found")
+        ensure_docker_volume(data_volume, already_exists_msg="Docker volume with jovyan data is found",
+                             driver_opts=SinaraServer.get_volume_driver_opts(volume_placement, "data", data_volume))
+        ensure_docker_volume(work_volume, already_exists_msg="Docker volume with jovyan work is found",
+                             driver_opts=SinaraServer.get_volume_driver_opts(volume_placement, "work", work_volume))
+        ensure_docker_volume(tmp_volume, already_exists_msg="Docker volume with jovyan tmp data is found",
+                             driver_opts=SinaraServer.get_volume_driver_opts(volume_placement, "tmp", tmp_volume))
+        ensure_docker_volume(raw_volume, already_exists_msg="Docker volume with jovyan raw data is found",
+                             driver_opts=SinaraServer.get_volume_driver_opts(volume_placement, "raw", raw_volume))
 
         return  [f"{data_volume}:/data",
                  f"{work_volume}:/home/jovyan/work",
                  f"{tmp_volume}:/tmp",
                  f"{raw_volume}:/raw"]
 
+    @staticmethod
+    def _prepare_pkg_cache():
+        ensure_docker_volume(SinaraServer.pkg_cache_volume, already_exists_msg="Docker volume with shared package cache is found")
+        return f"{SinaraServer.pkg_cache_volume}:{SinaraServer.pkg_cache_mount_point}"
+
     @staticmethod
     def _prepare_basic_mode(args):
         #folders_exist = ''
@@ -408,6 +547,12 @@ class SinaraServer():
         docker_container_exec(instance, "rm -rf /tmp/*")
         docker_container_exec(instance, f"chmod 777 /tmp")
 
+        mounts = docker_get_container_mounts(instance)
+        if any(mount["Destination"] == SinaraServer.pkg_cache_mount_point for mount in mounts):
+            # the cache is shared by servers with different users, keep it writable for all
+            docker_container_exec(instance, f"mkdir -p {SinaraServer.pkg_cache_mount_point}/pip {SinaraServer.pkg_cache_mount_point}/conda")
+            docker_container_exec(instance, f"chmod 777 {SinaraServer.pkg_cache_mount_point} {SinaraServer.pkg_cache_mount_point}/pip {SinaraServer.pkg_cache_mount_point}/conda")
+
     @staticmethod
     def get_server_logs(instance, server_command):
         exit_code, output = docker_container_exec(instance, server_command)
@@ -518,14 +663,24 @@ class SinaraServer():
         if not docker_container_exists(args.instanceName):
             print(f"Sinara server with name {args.instanceName} doesn't exist yet, run 'sinara server create' first")
             return
+
+        if docker_container_paused(args.instanceName):
+            # server was paused by idle policy, it is already provisioned
+            print(f'Resuming sinara server {args.instanceName}...')
+            docker_container_unpause(args.instanceName)
+            SinaraServer.print_server_started(args.instanceName)
+            return
         
         print(f'Starting sinara server {args.instanceName}...')
+        SinaraServer.provision_server(args.instanceName)
+        SinaraServer.print_server_started(args.instanceName)
 
+    @staticmethod
+    def provision_server(container_name):
         curr_dir = os.path.dirname(os.path.realpath(__file__))
-        docker_copy_to_container(args.instanceName, Path(curr_dir) / 'assets/sinaraml_jupyter_host_ext-0.1.0-py3-none-any.whl',
+        docker_copy_to_container(container_name, Path(curr_dir) / 'assets/sinaraml_jupyter_host_ext-0.1.0-py3-none-any.whl',
             '/home/sinarian/')
         
-        container_name = args.instanceName
         docker_container_start(container_name)
         SinaraServer.prepare_mounted_folders(container_name)
         SinaraServer.ensure_proxy_from_host(container_name)
@@ -538,7 +693,9 @@ class SinaraServer():
         # restart container to activate and enable extension
         docker_container_stop(container_name)
         docker_container_start(container_name)
-        
+
+    @staticmethod
+    def print_server_started(container_name):
         platform = SinaraServer.get_server_platform(container_name)
         server_clickable_url = SinaraServer.get_server_clickable_url(container_name)
         server_clickable_url = '\n'.join(server_clickable_url)
@@ -573,18 +730,29 @@ class SinaraServer():
             return
         if args.withVolumes == "y":
             mounts = docker_get_container_mounts(args.instanceName)
+            # host folders are emptied only after the server container is gone
+            docker_container_remove(args.instanceName)
+
+            trashed_folders = []
             for mount in mounts:
                 if mount["Type"] == "bind":
                     if mount["Destination"] in container_folders:
                         print(f"Removing sinara volume {mount['Source']}")
-                        delete_folder_contents(mount["Source"])
+                        trashed_folders.append(trash_folder_contents(mount["Source"]))
 
             # always try to remove docker volumes, in case they are orphaned
-            docker_container_remove(args.instanceName)
 
             for vol in container_volumes:
                 print(f"Removing sinara volume {vol}")
+                # docker keeps the data of volumes placed into host folders, it is purged with them
+                volume_device = docker_get_volume_options(vol).get("device")
                 docker_volume_remove(vol)
+                if volume_device and os.path.exists(volume_device):
+                    trashed_folders.append(trash_folder_contents(volume_device))
+
+            if trashed_folders:
+                purge_folders_in_background(trashed_folders)
+                print("Removed host folders contents are deleted in background, progress is shown by 'sinara server list'")
         else:
             docker_container_remove(args.instanceName)
 
@@ -593,24 +761,187 @@ class SinaraServer():
 
         print(f'Sinara server {args.instanceName} removed.\n\nTo create it again use command:\nsinara server create --fromConfig {server_config}')
 
+    @staticmethod
+    def pull_image_if_changed(image, progress_position=None):
+        remote_digest = docker_get_registry_manifest_digest(image)
+        if remote_digest and remote_digest in docker_get_image_repo_digests(image):
+            print(f'Sinara server image {image} is up to date')
+        else:
+            docker_pull_image(image, progress_position)
+
+    @staticmethod
+    def update_image(sinara_image, progress_position=None):
+        SinaraServer.pull_image_if_changed(sinara_image, progress_position)
+
+        # create uses the versioned tag, latest is only retagged when the registry has the same manifest for it
+        versioned_image_tag = docker_get_latest_image_version(sinara_image.split('/')[-1])
+        versioned_image = f"{sinara_image}:{versioned_image_tag}"
+        if versioned_image_tag != 'latest':
+            versioned_digest = docker_get_registry_manifest_digest(versioned_image)
+            if versioned_digest and versioned_digest in docker_get_image_repo_digests(sinara_image):
+                docker_image_tag(sinara_image, sinara_image, versioned_image_tag)
+            else:
+                SinaraServer.pull_image_if_changed(versioned_image, progress_position)
+        return versioned_image
+
     @staticmethod
     def update(args):
-        args_dict = vars(args)
-        sinara_image_num = -1
-        if not args.image:
+        sinara_image_nums = []
+        if args.all:
+            sinara_image_nums = [1, 2]
+        elif not args.image:
+            sinara_image_num = -1
             while sinara_image_num not in [1, 2]:
                 try:
                     sinara_image_num = int(input('Please, choose a SinaraML Server to update [1] ML or [2] CV:'))
                 except ValueError:
                     pass
-        elif args.image == "ml":
-            sinara_image_num = 1
-        elif args.image == "cv":
-            sinara_image_num = 2
+            sinara_image_nums = [sinara_image_num]
+        else:
+            sinara_image_nums = sorted(set([SinaraServer.server_types.index(image) + 1 for image in args.image]))
 
-        sinara_image = SinaraServer.sinara_images[ int(args.experimental) ][ sinara_image_num-1 ]
-        docker_pull_image(sinara_image)
-        print(f'Sinara server image {sinara_image} updated successfully')
+        experimental_flags = [0, 1] if args.all else [int(args.experimental)]
+        sinara_images = [SinaraServer.sinara_images[exp][num-1] for exp in experimental_flags for num in sinara_image_nums]
+
+        if len(sinara_images) == 1:
+            SinaraServer.update_image(sinara_images[0])
+            print(f'Sinara server image {sinara_images[0]} updated successfully')
+            return
+
+        failed_images = []
+        with ThreadPoolExecutor(max_workers=len(sinara_images)) as executor:
+            futures = {executor.submit(SinaraServer.update_image, image, position): image for position, image in enumerate(sinara_images)}
+            for future in as_completed(futures):
+                sinara_image = futures[future]
+                try:
+                    future.result()
+                    print(f'Sinara server image {sinara_image} updated successfully')
+                except Exception as e:
+                    failed_images.append(sinara_image)
+                    print(f"{fc.RED}Failed to update sinara server image {sinara_image}: {e}{fc.RESET}")
+        if failed_images:
+            raise Exception(f"Failed to update sinara server images: {', '.join(failed_images)}")
+
+    @staticmethod
+    def get_container_ports_mapping(container_name):
+        port_bindings = docker_inspect_container(container_name)["HostConfig"]["PortBindings"] or {}
+        return {port_spec.split('/')[0]: bindings[0]['HostPort'] for port_spec, bindings in port_bindings.items() if bindings}
+
+    @staticmethod
+    def get_device_requests(saved_device_requests):
+        from docker import types
+        # device requests are saved to server.json in docker engine format
+        return [types.DeviceRequest(driver=r.get("Driver", ""),
+                                    count=r.get("Count", 0),
+                                    device_ids=r.get("DeviceIDs"),
+                                    capabilities=r.get("Capabilities"),
+                                    options=r.get("Options")) for r in saved_device_requests or []]
+
+    @staticmethod
+    def replace_container(container_name, server_params, was_running=None):
+        backup_container_name = f"{container_name}-upgrade-backup"
+        docker_container_remove(backup_container_name)
+        if was_running is None:
+            was_running = docker_container_running(container_name)
+
+        docker_container_stop(container_name)
+        docker_container_rename(container_name, backup_container_name)
+        try:
+            docker_container_create(**server_params)
+            SinaraServer.provision_server(container_name)
+            # fails if jupyter does not come up in the new container
+            SinaraServer.get_server_clickable_url(container_name)
+        except Exception as e:
+            print(f"{fc.RED}Failed to start sinara server {container_name}: {e}\nRolling back to previous container{fc.RESET}")
+            docker_container_remove(container_name)
+            docker_container_rename(backup_container_name, container_name)
+            if was_running:
+                docker_container_start(container_name)
+            raise
+
+        docker_container_remove(backup_container_name)
+
+    @staticmethod
+    def upgrade(args):
+        container_name = args.instanceName
+        if not docker_container_exists(container_name):
+            print(f"Sinara server with name {container_name} doesn't exist yet, run 'sinara server create' first")
+            return
+        cm = SinaraServerConfigManager(container_name)
+        if not cm.server_config_exist():
+            raise Exception(f"Config of sinara server {container_name} is not found, upgrade is only possible for servers created by sinara cli")
+
+        server_config = cm.load_server_config()
+        server_params = dict(server_config["container"])
+        # a frozen server is upgraded to its base image, packages installed into the frozen image are not kept
+        frozen_image = server_config.get("frozen_image")
+        target_image = args.image or server_config.get("base_image") or server_params["image"]
+        if frozen_image:
+            print(f"{fc.YELLOW}Sinara server {container_name} is frozen into image {frozen_image}, it is upgraded to {target_image}\n" \
+                  f"Packages installed into the frozen image are not kept, freeze the server again after installing them{fc.RESET}")
+
+        # pull while the old server keeps running, so downtime is only the container swap
+        print(f"Pulling image {target_image}, sinara server {container_name} keeps running...")
+        sinara_images = [image for image_sublist in SinaraServer.sinara_images for image in image_sublist]
+        if target_image in sinara_images:
+            target_image_versioned = SinaraServer.update_image(target_image)
+        elif docker_image_exists(target_image) and not docker_get_image_repo_digests(target_image):
+            # images built or committed locally are in no registry
+            print(f"Image {target_image} is a local image, pull skipped")
+            target_image_versioned = target_image
+        else:
+            SinaraServer.pull_image_if_changed(target_image)
+            target_image_versioned = target_image
+
+        server_params["image"] = target_image
+        server_params["ports"] = SinaraServer.get_container_ports_mapping(container_name)
+        server_params["device_requests"] = SinaraServer.get_device_requests(server_params.get("device_requests"))
+        server_params["environment"] = dict(server_params["environment"], JUPYTER_IMAGE_SPEC=target_image_versioned)
+        server_params["labels"] = dict(server_params["labels"], **{"sinaraml.cli.version": str(get_cli_version())})
+
+        print(f"Replacing sinara server {container_name} container...")
+        SinaraServer.replace_container(container_name, server_params)
+        if args.image or frozen_image:
+            calculated_args = re.sub(r" --image=[^\s]+", "", server_config["cmd"]["calculated_args"])
+            server_config["cmd"]["calculated_args"] = f"{calculated_args} --image={target_image}"
+        server_config.pop("frozen_image", None)
+        server_config.pop("base_image", None)
+        server_config["container"] = server_params
+        cm.save_server_config(server_config)
+        SinaraServer.print_server_started(container_name)
+
+    @staticmethod
+    def freeze(args):
+        container_name = args.instanceName
+        if not docker_container_exists(container_name):
+            print(f"Sinara server with name {container_name} doesn't exist")
+            return
+        cm = SinaraServerConfigManager(container_name)
+        if not cm.server_config_exist():
+            raise Exception(f"Config of sinara server {container_name} is not found, freeze is only possible for servers created by sinara cli")
+
+        if args.tag:
+            frozen_image = args.tag
+        else:
+            timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            frozen_image = f"sinara-frozen-{container_name.lower()}:{timestamp}"
+        repository, tag = frozen_image.rsplit(':', 1) if ':' in frozen_image.split('/')[-1] else (frozen_image, 'latest')
+
+        print(f"Freezing sinara server {container_name} into image {repository}:{tag}...")
+        docker_container_commit(container_name, repository, tag, message=f"sinara server {container_name} frozen by sinara cli")
+        diff_size = docker_get_image_top_layer_size(f"{repository}:{tag}")
+
+        server_config = cm.load_server_config()
+        server_config["base_image"] = server_config.get("base_image") or server_config["container"]["image"]
+        server_config["frozen_image"] = f"{repository}:{tag}"
+        server_config["container"]["image"] = f"{repository}:{tag}"
+        calculated_args = re.sub(r" --image=[^\s]+", "", server_config["cmd"]["calculated_args"])
+        server_config["cmd"]["calculated_args"] = f"{calculated_args} --image={repository}:{tag}"
+        cm.save_server_config(server_config)
+
+        print(f"Sinara server {container_name} frozen into image {repository}:{tag}, installed packages layer size: {convert_size(diff_size)}\n" \
+              f"The image will be used when the server is created again with 'sinara server create --fromConfig'\n" \
+              f"'sinara server upgrade' replaces it with base image {server_config['base_image']}, freeze the server again after upgrade to keep packages")
 
     @staticmethod
     def save_server_config(container_params, args, config_manager):
@@ -670,6 +1001,12 @@ class SinaraServer():
                 url_str = ", ".join(server_clickable_urls)
                 print(f"{fc.CYAN}Urls{fc.RESET}: {fc.WHITE}{url_str}{fc.RESET}")
         
+        purge_statuses = [status for status in get_purge_statuses() if status["alive"]]
+        if purge_statuses:
+            deleted_files = sum([status["deleted_files"] for status in purge_statuses])
+            purged_folders = sum([len(status["paths"]) for status in purge_statuses])
+            print(f"\n{fc.YELLOW}Deleting {purged_folders} removed folders in background, {deleted_files} files deleted so far{fc.RESET}")
+
         if not args.hideRemoved:
             print(f"\n{fc.HEADER}Sinara removed servers:\n-------------------------------------{fc.RESET}")
             for server in sinara_removed_server:
@@ -699,6 +1036,65 @@ class SinaraServer():
                 except Exception as e:
                     print(f"{fc.RED}\nServer config at {sinara_removed_server[server]} cannot be read, skipping{fc.RESET}")
                     
+    @staticmethod
+    def stats(args):
+        from .server_stats import SinaraServerStats
+
+        if args.all:
+            sinara_containers = docker_list_containers("sinaraml.platform")
+            server_names = [c.attrs["Names"][0][1:] for c in sinara_containers if c.attrs["State"].lower() == "running"]
+        else:
+            if not docker_container_running(args.instanceName):
+                print(f"Sinara server {args.instanceName} is not running")
+                return
+            server_names = [args.instanceName]
+
+        if not server_names:
+            print("There are no running sinara servers")
+            return
+        SinaraServerStats.watch(server_names, args.interval, json_output=args.json)
+
+    @staticmethod
+    def idle_policy(args):
+        from .server_idle import SinaraServerIdlePolicy
+
+        if args.disable:
+            SinaraServerIdlePolicy.set_policy(args.instanceName, None)
+            print(f"Idle policy of sinara server {args.instanceName} is disabled")
+            return
+        policy = {
+            "idle_minutes": args.idleMinutes,
+            "action": args.idleAction,
+            "cpu_threshold": args.cpuThreshold
+        }
+        SinaraServerIdlePolicy.set_policy(args.instanceName, policy)
+        print(f"Sinara server {args.instanceName} will be {'paused' if args.idleAction == 'pause' else 'stopped'} after {args.idleMinutes} idle minutes")
+
+    @staticmethod
+    def idle_check(args):
+        from .server_idle import SinaraServerIdlePolicy
+
+        if args.watch:
+            SinaraServerIdlePolicy.watch(args.watch, args.dryRun)
+            return
+        if args.all:
+            sinara_containers = docker_list_containers("sinaraml.platform")
+            server_names = [c.attrs["Names"][0][1:] for c in sinara_containers]
+        else:
+            server_names = [args.instanceName]
+        SinaraServerIdlePolicy.check(server_names, args.dryRun)
+
+    @staticmethod
+    def apply(args):
+        from .server_manifest import SinaraServerManifest
+
+        manifest = SinaraServerManifest.load(args.file)
+        changes = SinaraServerManifest.plan(manifest)
+        SinaraServerManifest.print_plan(changes)
+        if args.plan:
+            return
+        SinaraServerManifest.reconcile(changes, args.parallel, getattr(args, 'verbose', False))
+
     @staticmethod
     def get_image_type(args):
         exp_part = ''
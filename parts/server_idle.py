@@ -0,0 +1,122 @@
+import time
+import logging
+import datetime
+
+from .docker_utils import docker_container_running, \
+                          docker_container_pause, \
+                          docker_container_stop, \
+                          docker_container_stats, \
+                          docker_get_port_on_host, \
+                          docker_list_containers
+from .server_stats import SinaraServerStats
+from .config_manager import SinaraServerConfigManager
+from .common_utils import fc
+
+class SinaraServerIdlePolicy:
+
+    @staticmethod
+    def get_policy(server_name):
+        cm = SinaraServerConfigManager(server_name, ensure_folders=False)
+        if not cm.server_config_exist():
+            return None
+        return cm.load_server_config().get("idle_policy")
+
+    @staticmethod
+    def set_policy(server_name, policy):
+        cm = SinaraServerConfigManager(server_name, ensure_folders=False)
+        if not cm.server_config_exist():
+            raise Exception(f"Config of sinara server {server_name} is not found, idle policy can only be set for servers created by sinara cli")
+        server_config = cm.load_server_config()
+        if policy:
+            server_config["idle_policy"] = policy
+        else:
+            server_config.pop("idle_policy", None)
+        cm.save_server_config(server_config)
+
+    @staticmethod
+    def _parse_jupyter_time(value):
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+    @staticmethod
+    def get_jupyter_activity(server_name):
+        # local import, server module imports this one lazily
+        import requests
+        from .server import SinaraServer
+        server_url = SinaraServer.get_server_url(server_name)
+        if not server_url:
+            return None
+        protocol = SinaraServer.get_server_protocol(server_url)
+        token = SinaraServer.get_server_token(server_url)
+        host_port = docker_get_port_on_host(server_name, 8888)
+        api_url = f"{protocol}://127.0.0.1:{host_port}/api"
+        headers = {"Authorization": f"token {token}"} if token else {}
+
+        # self-signed certificates are common for local servers
+        requests.packages.urllib3.disable_warnings()
+        status = requests.get(f"{api_url}/status", headers=headers, verify=False, timeout=10).json()
+        kernels = requests.get(f"{api_url}/kernels", headers=headers, verify=False, timeout=10).json()
+        sessions = requests.get(f"{api_url}/sessions", headers=headers, verify=False, timeout=10).json()
+
+        last_activity = [SinaraServerIdlePolicy._parse_jupyter_time(status["last_activity"])] if status.get("last_activity") else []
+        last_activity.extend([SinaraServerIdlePolicy._parse_jupyter_time(k["last_activity"]) for k in kernels if k.get("last_activity")])
+        return {
+            "last_activity": max(last_activity) if last_activity else None,
+            "busy_kernels": len([k for k in kernels if k.get("execution_state") == "busy"]),
+            "kernels": len(kernels),
+            "sessions": len(sessions)
+        }
+
+    @staticmethod
+    def get_cpu_percent(server_name):
+        stats = docker_container_stats(server_name, stream=False)
+        return SinaraServerStats.get_cpu_percent(stats)
+
+    @staticmethod
+    def get_idle_minutes(server_name, cpu_threshold):
+        activity = SinaraServerIdlePolicy.get_jupyter_activity(server_name)
+        if not activity or not activity["last_activity"] or activity["busy_kernels"] > 0:
+            return 0
+        if SinaraServerIdlePolicy.get_cpu_percent(server_name) > cpu_threshold:
+            return 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return (now - activity["last_activity"]).total_seconds() / 60
+
+    @staticmethod
+    def check_server(server_name, dry_run=False):
+        policy = SinaraServerIdlePolicy.get_policy(server_name)
+        if not policy or not docker_container_running(server_name):
+            return
+        try:
+            idle_minutes = SinaraServerIdlePolicy.get_idle_minutes(server_name, policy["cpu_threshold"])
+        except Exception as e:
+            logging.debug(e)
+            print(f"{fc.YELLOW}Cannot get activity of sinara server {server_name}, skipping{fc.RESET}")
+            return
+
+        if idle_minutes < policy["idle_minutes"]:
+            print(f"Sinara server {server_name} is active (idle for {int(idle_minutes)} of {policy['idle_minutes']} minutes)")
+            return
+
+        print(f"Sinara server {server_name} is idle for {int(idle_minutes)} minutes, action: {policy['action']}")
+        if dry_run:
+            return
+        if policy["action"] == "pause":
+            docker_container_pause(server_name)
+        else:
+            docker_container_stop(server_name)
+        print(f"Sinara server {server_name} is {'paused' if policy['action'] == 'pause' else 'stopped'}, run 'sinara server start --instanceName {server_name}' to resume it")
+
+    @staticmethod
+    def check(server_names, dry_run=False):
+        for server_name in server_names:
+            SinaraServerIdlePolicy.check_server(server_name, dry_run)
+
+    @staticmethod
+    def watch(interval_minutes, dry_run=False):
+        try:
+            while True:
+                sinara_containers = docker_list_containers("sinaraml.platform")
+                SinaraServerIdlePolicy.check([c.attrs["Names"][0][1:] for c in sinara_containers], dry_run)
+                time.sleep(interval_minutes * 60)
+        except KeyboardInterrupt:
+            pass
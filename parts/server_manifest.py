@@ -0,0 +1,216 @@
+import os
+import json
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tabulate import tabulate
+
+from .docker_utils import docker_container_exists, \
+                          docker_volume_exists, \
+                          docker_image_exists, \
+                          docker_list_containers
+from .config_manager import SinaraServerConfigManager
+from .common_utils import fc
+from .server import SinaraServer
+
+class SinaraServerManifestException(Exception):
+    pass
+
+class SinaraServerManifest:
+
+    # manifest server spec keys compared against saved container params
+    compared_keys = ["image", "runMode", "memLimit", "cpuLimit", "shmSize", "serverType", "platform", "gpuEnabled"]
+
+    @staticmethod
+    def load(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        manifest_name = manifest.get("name") or Path(manifest_path).stem
+        profiles = manifest.get("profiles", {})
+        create_args = [action.dest for action in SinaraServer.create_parser._actions]
+
+        servers = []
+        for server in manifest.get("servers", []):
+            spec = {}
+            server_profiles = server.get("profiles", [])
+            if isinstance(server_profiles, str):
+                server_profiles = [server_profiles]
+            for profile in server_profiles:
+                if profile not in profiles:
+                    raise SinaraServerManifestException(f"Profile '{profile}' is not defined in manifest {manifest_path}")
+                spec.update(profiles[profile])
+            spec.update({k: v for k, v in server.items() if k != "profiles"})
+
+            unknown_keys = [k for k in spec if k not in create_args or k in ["fromConfig", "manifest", "help"]]
+            if unknown_keys:
+                raise SinaraServerManifestException(f"Unsupported keys {', '.join(unknown_keys)} for server {spec.get('instanceName')} in manifest {manifest_path}")
+            if not spec.get("instanceName"):
+                raise SinaraServerManifestException(f"Each server in manifest {manifest_path} must have instanceName")
+            if not spec.get("serverType"):
+                raise SinaraServerManifestException(f"Server {spec['instanceName']} in manifest {manifest_path} must have serverType")
+            # servers are created in parallel workers, create must never prompt for a folder
+            if spec.get("runMode") == "b" and not spec.get("useCustomFolders") and not spec.get("jovyanRootPath"):
+                raise SinaraServerManifestException(f"Server {spec['instanceName']} in manifest {manifest_path} runs in basic mode and must have jovyanRootPath")
+            custom_folder_keys = ["jovyanDataPath", "jovyanWorkPath", "jovyanTmpPath", "jovyanRawPath"]
+            missing_folder_keys = [k for k in custom_folder_keys if not spec.get(k)]
+            if spec.get("runMode") == "b" and spec.get("useCustomFolders") and missing_folder_keys:
+                raise SinaraServerManifestException(f"Server {spec['instanceName']} in manifest {manifest_path} uses custom folders and must have {', '.join(missing_folder_keys)}")
+            # fail early on invalid values, before anything is changed
+            SinaraServerManifest.get_create_args(spec, manifest_name, False)
+            servers.append(spec)
+
+        server_names = [s["instanceName"] for s in servers]
+        duplicates = set([name for name in server_names if server_names.count(name) > 1])
+        if duplicates:
+            raise SinaraServerManifestException(f"Duplicate servers {', '.join(duplicates)} in manifest {manifest_path}")
+
+        return {"name": manifest_name, "servers": servers}
+
+    @staticmethod
+    def get_desired_image(spec):
+        if spec.get("image"):
+            return spec["image"]
+        server_type_num = SinaraServer.server_types.index(spec["serverType"])
+        return SinaraServer.sinara_images[int(bool(spec.get("experimental")))][server_type_num]
+
+    @staticmethod
+    def get_current_values(container_params):
+        volumes = container_params.get("volumes", [])
+        run_mode = "b" if volumes and os.sep in volumes[0].split(":")[0] else "q"
+        labels = container_params.get("labels", {})
+        return {
+            "image": container_params.get("image"),
+            "runMode": run_mode,
+            "memLimit": str(container_params.get("mem_limit")),
+            "cpuLimit": str(int(container_params.get("nano_cpus", 0) / 1000000000)),
+            "shmSize": str(container_params.get("shm_size")),
+            "serverType": labels.get("sinaraml.serverType"),
+            "platform": labels.get("sinaraml.platform"),
+            "gpuEnabled": "y" if container_params.get("device_requests") else "n"
+        }
+
+    @staticmethod
+    def get_desired_values(spec):
+        desired = {"image": SinaraServerManifest.get_desired_image(spec)}
+        for key in SinaraServerManifest.compared_keys:
+            if key == "image" or key not in spec:
+                continue
+            desired[key] = str(spec[key])
+        if spec.get("serverType") == "cv":
+            desired["gpuEnabled"] = "y"
+        return desired
+
+    @staticmethod
+    def diff(spec):
+        cm = SinaraServerConfigManager(spec["instanceName"], ensure_folders=False)
+        if not cm.server_config_exist():
+            return ["server config is not found"]
+        server_config = cm.load_server_config()
+        current = SinaraServerManifest.get_current_values(server_config["container"])
+        # frozen servers run a local image committed from their base image
+        if server_config.get("base_image"):
+            current["image"] = server_config["base_image"]
+        desired = SinaraServerManifest.get_desired_values(spec)
+        reasons = [f"{key}: {current[key]} -> {value}" for key, value in desired.items() if current[key] != value]
+        if reasons and server_config.get("frozen_image"):
+            reasons.append(f"frozen image {server_config['frozen_image']} is not kept")
+        return reasons
+
+    @staticmethod
+    def get_create_calls(spec):
+        name = spec["instanceName"]
+        calls = []
+        if spec.get("runMode", "q") == "q":
+            for mount in ["data", "work", "tmp", "raw"]:
+                volume_name = f"jovyan-{mount}-{name}"
+                if not docker_volume_exists(volume_name):
+                    calls.append(f"POST /volumes/create name={volume_name}")
+        image = SinaraServerManifest.get_desired_image(spec)
+        if not docker_image_exists(image):
+            calls.append(f"POST /images/create fromImage={image}")
+        calls.append(f"POST /containers/create name={name} image={image}")
+        return calls
+
+    @staticmethod
+    def get_remove_calls(server_name):
+        return [f"DELETE /containers/{server_name}?force=true"]
+
+    @staticmethod
+    def plan(manifest):
+        changes = []
+        desired_names = []
+        for spec in manifest["servers"]:
+            name = spec["instanceName"]
+            desired_names.append(name)
+            if not docker_container_exists(name):
+                changes.append({"server": name, "action": "create", "reasons": ["server does not exist"],
+                                "spec": spec, "manifest": manifest["name"],
+                                "calls": SinaraServerManifest.get_create_calls(spec)})
+                continue
+            reasons = SinaraServerManifest.diff(spec)
+            if reasons:
+                changes.append({"server": name, "action": "update", "reasons": reasons,
+                                "spec": spec, "manifest": manifest["name"],
+                                "calls": SinaraServerManifest.get_remove_calls(name) + SinaraServerManifest.get_create_calls(spec)})
+            else:
+                changes.append({"server": name, "action": "unchanged", "reasons": [], "spec": spec, "calls": []})
+
+        managed_containers = docker_list_containers(f"sinaraml.manifest={manifest['name']}")
+        for container in managed_containers:
+            name = container.attrs["Names"][0][1:]
+            if name not in desired_names:
+                changes.append({"server": name, "action": "remove", "reasons": ["server is not in manifest, volumes are kept"],
+                                "spec": None, "calls": SinaraServerManifest.get_remove_calls(name)})
+        return changes
+
+    @staticmethod
+    def print_plan(changes):
+        print(f"{fc.HEADER}Sinara servers plan:\n-------------------------------------{fc.RESET}")
+        rows = [[c["server"], c["action"], "\n".join(c["reasons"]), "\n".join(c["calls"])] for c in changes]
+        print(tabulate(rows, ["server", "action", "reason", "docker engine calls"]))
+
+    @staticmethod
+    def get_create_args(spec, manifest_name, verbose):
+        argv = []
+        for k, v in spec.items():
+            if type(v) == bool:
+                if v:
+                    argv.append(f"--{k}")
+            elif v is not None:
+                argv.append(f"--{k}={v}")
+        argv.append(f"--manifest={manifest_name}")
+        # subject and action go first so that the saved config can recreate the server
+        args = argparse.Namespace(subject=SinaraServer.subject, action="create")
+        args = SinaraServer.create_parser.parse_args(argv, namespace=args)
+        args.verbose = verbose
+        return args
+
+    @staticmethod
+    def apply_change(change, verbose):
+        name = change["server"]
+        if change["action"] in ["update", "remove"]:
+            SinaraServer.remove(argparse.Namespace(instanceName=name, withVolumes="n"))
+        if change["action"] in ["create", "update"]:
+            SinaraServer.create(SinaraServerManifest.get_create_args(change["spec"], change["manifest"], verbose))
+
+    @staticmethod
+    def reconcile(changes, parallel, verbose=False):
+        pending = [c for c in changes if c["action"] != "unchanged"]
+        if not pending:
+            print("Sinara servers match the manifest, nothing to do")
+            return
+
+        failed = {}
+        with ThreadPoolExecutor(max_workers=max(parallel, 1)) as executor:
+            futures = {executor.submit(SinaraServerManifest.apply_change, c, verbose): c for c in pending}
+            for future in as_completed(futures):
+                change = futures[future]
+                try:
+                    future.result()
+                    print(f"{fc.GREEN}Sinara server {change['server']}: {change['action']} done{fc.RESET}")
+                except Exception as e:
+                    failed[change["server"]] = e
+                    print(f"{fc.RED}Sinara server {change['server']}: {change['action']} failed: {e}{fc.RESET}")
+
+        if failed:
+            raise SinaraServerManifestException(f"Failed to reconcile servers: {', '.join(failed.keys())}")
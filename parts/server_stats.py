@@ -0,0 +1,190 @@
+import json
+import time
+import threading
+from collections import deque
+from tabulate import tabulate
+
+from .docker_utils import docker_container_stats, docker_inspect_container
+from .common_utils import convert_size, parse_size, fc
+
+class SinaraServerStats:
+
+    history_size = 60
+    memory_alert_ratio = 0.9
+    shm_alert_ratio = 0.9
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.samples = deque(maxlen=SinaraServerStats.history_size)
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.memory_limit, self.shm_size = SinaraServerStats.get_server_limits(server_name)
+        self._prev_io = None
+        self._thread = None
+
+    @staticmethod
+    def get_server_limits(server_name):
+        container_info = docker_inspect_container(server_name)
+        env = dict(item.split('=', 1) for item in container_info["Config"]["Env"] or [] if '=' in item)
+        memory_limit = None
+        try:
+            memory_limit = parse_size(env.get("SINARA_SERVER_MEMORY_LIMIT"))
+        except ValueError:
+            pass
+        if not memory_limit:
+            memory_limit = container_info["HostConfig"].get("Memory") or None
+        shm_size = container_info["HostConfig"].get("ShmSize") or None
+        return memory_limit, shm_size
+
+    @staticmethod
+    def get_cpu_percent(stats):
+        cpu_stats = stats.get("cpu_stats", {})
+        precpu_stats = stats.get("precpu_stats", {})
+        cpu_delta = cpu_stats.get("cpu_usage", {}).get("total_usage", 0) - precpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+        system_delta = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get("system_cpu_usage", 0)
+        online_cpus = cpu_stats.get("online_cpus") or len(cpu_stats.get("cpu_usage", {}).get("percpu_usage") or []) or 1
+        if cpu_delta <= 0 or system_delta <= 0:
+            return 0.0
+        return cpu_delta / system_delta * online_cpus * 100.0
+
+    @staticmethod
+    def get_memory_usage(stats):
+        memory_stats = stats.get("memory_stats", {})
+        usage = memory_stats.get("usage", 0)
+        mem_details = memory_stats.get("stats", {})
+        # same cache accounting as 'docker stats' for cgroup v1 and v2
+        for cache_key in ["total_inactive_file", "inactive_file"]:
+            if cache_key in mem_details and mem_details[cache_key] < usage:
+                return usage - mem_details[cache_key], mem_details.get("shmem")
+        return usage, mem_details.get("shmem")
+
+    @staticmethod
+    def get_io_counters(stats):
+        net_rx = net_tx = 0
+        for iface in (stats.get("networks") or {}).values():
+            net_rx += iface.get("rx_bytes", 0)
+            net_tx += iface.get("tx_bytes", 0)
+        blk_read = blk_write = 0
+        for entry in (stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []):
+            op = entry.get("op", "").lower()
+            if op == "read":
+                blk_read += entry.get("value", 0)
+            elif op == "write":
+                blk_write += entry.get("value", 0)
+        return net_rx, net_tx, blk_read, blk_write
+
+    def add_stats(self, stats, timestamp):
+        memory_usage, shm_usage = SinaraServerStats.get_memory_usage(stats)
+        io_counters = SinaraServerStats.get_io_counters(stats)
+        rates = [0.0, 0.0, 0.0, 0.0]
+        if self._prev_io:
+            prev_timestamp, prev_counters = self._prev_io
+            elapsed = timestamp - prev_timestamp
+            if elapsed > 0:
+                rates = [max(curr - prev, 0) / elapsed for curr, prev in zip(io_counters, prev_counters)]
+        self._prev_io = (timestamp, io_counters)
+
+        sample = {
+            "server": self.server_name,
+            "timestamp": time.time(),
+            "cpu_percent": round(SinaraServerStats.get_cpu_percent(stats), 2),
+            "memory_usage": memory_usage,
+            "memory_limit": self.memory_limit,
+            "shm_usage": shm_usage,
+            "shm_size": self.shm_size,
+            "net_rx_rate": int(rates[0]),
+            "net_tx_rate": int(rates[1]),
+            "blk_read_rate": int(rates[2]),
+            "blk_write_rate": int(rates[3]),
+            "alerts": self.get_alerts(memory_usage, shm_usage)
+        }
+        with self.lock:
+            self.samples.append(sample)
+        return sample
+
+    def get_alerts(self, memory_usage, shm_usage):
+        alerts = []
+        if self.memory_limit and memory_usage >= self.memory_limit * SinaraServerStats.memory_alert_ratio:
+            alerts.append("memory")
+        if self.shm_size and shm_usage and shm_usage >= self.shm_size * SinaraServerStats.shm_alert_ratio:
+            alerts.append("shm")
+        return alerts
+
+    def last_sample(self):
+        with self.lock:
+            return self.samples[-1] if self.samples else None
+
+    def average_cpu(self):
+        with self.lock:
+            if not self.samples:
+                return 0.0
+            return sum(s["cpu_percent"] for s in self.samples) / len(self.samples)
+
+    def _collect(self):
+        try:
+            for stats in docker_container_stats(self.server_name, stream=True):
+                if self.stopped:
+                    break
+                self.add_stats(stats, time.monotonic())
+        except Exception as e:
+            if not self.stopped:
+                print(f"{fc.RED}Stats stream of server {self.server_name} stopped: {e}{fc.RESET}")
+        self.stopped = True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _format_memory(usage, limit):
+        if usage is None:
+            return "N/A"
+        if not limit:
+            return convert_size(usage)
+        return f"{convert_size(usage)} / {convert_size(limit)} ({round(usage / limit * 100, 1)}%)"
+
+    @staticmethod
+    def print_as_table(server_stats):
+        rows = []
+        for stats in server_stats:
+            sample = stats.last_sample()
+            if not sample:
+                rows.append([stats.server_name, "...", "", "", "", "", ""])
+                continue
+            alerts = f"{fc.RED}{', '.join(sample['alerts'])}{fc.RESET}" if sample["alerts"] else ""
+            rows.append([
+                stats.server_name,
+                f"{sample['cpu_percent']}% (avg {round(stats.average_cpu(), 2)}%)",
+                SinaraServerStats._format_memory(sample["memory_usage"], sample["memory_limit"]),
+                SinaraServerStats._format_memory(sample["shm_usage"], sample["shm_size"]),
+                f"{convert_size(sample['net_rx_rate'])}/s / {convert_size(sample['net_tx_rate'])}/s",
+                f"{convert_size(sample['blk_read_rate'])}/s / {convert_size(sample['blk_write_rate'])}/s",
+                alerts
+            ])
+        header = ["server", "cpu", "memory", "shm", "net rx / tx", "block read / write", "alerts"]
+        # clear terminal and redraw the table in place
+        print("\033[2J\033[H", end="")
+        print(f"{fc.HEADER}Sinara servers stats{fc.RESET}\n")
+        print(tabulate(rows, header))
+
+    @staticmethod
+    def watch(server_names, interval, json_output=False):
+        server_stats = [SinaraServerStats(name) for name in server_names]
+        for stats in server_stats:
+            stats.start()
+
+        try:
+            while not all(stats.stopped for stats in server_stats):
+                time.sleep(interval)
+                if json_output:
+                    for stats in server_stats:
+                        sample = stats.last_sample()
+                        if sample:
+                            print(json.dumps(sample), flush=True)
+                else:
+                    SinaraServerStats.print_as_table(server_stats)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for stats in server_stats:
+                stats.stopped = True
@@ -3,9 +3,14 @@ import json
 import os
 from datetime import datetime
 import logging
+import re
+import sys
+import csv
+import shlex
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from .docker_utils import docker_list_volumes, docker_list_containers, docker_volume_remove, docker_volume_exists, docker_container_run, docker_image_exists
-from .common_utils import convert_size, fc, platform_is_wsl, get_folder_size
+from .docker_utils import docker_list_volumes, docker_list_volumes_without_size, docker_list_containers, docker_volume_remove, docker_volume_exists, docker_container_run, docker_image_exists, docker_get_volume_options
+from .common_utils import convert_size, fc, platform_is_wsl, get_folder_size, parse_size, trash_folder_contents, purge_folders_in_background
 from .config_manager import SinaraGlobalConfigManager
 from .server import SinaraServer
 
@@ -24,8 +29,38 @@ class SinaraVolume:
     list_parser = None
     remove_parser = None
     clean_parser = None
+    cache_parser = None
+    quota_parser = None
+    watch_parser = None
+    dedupe_report_parser = None
+    tier_parser = None
+    untier_parser = None
+    backup_parser = None
+    restore_parser = None
+    migrate_parser = None
+    seed_parser = None
     days_to_keep = 7
     mount_points = ["/data", "/tmp", "/home/jovyan/work"]
+    list_columns = ["server", "status", "name", "used", "used_bytes", "type", "mounted_at", "source"]
+    mounts_by_name = {
+        "data": "/data",
+        "work": "/home/jovyan/work",
+        "tmp": "/tmp",
+        "raw": "/raw"
+    }
+    # cached packages are removed as whole units: a conda package folder with its tarballs, a pip http
+    # response with its body or a pip wheel; units modified least recently are removed first
+    pkg_cache_prune_script = """
+cd /cache
+total=$(du -sb . | cut -f1)
+{{
+  find conda -mindepth 1 -maxdepth 1 \\( -type d ! -name cache -o -name '*.tar.bz2' -o -name '*.conda' \\) -print0 2>/dev/null | xargs -0 -r du -sb --time --time-style=+%s
+  find pip/http pip/http-v2 pip/wheels -type f -print0 2>/dev/null | xargs -0 -r du -b --time --time-style=+%s
+}} | awk -F'\\t' '{{u = $3; sub(/\\.(tar\\.bz2|conda|body)$/, "", u); s[u] += $1; if ($2 > t[u]) t[u] = $2}} END {{for (u in s) printf "%d\\t%.0f\\t%s\\n", t[u], s[u], u}}' \\
+  | sort -n | awk -F'\\t' -v total=$total -v max={max_size} 'total > max {{print $3; total -= $2}}' \\
+  | while IFS= read -r u; do rm -rf -- "$u" "$u.tar.bz2" "$u.conda" "$u.body"; done
+find pip -mindepth 1 -type d -empty -delete 2>/dev/null || true
+"""
     
     @staticmethod
     def add_command_handlers(root_parser, subject_parser):
@@ -34,11 +69,25 @@ class SinaraVolume:
         SinaraVolume.add_list_handler(volume_subparsers)
         SinaraVolume.add_remove_handler(volume_subparsers)
         SinaraVolume.add_clean_handler(volume_subparsers)
+        SinaraVolume.add_cache_handler(volume_subparsers)
+        SinaraVolume.add_quota_handler(volume_subparsers)
+        SinaraVolume.add_watch_handler(volume_subparsers)
+        SinaraVolume.add_dedupe_report_handler(volume_subparsers)
+        SinaraVolume.add_tier_handler(volume_subparsers)
+        SinaraVolume.add_untier_handler(volume_subparsers)
+        SinaraVolume.add_backup_handler(volume_subparsers)
+        SinaraVolume.add_restore_handler(volume_subparsers)
+        SinaraVolume.add_migrate_handler(volume_subparsers)
+        SinaraVolume.add_seed_handler(volume_subparsers)
 
     @staticmethod
     def add_list_handler(volume_cmd_parser):
         SinaraVolume.list_parser = volume_cmd_parser.add_parser('list', help='list sinara volumes')
         SinaraVolume.list_parser.add_argument('--all', action='store_true', help='Show all sinara volumes including attached to removed servers')
+        SinaraVolume.list_parser.add_argument('--sizeSource', default='df', choices=["df", "du"], help='df - docker volume sizes from docker system df, du - measure only sinara volumes with du in a maintenance container (default: %(default)s)')
+        SinaraVolume.list_parser.add_argument('--format', default='table', choices=["table", "json", "csv"], help='Output format, json prints one object per volume per line (default: %(default)s)')
+        SinaraVolume.list_parser.add_argument('--sort', choices=["size", "server", "name"], help='Sort volumes of all servers, size sorts largest first')
+        SinaraVolume.list_parser.add_argument('--top', type=int, help='Show only N largest volumes')
         SinaraVolume.list_parser.set_defaults(func=SinaraVolume.list)
         
     @staticmethod
@@ -54,25 +103,124 @@ class SinaraVolume:
         SinaraVolume.clean_parser.add_argument('--data', action='store_true', help='Clean data volume')
         SinaraVolume.clean_parser.add_argument('--tmp', action='store_true', help='Clean tmp volume')
         SinaraVolume.clean_parser.add_argument('--work', action='store_true', help='Clean work volume')
-        SinaraVolume.clean_parser.add_argument('--days_keep', type=int, default=SinaraVolume.days_to_keep, help='Clean interval (default: %(default)s)')
+        SinaraVolume.clean_parser.add_argument('--days_keep', type=int, default=SinaraVolume.days_to_keep, help='Remove files modified more than days_keep days ago, 0 - regardless of age (default: %(default)s)')
+        SinaraVolume.clean_parser.add_argument('--minSize', type=str, help='Remove only files larger than this size, find -size units: k, M, G (e.g. 100M)')
+        SinaraVolume.clean_parser.add_argument('--pattern', action='append', help='Remove only files matching glob pattern, may be repeated (e.g. --pattern "*.parquet")')
+        SinaraVolume.clean_parser.add_argument('--dryRun', action='store_true', help='Only report number of files and bytes that would be reclaimed')
         SinaraVolume.clean_parser.set_defaults(func=SinaraVolume.clean)
 
+    @staticmethod
+    def add_cache_handler(cache_cmd_parser):
+        SinaraVolume.cache_parser = cache_cmd_parser.add_parser('cache', help='show usage and prune shared package cache volume')
+        SinaraVolume.cache_parser.add_argument('--prune', action='store_true', help='Remove least recently used cached packages to fit into --maxSize')
+        SinaraVolume.cache_parser.add_argument('--maxSize', type=str, default='20g', help='Size budget of the package cache used by --prune (default: %(default)s)')
+        SinaraVolume.cache_parser.set_defaults(func=SinaraVolume.cache)
+
+    @staticmethod
+    def add_quota_handler(quota_cmd_parser):
+        SinaraVolume.quota_parser = quota_cmd_parser.add_parser('quota', help='set or remove usage quota of sinara server volumes')
+        SinaraVolume.quota_parser.add_argument('--instanceName', default=SinaraServer.container_name, type=str, help='sinara server container name (default: %(default)s)')
+        SinaraVolume.quota_parser.add_argument('--mount', default='total', choices=["total", "data", "work", "tmp", "raw"], help='Volume to set quota for, total - all server volumes together (default: %(default)s)')
+        SinaraVolume.quota_parser.add_argument('--limit', type=str, help='Quota size (e.g. 50g)')
+        SinaraVolume.quota_parser.add_argument('--warnAt', type=float, default=0.8, help='Usage ratio of the quota to warn at (default: %(default)s)')
+        SinaraVolume.quota_parser.add_argument('--autoClean', action='store_true', help='Run clean policy when usage crosses --warnAt')
+        SinaraVolume.quota_parser.add_argument('--days_keep', type=int, default=SinaraVolume.days_to_keep, help='Clean policy: remove files modified more than days_keep days ago (default: %(default)s)')
+        SinaraVolume.quota_parser.add_argument('--minSize', type=str, help='Clean policy: remove only files larger than this size (e.g. 100M)')
+        SinaraVolume.quota_parser.add_argument('--pattern', action='append', help='Clean policy: remove only files matching glob pattern, may be repeated')
+        SinaraVolume.quota_parser.add_argument('--remove', action='store_true', help='Remove the quota')
+        SinaraVolume.quota_parser.set_defaults(func=SinaraVolume.quota)
+
+    @staticmethod
+    def add_watch_handler(watch_cmd_parser):
+        SinaraVolume.watch_parser = watch_cmd_parser.add_parser('watch', help='check sinara volumes usage against quotas')
+        SinaraVolume.watch_parser.add_argument('--instanceName', type=str, help='Check only this sinara server (default: all servers with quotas)')
+        SinaraVolume.watch_parser.add_argument('--interval', type=int, help='Keep checking every INTERVAL minutes (default: check once)')
+        SinaraVolume.watch_parser.add_argument('--dryRun', action='store_true', help='Only report what auto clean would reclaim')
+        SinaraVolume.watch_parser.set_defaults(func=SinaraVolume.watch)
+
+    @staticmethod
+    def add_dedupe_report_handler(dedupe_cmd_parser):
+        SinaraVolume.dedupe_report_parser = dedupe_cmd_parser.add_parser('dedupe-report', help='find duplicate files across data and raw volumes of sinara servers')
+        SinaraVolume.dedupe_report_parser.add_argument('--all', action='store_true', help='Include volumes of removed servers')
+        SinaraVolume.dedupe_report_parser.add_argument('--minSize', type=str, default='1m', help='Ignore files smaller than this size (default: %(default)s)')
+        SinaraVolume.dedupe_report_parser.add_argument('--top', type=int, default=10, help='Number of largest duplicate groups to show (default: %(default)s)')
+        SinaraVolume.dedupe_report_parser.add_argument('--hardlink', action='store_true', help='Replace duplicates inside host folders with hardlinks to one copy')
+        SinaraVolume.dedupe_report_parser.set_defaults(func=SinaraVolume.dedupe_report)
+
+    @staticmethod
+    def add_tier_handler(tier_cmd_parser):
+        SinaraVolume.tier_parser = tier_cmd_parser.add_parser('tier', help='move cold files of sinara server volume into compressed archives')
+        SinaraVolume.tier_parser.add_argument('--instanceName', type=str, required=True, help='sinara server container name')
+        SinaraVolume.tier_parser.add_argument('--mount', choices=["data", "raw", "work", "tmp"], default="data", help='Volume of sinara server to archive (default: %(default)s)')
+        SinaraVolume.tier_parser.add_argument('--days', type=int, default=90, help='Archive files not accessed or modified for this number of days (default: %(default)s)')
+        SinaraVolume.tier_parser.add_argument('--archivePath', type=str, help='Host folder or docker volume to store archives in (default: sinara-archive docker volume)')
+        SinaraVolume.tier_parser.add_argument('--dryRun', action='store_true', help='Only show how many files would be archived')
+        SinaraVolume.tier_parser.set_defaults(func=SinaraVolume.tier)
+
+    @staticmethod
+    def add_untier_handler(untier_cmd_parser):
+        SinaraVolume.untier_parser = untier_cmd_parser.add_parser('untier', help='restore archived files into sinara server volume')
+        SinaraVolume.untier_parser.add_argument('--instanceName', type=str, required=True, help='sinara server container name')
+        SinaraVolume.untier_parser.add_argument('--mount', choices=["data", "raw", "work", "tmp"], default="data", help='Volume of sinara server to restore into (default: %(default)s)')
+        SinaraVolume.untier_parser.add_argument('--path', type=str, default="", help='File or folder path relative to the volume root, restores all archived files by default')
+        SinaraVolume.untier_parser.add_argument('--archivePath', type=str, help='Host folder or docker volume archives are stored in (default: sinara-archive docker volume)')
+        SinaraVolume.untier_parser.add_argument('--list', action='store_true', help='Only list archived files')
+        SinaraVolume.untier_parser.set_defaults(func=SinaraVolume.untier)
+
+    @staticmethod
+    def add_backup_handler(backup_cmd_parser):
+        SinaraVolume.backup_parser = backup_cmd_parser.add_parser('backup', help='back up sinara server volumes into chunked incremental snapshot')
+        SinaraVolume.backup_parser.add_argument('--instanceName', type=str, required=True, help='sinara server container name')
+        SinaraVolume.backup_parser.add_argument('--mount', action='append', choices=["data", "work", "raw"], help='Volume to back up, can be repeated (default: data, work and raw)')
+        SinaraVolume.backup_parser.add_argument('--backupPath', type=str, help='Folder to store backups in (default: ~/.sinaraml/backups)')
+        SinaraVolume.backup_parser.set_defaults(func=SinaraVolume.backup)
+
+    @staticmethod
+    def add_restore_handler(restore_cmd_parser):
+        SinaraVolume.restore_parser = restore_cmd_parser.add_parser('restore', help='restore sinara server volumes from snapshot into new volumes')
+        SinaraVolume.restore_parser.add_argument('--instanceName', type=str, required=True, help='sinara server container name the snapshot was taken from')
+        SinaraVolume.restore_parser.add_argument('--snapshot', type=str, help='Snapshot to restore (default: latest)')
+        SinaraVolume.restore_parser.add_argument('--mount', action='append', choices=["data", "work", "raw"], help='Volume to restore, can be repeated (default: all volumes of the snapshot)')
+        SinaraVolume.restore_parser.add_argument('--targetName', type=str, help='sinara server name to restore volumes for (default: instanceName)')
+        SinaraVolume.restore_parser.add_argument('--backupPath', type=str, help='Folder backups are stored in (default: ~/.sinaraml/backups)')
+        SinaraVolume.restore_parser.add_argument('--list', action='store_true', help='Only list snapshots of sinara server')
+        SinaraVolume.restore_parser.set_defaults(func=SinaraVolume.restore)
+
+    @staticmethod
+    def add_migrate_handler(migrate_cmd_parser):
+        SinaraVolume.migrate_parser = migrate_cmd_parser.add_parser('migrate', help='move sinara server volumes between docker volumes and host folders')
+        SinaraVolume.migrate_parser.add_argument('--instanceName', type=str, required=True, help='sinara server container name')
+        SinaraVolume.migrate_parser.add_argument('--jovyanRootPath', type=str, help='Move volumes into data, work, raw and tmp host folders under this path, without it host folders are moved into docker volumes')
+        SinaraVolume.migrate_parser.set_defaults(func=SinaraVolume.migrate)
+
+    @staticmethod
+    def add_seed_handler(seed_cmd_parser):
+        SinaraVolume.seed_parser = seed_cmd_parser.add_parser('seed', help='copy host folder into sinara server volume')
+        SinaraVolume.seed_parser.add_argument('src', type=str, help='Host folder to copy')
+        SinaraVolume.seed_parser.add_argument('--instanceName', type=str, required=True, help='sinara server container name')
+        SinaraVolume.seed_parser.add_argument('--mount', choices=["data", "raw", "work"], default="data", help='Volume of sinara server to copy into (default: %(default)s)')
+        SinaraVolume.seed_parser.add_argument('--dest', type=str, help='Folder inside the volume to copy into (default: volume root)')
+        SinaraVolume.seed_parser.set_defaults(func=SinaraVolume.seed)
+
     @staticmethod
     def print_as_table(args, volumes, list_header):
         print(f"{fc.HEADER}{list_header}{fc.RESET}{fc.HEADER}\n************************************\n")
         for server in volumes:
-            # hide servers with 0 usage
-            vols = volumes[server]["volumes"]
-            non_empty_server = [x for x in vols if x["used"] != "0B" and x["used"].lower() != "n/a"]
-            if not non_empty_server:
-                continue
-                
-            print(f"{fc.CYAN}Server:{fc.RESET} {fc.WHITE}{server}{fc.RESET}{fc.CYAN}\nVolumes:{fc.RESET}")
+            SinaraVolume.print_server_table(server, volumes[server]["volumes"])
+
+    @staticmethod
+    def print_server_table(server, vols):
+        # hide servers with 0 usage
+        non_empty_server = [x for x in vols if x["used"] != "0B" and x["used"].lower() != "n/a"]
+        if not non_empty_server:
+            return
             
-            header = vols[0].keys()
-            rows = [x.values() for x in vols]
-            print(tabulate(rows, header))
-            print(f"{fc.HEADER}************************************{fc.RESET}\n")
+        print(f"{fc.CYAN}Server:{fc.RESET} {fc.WHITE}{server}{fc.RESET}{fc.CYAN}\nVolumes:{fc.RESET}")
+        
+        header = vols[0].keys()
+        rows = [x.values() for x in vols]
+        print(tabulate(rows, header))
+        print(f"{fc.HEADER}************************************{fc.RESET}\n", flush=True)
                 
     @staticmethod
     def _get_bind_vol_wsl_source(server_container, dest_path):
@@ -110,117 +258,258 @@ class SinaraVolume:
         return mounts
     
     @staticmethod
-    def _get_active_servers_volumes():
-        volumes = {}
-        all_docker_volumes = docker_list_volumes()
+    def _load_removed_server_configs():
+        removed_server_configs = {}
+        gcm = SinaraGlobalConfigManager()
+        sinara_removed_servers = gcm.get_trashed_servers()
+        for removed_server in sinara_removed_servers:
+            try:
+                with open(sinara_removed_servers[removed_server], "r") as cfg:
+                    removed_server_configs[removed_server] = json.load(cfg)
+            except Exception as e:
+                print(f"{fc.RED}\nServer config at {sinara_removed_servers[removed_server]} cannot be read, skipping{fc.RESET}")
+        return removed_server_configs
+
+    @staticmethod
+    def measure_docker_volumes(volume_names):
+        # du over sinara volumes only is much cheaper than docker df over all images, containers and volumes
+        if not volume_names:
+            return {}
+        m_image = SinaraVolume._get_maintenance_image()
+        docker_volumes = [f"{name}:/volumes/{i}:ro" for i, name in enumerate(volume_names)]
+        output = docker_container_run(m_image, ["sh", "-c", "du -sb /volumes/* 2>/dev/null; true"], volumes=docker_volumes, remove=True)
+        sizes = {}
+        for line in output.decode("utf-8").splitlines():
+            size, path = line.split(None, 1)
+            sizes[volume_names[int(path.strip().split("/")[-1])]] = int(size)
+        return sizes
+
+    @staticmethod
+    def get_docker_volumes_index(size_source, volume_names):
+        if size_source == "df":
+            return {vol["Name"]: vol for vol in docker_list_volumes() or []}
+        volumes_index = {vol["Name"]: vol for vol in docker_list_volumes_without_size()}
+        if size_source == "du":
+            # volumes placed into host folders are measured on the host
+            existing_volume_names = [name for name in volume_names if name in volumes_index and not SinaraVolume._get_docker_volume_device(volumes_index[name])]
+            for name, size in SinaraVolume.measure_docker_volumes(existing_volume_names).items():
+                volumes_index[name]["UsageData"] = {"Size": size}
+        return volumes_index
+
+    @staticmethod
+    def _load_servers_volumes_sources(size_source):
+        # one docker volumes snapshot per command, size_source: df, du or none
         sinara_containers = docker_list_containers("sinaraml.platform")
-        
+        removed_server_configs = SinaraVolume._load_removed_server_configs()
+
+        volume_names = set()
+        for sinara_container in sinara_containers:
+            volume_names.update([m["Name"] for m in sinara_container.attrs["Mounts"] if m["Type"] == "volume"])
+        for server_config in removed_server_configs.values():
+            mounts = SinaraVolume.get_mounts_from_container_spec(server_config["container"])
+            volume_names.update([m["Name"] for m in mounts if m["Type"] == "volume"])
+
+        volumes_index = SinaraVolume.get_docker_volumes_index(size_source, sorted(volume_names))
+        return sinara_containers, removed_server_configs, volumes_index
+
+    @staticmethod
+    def get_servers_volumes(size_source="df"):
+        sinara_containers, removed_server_configs, volumes_index = SinaraVolume._load_servers_volumes_sources(size_source)
+        with_sizes = size_source != "none"
+        active_server_volumes = SinaraVolume._get_active_servers_volumes(sinara_containers, volumes_index, with_sizes)
+        removed_server_volumes = SinaraVolume._get_removed_servers_volumes(removed_server_configs, volumes_index, with_sizes)
+        return active_server_volumes, removed_server_volumes
+
+    @staticmethod
+    def _get_docker_volume_device(docker_volume):
+        # set for volumes created with local driver bind options by volume placement rules
+        options = docker_volume.get("Options") if docker_volume else None
+        return (options or {}).get("device")
+
+    @staticmethod
+    def _get_docker_volume_size(docker_volume, with_sizes=True):
+        device = SinaraVolume._get_docker_volume_device(docker_volume)
+        if device and os.path.exists(device):
+            # docker does not measure bind volumes, their data is a host folder
+            return get_folder_size(device) if with_sizes else None
+        usage_data = docker_volume.get("UsageData") if docker_volume else None
+        if not usage_data or usage_data.get("Size", -1) < 0:
+            return None
+        return usage_data["Size"]
+
+    @staticmethod
+    def _set_volume_size(volume_parsed, size_bytes):
+        volume_parsed["used"] = "N/A" if size_bytes is None else convert_size(size_bytes)
+        volume_parsed["used_bytes"] = size_bytes
+
+    @staticmethod
+    def _get_active_server_volumes(sinara_container, volumes_index, with_sizes=True):
+        server_volumes = []
+        for volume in sinara_container.attrs["Mounts"]:
+            volume_parsed = {}
+            if volume["Type"] == "volume":
+                docker_volume = volumes_index.get(volume["Name"])
+                volume_parsed["name"] = volume["Name"]
+                SinaraVolume._set_volume_size(volume_parsed, SinaraVolume._get_docker_volume_size(docker_volume, with_sizes))
+                volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
+                volume_parsed["mounted_at"] = volume["Destination"]
+            
+            elif volume["Type"] == "bind":
+                if platform_is_wsl():
+                    volume_parsed["name"] = SinaraVolume._get_bind_vol_wsl_source(sinara_container, volume["Destination"])                        
+                else:
+                    volume_parsed["name"] = volume["Source"]
+                SinaraVolume._set_volume_size(volume_parsed, get_folder_size(volume_parsed["name"]) if with_sizes else None)
+                volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
+                volume_parsed["mounted_at"] = volume["Destination"]
+                               
+            else:
+                raise Exception(f"Unsupported volume type {volume['Type']}")
+            
+            volume_parsed["source"] = volume["Source"]
+            if volume["Type"] == "volume" and SinaraVolume._get_docker_volume_device(docker_volume):
+                volume_parsed["source"] = SinaraVolume._get_docker_volume_device(docker_volume)
+            
+            server_volumes.append(volume_parsed)
+        return server_volumes
+
+    @staticmethod
+    def _get_active_servers_volumes(sinara_containers, volumes_index, with_sizes=True):
+        volumes = {}
         for sinara_container in sinara_containers:
             container_name = sinara_container.attrs["Names"][0][1:]
             volumes[container_name] = {
-                "volumes": []
+                "volumes": SinaraVolume._get_active_server_volumes(sinara_container, volumes_index, with_sizes)
             }
-            for volume in sinara_container.attrs["Mounts"]:
-                volume_parsed = {}
-                if volume["Type"] == "volume":
-                    volume_parsed["name"] = volume["Name"]
-                    docker_volume = [vol for vol in all_docker_volumes if vol["Name"] == volume["Name"]][0]
-                    volume_parsed["used"] = convert_size(docker_volume["UsageData"]["Size"])
-                    volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
-                    volume_parsed["mounted_at"] = volume["Destination"]
+        return volumes
+
+    @staticmethod
+    def _get_removed_server_volumes(server_config, volumes_index, with_sizes=True):
+        server_volumes = []
+        volumes_from_spec = SinaraVolume.get_mounts_from_container_spec(server_config["container"])
+
+        for volume in volumes_from_spec:
+            volume_parsed = {}
+            if volume["Type"] == "volume":
+                volume_parsed["name"] = volume["Name"]
+                docker_volume = volumes_index.get(volume["Name"])
+                SinaraVolume._set_volume_size(volume_parsed, SinaraVolume._get_docker_volume_size(docker_volume, with_sizes))
+                volume_parsed["exists"] = docker_volume is not None
+                volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
+                volume_parsed["source"] = SinaraVolume._get_docker_volume_device(docker_volume) or (docker_volume["Mountpoint"] if docker_volume else "")
+                volume_parsed["mounted_at"] = volume["Destination"]
+            
+            elif volume["Type"] == "bind":
+                volume_parsed["name"] = volume["Name"]
+                volume_parsed["exists"] = os.path.exists(volume_parsed["name"])
                 
-                elif volume["Type"] == "bind":
-                    if platform_is_wsl():
-                        volume_parsed["name"] = SinaraVolume._get_bind_vol_wsl_source(sinara_container, volume["Destination"])                        
-                    else:
-                        volume_parsed["name"] = volume["Source"]
-                    volume_parsed["used"] = convert_size(get_folder_size(volume_parsed["name"]))
-                    volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
-                    volume_parsed["mounted_at"] = volume["Destination"]
-                                   
+                if with_sizes and volume_parsed["exists"]:
+                    SinaraVolume._set_volume_size(volume_parsed, get_folder_size(volume_parsed["name"]))
                 else:
-                    raise Exception(f"Unsupported volume type {volume['Type']}")
-                
-                volume_parsed["source"] = volume["Source"]
-                
-                volumes[container_name]["volumes"].append(volume_parsed)
-        return volumes
+                    SinaraVolume._set_volume_size(volume_parsed, None)
+                    
+                volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
+                volume_parsed["source"] = volume["Name"]
+                volume_parsed["mounted_at"] = volume["Destination"]
+            
+            else:
+                raise Exception(f"Unsupported volume type {volume['Type']}")
+            
+            server_volumes.append(volume_parsed)
+        return server_volumes
         
     @staticmethod
-    def _get_removed_servers_volumes():
+    def _get_removed_servers_volumes(removed_server_configs, volumes_index, with_sizes=True):
         volumes_of_removed_servers = {}
-        all_docker_volumes = docker_list_volumes()
-        gcm = SinaraGlobalConfigManager()
-        sinara_removed_servers = gcm.get_trashed_servers()
 
-        for removed_server in sinara_removed_servers:
+        for removed_server, server_config in removed_server_configs.items():
             try:
-                with open(sinara_removed_servers[removed_server], "r") as cfg:
-                    server_config = json.load(cfg)
                 container_name = server_config["container"]["name"]
-                
                 volumes_of_removed_servers[container_name] = {
-                    "volumes": []
+                    "volumes": SinaraVolume._get_removed_server_volumes(server_config, volumes_index, with_sizes)
                 }
-                
-                volumes_from_spec = SinaraVolume.get_mounts_from_container_spec(server_config["container"])
-
-                for volume in volumes_from_spec:
-                    volume_parsed = {}
-                    if volume["Type"] == "volume":
-                        volume_parsed["name"] = volume["Name"]
-                        
-                        docker_volumes = [vol for vol in all_docker_volumes if vol["Name"] == volume["Name"]]
-                        if docker_volumes:
-                            docker_volume = docker_volumes[0]
-                            volume_parsed["used"] = convert_size(docker_volume["UsageData"]["Size"])
-                        else:
-                            volume_parsed["used"] = "N/A"
-                            
-                        volume_parsed["exists"] = True if len(docker_volumes) > 0 else False
-                        #volume_parsed["source"] = docker_volumes[volume_parsed["name"]]["Source"] if len(docker_volumes) > 0 else ""
-                        volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
-                        
-                        volume_parsed["source"] = docker_volume["Mountpoint"] if len(docker_volumes) > 0 else ""
-                        volume_parsed["mounted_at"] = volume["Destination"]
-                    
-                    elif volume["Type"] == "bind":
-                        volume_parsed["name"] = volume["Name"]
-                        
-                        if os.path.exists(volume_parsed["name"]):
-                            volume_parsed["used"] = convert_size(get_folder_size(volume_parsed["name"]))
-                        else:
-                            volume_parsed["used"] = "N/A"
-                            
-                        volume_parsed["type"] = SinaraVolume.get_volume_type_description(volume)
-                        volume_parsed["exists"] = os.path.exists(volume_parsed["name"])
-                        print(volume)
-                        volume_parsed["mounted_at"] = volume["Destination"]
-                    
-                    else:
-                        raise Exception(f"Unsupported volume type {volume['Type']}")
-                    
-                    
-                    volumes_of_removed_servers[container_name]["volumes"].append(volume_parsed)
             except Exception as e:
-                print(f"{fc.RED}\nServer config at {sinara_removed_servers[removed_server]} cannot be read, skipping{fc.RESET}")
+                print(f"{fc.RED}\nServer config of {removed_server} cannot be read, skipping{fc.RESET}")
                 
         return volumes_of_removed_servers
-        
+
+    @staticmethod
+    def iter_servers_volumes(size_source, include_removed):
+        # servers are measured in parallel and yielded as soon as each one is done,
+        # a slow bind mount delays only its own server
+        sinara_containers, removed_server_configs, volumes_index = SinaraVolume._load_servers_volumes_sources(size_source)
+        with_sizes = size_source != "none"
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {}
+            for sinara_container in sinara_containers:
+                future = executor.submit(SinaraVolume._get_active_server_volumes, sinara_container, volumes_index, with_sizes)
+                futures[future] = (sinara_container.attrs["Names"][0][1:], "active")
+            if include_removed:
+                for removed_server, server_config in removed_server_configs.items():
+                    future = executor.submit(SinaraVolume._get_removed_server_volumes, server_config, volumes_index, with_sizes)
+                    futures[future] = (server_config.get("container", {}).get("name", removed_server), "removed")
+            for future in as_completed(futures):
+                server, status = futures[future]
+                try:
+                    yield server, status, future.result()
+                except Exception as e:
+                    logging.debug(e)
+                    print(f"{fc.RED}\nVolumes of sinara server {server} cannot be read, skipping{fc.RESET}", file=sys.stderr)
+
+    @staticmethod
+    def print_volumes(args, rows, writer=None):
+        if args.format == "json":
+            for row in rows:
+                print(json.dumps(row), flush=True)
+        elif args.format == "csv":
+            for row in rows:
+                writer.writerow(row)
+            sys.stdout.flush()
+        else:
+            print(tabulate([[row[key] for key in SinaraVolume.list_columns] for row in rows], SinaraVolume.list_columns), flush=True)
+
     @staticmethod
     def list(args):
-        active_server_volumes = SinaraVolume._get_active_servers_volumes()
-        removed_server_volumes = SinaraVolume._get_removed_servers_volumes()
-        if active_server_volumes:
-            SinaraVolume.print_as_table(args, active_server_volumes, "Active Servers")
-        if args.all and removed_server_volumes:
-            SinaraVolume.print_as_table(args, removed_server_volumes, "Removed Servers")
+        if args.format == "table" and not args.sort and not args.top:
+            # active servers are printed as soon as each one is measured, removed ones after them
+            print(f"{fc.HEADER}Active Servers{fc.RESET}{fc.HEADER}\n************************************\n")
+            removed_server_volumes = {}
+            for server, status, volumes in SinaraVolume.iter_servers_volumes(args.sizeSource, args.all):
+                if status == "active":
+                    SinaraVolume.print_server_table(server, volumes)
+                else:
+                    removed_server_volumes[server] = {"volumes": volumes}
+            if removed_server_volumes:
+                SinaraVolume.print_as_table(args, removed_server_volumes, "Removed Servers")
+            return
+
+        writer = None
+        if args.format == "csv":
+            writer = csv.DictWriter(sys.stdout, fieldnames=SinaraVolume.list_columns, extrasaction="ignore")
+            writer.writeheader()
+
+        rows = []
+        for server, status, volumes in SinaraVolume.iter_servers_volumes(args.sizeSource, args.all):
+            server_rows = [{"server": server, "status": status, **volume} for volume in volumes]
+            if args.sort or args.top:
+                rows.extend(server_rows)
+            else:
+                SinaraVolume.print_volumes(args, server_rows, writer)
+
+        if args.sort or args.top:
+            sort_key = args.sort or "size"
+            if sort_key == "size":
+                rows.sort(key=lambda row: row["used_bytes"] or 0, reverse=True)
+            else:
+                rows.sort(key=lambda row: row[sort_key])
+            if args.top:
+                rows = rows[:args.top]
+            SinaraVolume.print_volumes(args, rows, writer)
     
     @staticmethod
     def remove(args):
         volume_to_remove = None
-        active_server_volumes = SinaraVolume._get_active_servers_volumes()
-        removed_server_volumes = SinaraVolume._get_removed_servers_volumes()
+        active_server_volumes, removed_server_volumes = SinaraVolume.get_servers_volumes(size_source="none")
         for server in active_server_volumes:
             volumes = active_server_volumes[server]["volumes"]
             for volume in volumes:
@@ -238,12 +527,28 @@ class SinaraVolume:
             raise VolumeIsHostFolderException("Removing of host folder sinara volumes is not supported")
         
         if docker_volume_exists(args.volume):
+            volume_device = docker_get_volume_options(args.volume).get("device")
             docker_volume_remove(args.volume)
+            if volume_device and os.path.exists(volume_device):
+                purge_folders_in_background([trash_folder_contents(volume_device)])
         else:
             raise VolumeNotFoundException(f"Volume '{args.volume}' not found")
         
         print(f"Sinara volume '{args.volume}' removed")
         
+    @staticmethod
+    def get_server_volume(server_name, mounted_at):
+        active_server_volumes, removed_server_volumes = SinaraVolume.get_servers_volumes(size_source="none")
+        for servers_volumes in [active_server_volumes, removed_server_volumes]:
+            for volume in servers_volumes.get(server_name, {}).get("volumes", []):
+                if volume["mounted_at"] == mounted_at and volume.get("exists", True):
+                    return volume
+        raise VolumeNotFoundException(f"Volume mounted at {mounted_at} of sinara server '{server_name}' not found")
+
+    @staticmethod
+    def get_volume_mount_source(volume):
+        return volume["name"] if volume["type"] == "docker volume" else volume["source"]
+
     @staticmethod
     def _get_maintenance_image():
         for image_sublist in SinaraServer.sinara_images:
@@ -253,32 +558,50 @@ class SinaraVolume:
         return "ubuntu:22.04"
     
     @staticmethod
-    def clean_files(server_name, volume, days_to_keep):
+    def get_clean_find_expression(days_to_keep, min_size=None, patterns=None):
+        find_expr = "-type f"
+        if days_to_keep > 0:
+            find_expr = f"{find_expr} -mtime +{days_to_keep}"
+        if min_size:
+            if not re.match(r"^[0-9]+[ckMG]?$", min_size):
+                raise ValueError(f"Invalid size {min_size}, use find -size units: k, M, G")
+            find_expr = f"{find_expr} -size +{min_size}"
+        if patterns:
+            name_expr = " -o ".join([f"-name {shlex.quote(pattern)}" for pattern in patterns])
+            find_expr = f"{find_expr} \\( {name_expr} \\)"
+        return find_expr
+
+    @staticmethod
+    def clean_files(volumes, days_to_keep, min_size=None, patterns=None, dry_run=False):
+        # all volumes are cleaned in parallel in one maintenance container,
+        # find -delete unlinks files without forking rm per file
         m_image = SinaraVolume._get_maintenance_image()
-        mounted_folder = volume["mounted_at"]
-        source = volume["source"]
-        type = volume["type"]
-        days = f"+{days_to_keep}" if days_to_keep > 0 else str(days_to_keep)
-        
-        if type == "docker volume":
-            name = volume["name"]
-            docker_volumes = [f"{name}:{mounted_folder}"]
-        else:
-            docker_volumes = [f"{source}:{mounted_folder}"]
-            
-        clean_cmd = f"find {mounted_folder} -type f -mtime {days} -name '*.*' -execdir rm -v -- '{{}}' \;"
-        docker_container_run(m_image,
-                            clean_cmd, 
-                            volumes=docker_volumes,
-                            remove=True)
-        
+        find_expr = SinaraVolume.get_clean_find_expression(days_to_keep, min_size, patterns)
+        find_action = "" if dry_run else " -delete"
+
+        docker_volumes = []
+        clean_cmds = []
+        for i, volume in enumerate(volumes):
+            source = volume["name"] if volume["type"] == "docker volume" else volume["source"]
+            docker_volumes.append(f"{source}:/clean/{i}")
+            # mawk prints sums from 2^31 in exponent form, printf keeps them integer
+            clean_cmds.append(f"(find /clean/{i} {find_expr} -printf '%s\\n'{find_action} | awk '{{n++; s+=$1}} END {{printf \"%d %d %.0f\\n\", {i}, n, s}}') &")
+        clean_cmd = " ".join(clean_cmds) + " wait"
+
+        output = docker_container_run(m_image, ["sh", "-c", clean_cmd], volumes=docker_volumes, remove=True)
+        results = {}
+        for line in output.decode("utf-8").splitlines():
+            i, files_count, files_size = line.split()
+            results[int(i)] = (int(files_count), int(files_size))
+        return [(volume, *results.get(i, (0, 0))) for i, volume in enumerate(volumes)]
+
     @staticmethod
     def clean(args):
-        active_server_volumes = SinaraVolume._get_active_servers_volumes()
-        removed_server_volumes = SinaraVolume._get_removed_servers_volumes()
+        active_server_volumes, removed_server_volumes = SinaraVolume.get_servers_volumes(size_source="none")
         
         already_cleaned_folders = []
         mount_points_to_clean = []
+        volumes_to_clean = []
         
         if args.data:
             print("Cleaning data sinara volume")
@@ -292,7 +615,7 @@ class SinaraVolume:
             
         if not mount_points_to_clean:
             volume_number = 0
-            while volume_number not in range(1, len(SinaraVolume.mount_points)):
+            while volume_number not in range(1, len(SinaraVolume.mount_points) + 1):
                 try:
                     volume_number = int(input("Select sinara volume number to clean\n1) data volume\n2) tmp volume\n3) work volume\n: "))
                 except ValueError:
@@ -304,7 +627,7 @@ class SinaraVolume:
                 volumes = active_server_volumes[server]["volumes"]
                 for volume in volumes:
                     if volume["mounted_at"] in mount_points_to_clean:
-                        SinaraVolume.clean_files(args.instanceName, volume, args.days_keep)
+                        volumes_to_clean.append(volume)
                         already_cleaned_folders.append(volume["source"])
                         
         for server in removed_server_volumes:
@@ -312,5 +635,135 @@ class SinaraVolume:
                 volumes = removed_server_volumes[server]["volumes"]
                 for volume in volumes:
                     if volume["mounted_at"] in mount_points_to_clean and volume["exists"] and volume["source"] not in already_cleaned_folders:
-                        SinaraVolume.clean_files(args.instanceName, volume, args.days_keep)
+                        volumes_to_clean.append(volume)
                         already_cleaned_folders.append(volume["source"])
+
+        if not volumes_to_clean:
+            print(f"No sinara volumes to clean found for server {args.instanceName}")
+            return
+
+        results = SinaraVolume.clean_files(volumes_to_clean, args.days_keep, args.minSize, args.pattern, args.dryRun)
+        header = ["volume", "mounted_at", "files to remove" if args.dryRun else "files removed", "reclaimable" if args.dryRun else "reclaimed"]
+        rows = [[volume["name"], volume["mounted_at"], files_count, convert_size(files_size)] for volume, files_count, files_size in results]
+        print(tabulate(rows, header))
+
+    @staticmethod
+    def get_pkg_cache_usage(m_image, cache_volumes):
+        # du skips folders already counted for an earlier argument, the total is measured by its own call
+        usage_cmd = ["sh", "-c", "du -sb /cache/pip /cache/conda 2>/dev/null; du -sb /cache 2>/dev/null"]
+        output = docker_container_run(m_image, usage_cmd, volumes=cache_volumes, remove=True)
+        usage = {}
+        for line in output.decode("utf-8").splitlines():
+            size, path = line.split(None, 1)
+            usage[path.replace("/cache", "").strip("/") or "total"] = int(size)
+        return usage
+
+    @staticmethod
+    def prune_pkg_cache(m_image, cache_volumes, max_size_bytes):
+        prune_cmd = SinaraVolume.pkg_cache_prune_script.format(max_size=max_size_bytes)
+        docker_container_run(m_image, ["sh", "-c", prune_cmd], volumes=cache_volumes, remove=True)
+
+    @staticmethod
+    def cache(args):
+        cache_volume = SinaraServer.pkg_cache_volume
+        if not docker_volume_exists(cache_volume):
+            print(f"Shared package cache volume {cache_volume} doesn't exist, create a server with --pkgCache to use it")
+            return
+        m_image = SinaraVolume._get_maintenance_image()
+        cache_volumes = [f"{cache_volume}:/cache"]
+
+        usage = SinaraVolume.get_pkg_cache_usage(m_image, cache_volumes)
+        if args.prune:
+            max_size_bytes = parse_size(args.maxSize)
+            if usage.get("total", 0) > max_size_bytes:
+                print(f"Pruning shared package cache to {convert_size(max_size_bytes)}...")
+                SinaraVolume.prune_pkg_cache(m_image, cache_volumes, max_size_bytes)
+                usage_pruned = SinaraVolume.get_pkg_cache_usage(m_image, cache_volumes)
+                print(f"Reclaimed {convert_size(max(usage.get('total', 0) - usage_pruned.get('total', 0), 0))}")
+                usage = usage_pruned
+            else:
+                print("Shared package cache fits into the size budget, nothing to prune")
+
+        rows = [[name, convert_size(usage[name])] for name in ["pip", "conda", "total"] if name in usage]
+        print(f"{fc.CYAN}Shared package cache:{fc.RESET} {fc.WHITE}{cache_volume}{fc.RESET}")
+        print(tabulate(rows, ["cache", "used"]))
+
+    @staticmethod
+    def quota(args):
+        from .volume_quota import SinaraVolumeQuota
+
+        if args.remove:
+            SinaraVolumeQuota.set_quota(args.instanceName, args.mount, None)
+            print(f"Quota of {args.mount} volume of sinara server {args.instanceName} removed")
+            return
+        if not args.limit:
+            raise Exception("Quota --limit is required")
+        if args.autoClean and args.mount == "total":
+            raise Exception("Clean policy can only be set for a single volume, use --mount")
+
+        quota = {
+            "limit": parse_size(args.limit),
+            "warn_ratio": args.warnAt
+        }
+        if args.autoClean:
+            quota["auto_clean"] = {
+                "days_keep": args.days_keep,
+                "min_size": args.minSize,
+                "patterns": args.pattern
+            }
+        SinaraVolumeQuota.set_quota(args.instanceName, args.mount, quota)
+        print(f"Quota of {args.mount} volume of sinara server {args.instanceName} set to {convert_size(quota['limit'])}")
+
+    @staticmethod
+    def watch(args):
+        from .volume_quota import SinaraVolumeQuota
+        SinaraVolumeQuota.watch(args.interval, args.instanceName, args.dryRun)
+
+    @staticmethod
+    def dedupe_report(args):
+        from .volume_dedupe import SinaraVolumeDedupe
+
+        volumes = SinaraVolumeDedupe.get_volumes(args.all, ["/data", "/raw"])
+        if not volumes:
+            print("No data or raw sinara volumes found")
+            return
+        print(f"Searching for duplicate files in {len(volumes)} sinara volumes...")
+        duplicate_groups = SinaraVolumeDedupe.find_duplicates(volumes, parse_size(args.minSize))
+        SinaraVolumeDedupe.print_report(volumes, duplicate_groups, args.top)
+
+        if args.hardlink and duplicate_groups:
+            answer = ""
+            while answer not in ["y", "n"]:
+                answer = input("Hardlinked files share content, changing one changes all copies. Replace duplicates in host folders with hardlinks (y/n): ")
+            if answer == "y":
+                SinaraVolumeDedupe.hardlink_duplicates(duplicate_groups)
+
+    @staticmethod
+    def tier(args):
+        from .volume_tier import SinaraVolumeTier
+        SinaraVolumeTier.tier(args)
+
+    @staticmethod
+    def untier(args):
+        from .volume_tier import SinaraVolumeTier
+        SinaraVolumeTier.untier(args)
+
+    @staticmethod
+    def backup(args):
+        from .volume_backup import SinaraVolumeBackup
+        SinaraVolumeBackup.backup(args)
+
+    @staticmethod
+    def restore(args):
+        from .volume_backup import SinaraVolumeBackup
+        SinaraVolumeBackup.restore(args)
+
+    @staticmethod
+    def migrate(args):
+        from .volume_migrate import SinaraVolumeMigrate
+        SinaraVolumeMigrate.migrate(args)
+
+    @staticmethod
+    def seed(args):
+        from .volume_seed import SinaraVolumeSeed
+        SinaraVolumeSeed.seed(args)
@@ -0,0 +1,230 @@
+import io
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import tarfile
+from datetime import datetime
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from tabulate import tabulate
+
+from .docker_utils import docker_container_create, \
+                          docker_container_remove, \
+                          docker_get_archive, \
+                          docker_put_archive, \
+                          docker_volume_exists, \
+                          docker_volume_create
+from .common_utils import convert_size, IterStreamReader, fc
+from .config_manager import SinaraGlobalConfigManager
+from .volume import SinaraVolume
+
+class SinaraVolumeBackupException(Exception):
+    pass
+
+class SinaraVolumeBackup:
+
+    # backup repository layout:
+    #   chunks/<hash[:2]>/<sha256 of chunk> - zlib compressed file chunks, shared by all snapshots
+    #   snapshots/<server>/<snapshot>.json.gz - tar entries of every volume with chunk hashes
+    chunk_size = 4 * 1024 * 1024
+    compress_level = 3
+    backup_mounts = ["data", "work", "raw"]
+
+    @staticmethod
+    def get_repository(backup_path):
+        if backup_path:
+            return Path(backup_path)
+        return Path(SinaraGlobalConfigManager().backups_folder)
+
+    @staticmethod
+    def get_chunk_path(repository, chunk_hash):
+        return repository / "chunks" / chunk_hash[:2] / chunk_hash
+
+    @staticmethod
+    def store_chunk(repository, data):
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        chunk_path = SinaraVolumeBackup.get_chunk_path(repository, chunk_hash)
+        if chunk_path.exists():
+            return chunk_hash, 0
+        chunk_path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(data, SinaraVolumeBackup.compress_level)
+        # unique temporary name, the same chunk may be stored by two workers at once
+        tmp_path = chunk_path.with_name(f"{chunk_hash}.{os.getpid()}.{id(data)}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, chunk_path)
+        return chunk_hash, len(compressed)
+
+    @staticmethod
+    def load_chunk(repository, chunk_hash):
+        with open(SinaraVolumeBackup.get_chunk_path(repository, chunk_hash), "rb") as f:
+            return zlib.decompress(f.read())
+
+    @staticmethod
+    def get_entry_name(name):
+        # docker archives start with the basename of the copied folder, it becomes the volume root
+        parts = name.split("/", 1)
+        return "." if len(parts) == 1 else f"./{parts[1]}"
+
+    @staticmethod
+    def backup_stream(repository, stream):
+        entries = []
+        stats = {"files": 0, "bytes": 0, "stored_bytes": 0}
+        pending = deque()
+        max_pending = cpu_count() * 4
+
+        def collect(block=False):
+            while pending and (block or len(pending) >= max_pending or pending[0][1].done()):
+                chunks, future = pending.popleft()
+                chunk_hash, stored_bytes = future.result()
+                chunks.append(chunk_hash)
+                stats["stored_bytes"] += stored_bytes
+
+        # chunks are hashed, compressed and written by a pool while the tar stream is read,
+        # chunks already in the repository are only hashed
+        with ThreadPoolExecutor(max_workers=cpu_count()) as executor, \
+             tarfile.open(fileobj=io.BufferedReader(IterStreamReader(stream), buffer_size=SinaraVolumeBackup.chunk_size), mode="r|") as tar:
+            for member in tar:
+                entry = {"name": SinaraVolumeBackup.get_entry_name(member.name),
+                         "type": member.type.decode("utf-8"), "mode": member.mode,
+                         "uid": member.uid, "gid": member.gid, "uname": member.uname, "gname": member.gname,
+                         "mtime": member.mtime, "size": member.size if member.isreg() else 0}
+                if member.issym():
+                    entry["linkname"] = member.linkname
+                elif member.islnk():
+                    entry["linkname"] = SinaraVolumeBackup.get_entry_name(member.linkname)
+                elif member.isreg():
+                    entry["chunks"] = []
+                    f = tar.extractfile(member)
+                    while True:
+                        data = f.read(SinaraVolumeBackup.chunk_size)
+                        if not data:
+                            break
+                        pending.append((entry["chunks"], executor.submit(SinaraVolumeBackup.store_chunk, repository, data)))
+                        collect()
+                    stats["files"] += 1
+                    stats["bytes"] += member.size
+                entries.append(entry)
+            collect(block=True)
+        return entries, stats
+
+    @staticmethod
+    def backup(args):
+        repository = SinaraVolumeBackup.get_repository(args.backupPath)
+        mounts = args.mount or SinaraVolumeBackup.backup_mounts
+        m_image = SinaraVolume._get_maintenance_image()
+
+        volumes = {}
+        for mount in mounts:
+            try:
+                volumes[mount] = SinaraVolume.get_server_volume(args.instanceName, SinaraVolume.mounts_by_name[mount])
+            except Exception as e:
+                print(f"{fc.YELLOW}Skipping {mount} volume: {e}{fc.RESET}")
+        if not volumes:
+            raise SinaraVolumeBackupException(f"No volumes of sinara server {args.instanceName} found to back up")
+
+        snapshot_name = datetime.now().strftime("%Y%m%d-%H%M%S")
+        snapshot = {"server": args.instanceName, "snapshot": snapshot_name, "volumes": {}}
+        # archives are read from a created, never started maintenance container
+        backup_container = f"sinara-backup-{args.instanceName}"
+        docker_container_remove(backup_container)
+        docker_container_create(m_image, name=backup_container,
+                                volumes=[f"{SinaraVolume.get_volume_mount_source(v)}:/backup/{mount}:ro" for mount, v in volumes.items()])
+        rows = []
+        try:
+            for mount, volume in volumes.items():
+                print(f"Backing up {mount} volume {volume['name']}...")
+                stream = docker_get_archive(backup_container, f"/backup/{mount}")
+                entries, stats = SinaraVolumeBackup.backup_stream(repository, stream)
+                snapshot["volumes"][mount] = {"source": volume["name"], "entries": entries}
+                rows.append([mount, stats["files"], convert_size(stats["bytes"]), convert_size(stats["stored_bytes"])])
+        finally:
+            docker_container_remove(backup_container)
+
+        snapshot_path = repository / "snapshots" / args.instanceName / f"{snapshot_name}.json.gz"
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(snapshot_path, "wt") as f:
+            json.dump(snapshot, f)
+
+        print(tabulate(rows, ["volume", "files", "size", "new chunks (compressed)"]))
+        print(f"Snapshot {snapshot_name} of sinara server {args.instanceName} saved to {repository}")
+
+    @staticmethod
+    def list_snapshots(repository, server_name):
+        snapshots_folder = repository / "snapshots" / server_name
+        if not snapshots_folder.exists():
+            return []
+        return sorted([p.name.replace(".json.gz", "") for p in snapshots_folder.glob("*.json.gz")])
+
+    @staticmethod
+    def load_snapshot(repository, server_name, snapshot_name):
+        with gzip.open(repository / "snapshots" / server_name / f"{snapshot_name}.json.gz", "rt") as f:
+            return json.load(f)
+
+    @staticmethod
+    def generate_tar(repository, entries):
+        # tar stream is built on the fly from the chunks, nothing is assembled on disk
+        for entry in entries:
+            info = tarfile.TarInfo(entry["name"])
+            info.type = entry["type"].encode("utf-8")
+            info.mode = entry["mode"]
+            info.uid = entry["uid"]
+            info.gid = entry["gid"]
+            info.uname = entry["uname"]
+            info.gname = entry["gname"]
+            info.mtime = entry["mtime"]
+            info.size = entry["size"]
+            info.linkname = entry.get("linkname", "")
+            yield info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            for chunk_hash in entry.get("chunks", []):
+                yield SinaraVolumeBackup.load_chunk(repository, chunk_hash)
+            padding = -entry["size"] % tarfile.BLOCKSIZE
+            if padding:
+                yield tarfile.NUL * padding
+        yield tarfile.NUL * tarfile.BLOCKSIZE * 2
+
+    @staticmethod
+    def restore(args):
+        repository = SinaraVolumeBackup.get_repository(args.backupPath)
+        snapshots = SinaraVolumeBackup.list_snapshots(repository, args.instanceName)
+        if args.list:
+            print(tabulate([[s] for s in snapshots], ["snapshot"]))
+            return
+        if not snapshots:
+            raise SinaraVolumeBackupException(f"No snapshots of sinara server {args.instanceName} found in {repository}")
+        snapshot_name = args.snapshot or snapshots[-1]
+        if snapshot_name not in snapshots:
+            raise SinaraVolumeBackupException(f"Snapshot {snapshot_name} of sinara server {args.instanceName} not found in {repository}")
+        snapshot = SinaraVolumeBackup.load_snapshot(repository, args.instanceName, snapshot_name)
+
+        target_name = args.targetName or args.instanceName
+        mounts = args.mount or list(snapshot["volumes"].keys())
+        target_volumes = {}
+        for mount in mounts:
+            if mount not in snapshot["volumes"]:
+                raise SinaraVolumeBackupException(f"Snapshot {snapshot_name} has no {mount} volume")
+            volume_name = f"jovyan-{mount}-{target_name}"
+            if docker_volume_exists(volume_name):
+                raise SinaraVolumeBackupException(f"Docker volume {volume_name} already exists, remove it or restore with another --targetName")
+            target_volumes[mount] = volume_name
+
+        m_image = SinaraVolume._get_maintenance_image()
+        restore_container = f"sinara-restore-{target_name}"
+        docker_container_remove(restore_container)
+        for volume_name in target_volumes.values():
+            docker_volume_create(volume_name)
+        docker_container_create(m_image, name=restore_container,
+                                volumes=[f"{volume_name}:/restore/{mount}" for mount, volume_name in target_volumes.items()])
+        try:
+            for mount, volume_name in target_volumes.items():
+                print(f"Restoring {mount} volume from snapshot {snapshot_name} into {volume_name}...")
+                entries = snapshot["volumes"][mount]["entries"]
+                docker_put_archive(restore_container, f"/restore/{mount}", SinaraVolumeBackup.generate_tar(repository, entries))
+        finally:
+            docker_container_remove(restore_container)
+
+        print(f"Sinara server volumes restored, to use them create server with command:\nsinara server create --instanceName {target_name}")
@@ -0,0 +1,149 @@
+import os
+from tabulate import tabulate
+
+from .docker_utils import docker_container_run
+from .common_utils import convert_size, compute_md5, fc
+from .volume import SinaraVolume
+
+class SinaraVolumeDedupe:
+
+    dedupe_root = "/dedupe"
+    # find and hash everything in one maintenance container:
+    # files are grouped by size first, only sizes seen more than once are hashed,
+    # once per inode, in parallel md5sum processes; records are NUL separated, so any file name is safe
+    dedupe_script = \
+        "tab=$(printf '\\t'); " \
+        "find {roots} -type f -size +{min_size}c -printf '%s\\t%D:%i\\t%T@\\t%p\\0' > /tmp/files; " \
+        "find {roots} -type f -size +{min_size}c -printf '%s\\n' | sort | uniq -d | sed \"s/.*/^&$tab/\" > /tmp/sizes; " \
+        "grep -z -f /tmp/sizes /tmp/files > /tmp/candidates; " \
+        "sort -z -u -t \"$tab\" -k2,2 /tmp/candidates | cut -z -f4- | xargs -0 -r -P $(nproc) -n 16 md5sum -z > /tmp/hashes; " \
+        "printf '#candidates\\0'; cat /tmp/candidates; printf '#hashes\\0'; cat /tmp/hashes"
+
+    @staticmethod
+    def get_volumes(include_removed, mount_points):
+        active_server_volumes, removed_server_volumes = SinaraVolume.get_servers_volumes(size_source="none")
+        servers_volumes = dict(removed_server_volumes) if include_removed else {}
+        servers_volumes.update(active_server_volumes)
+
+        volumes = []
+        seen_sources = []
+        for server, server_volumes in servers_volumes.items():
+            for volume in server_volumes["volumes"]:
+                if volume["mounted_at"] not in mount_points or volume.get("exists") is False:
+                    continue
+                source = volume["name"] if volume["type"] == "docker volume" else volume["source"]
+                if source in seen_sources:
+                    continue
+                seen_sources.append(source)
+                volumes.append(dict(volume, server=server))
+        return volumes
+
+    @staticmethod
+    def find_duplicates(volumes, min_size):
+        m_image = SinaraVolume._get_maintenance_image()
+        docker_volumes = []
+        for i, volume in enumerate(volumes):
+            source = volume["name"] if volume["type"] == "docker volume" else volume["source"]
+            docker_volumes.append(f"{source}:{SinaraVolumeDedupe.dedupe_root}/{i}:ro")
+        roots = " ".join([f"{SinaraVolumeDedupe.dedupe_root}/{i}" for i in range(len(volumes))])
+        dedupe_cmd = SinaraVolumeDedupe.dedupe_script.format(roots=roots, min_size=min_size)
+        output = docker_container_run(m_image, ["sh", "-c", dedupe_cmd], volumes=docker_volumes, remove=True)
+
+        candidates = []
+        hashes = {}
+        section = None
+        for line in output.decode("utf-8", "surrogateescape").split("\0"):
+            if line in ["#candidates", "#hashes"]:
+                section = line
+            elif section == "#candidates" and line:
+                size, inode, mtime, path = line.split("\t", 3)
+                candidates.append({"size": int(size), "inode": inode, "mtime": float(mtime), "path": path})
+            elif section == "#hashes" and line:
+                md5, path = line.split("  ", 1)
+                hashes[path] = md5
+
+        inode_hashes = {}
+        for candidate in candidates:
+            if candidate["path"] in hashes:
+                inode_hashes[candidate["inode"]] = hashes[candidate["path"]]
+
+        groups = {}
+        for candidate in candidates:
+            md5 = inode_hashes.get(candidate["inode"])
+            if not md5:
+                continue
+            volume = volumes[int(candidate["path"].split("/")[2])]
+            candidate["volume"] = volume
+            candidate["relative_path"] = "/".join(candidate["path"].split("/")[3:])
+            candidate["md5"] = md5
+            groups.setdefault((candidate["size"], md5), []).append(candidate)
+        return [files for files in groups.values() if len(set([f["inode"] for f in files])) > 1]
+
+    @staticmethod
+    def get_host_path(candidate):
+        return os.path.join(candidate["volume"]["source"], candidate["relative_path"])
+
+    @staticmethod
+    def print_report(volumes, duplicate_groups, top):
+        servers_report = {}
+        for files in duplicate_groups:
+            # first copy is kept, other distinct inodes are reclaimable
+            seen_inodes = [files[0]["inode"]]
+            for f in files[1:]:
+                if f["inode"] in seen_inodes:
+                    continue
+                seen_inodes.append(f["inode"])
+                report = servers_report.setdefault(f["volume"]["server"], {"files": 0, "bytes": 0})
+                report["files"] += 1
+                report["bytes"] += f["size"]
+
+        print(f"{fc.HEADER}Duplicate files in sinara volumes\n************************************{fc.RESET}")
+        rows = [[server, r["files"], convert_size(r["bytes"])] for server, r in sorted(servers_report.items(), key=lambda x: -x[1]["bytes"])]
+        print(tabulate(rows, ["server", "duplicate files", "reclaimable"]))
+        total = sum([r["bytes"] for r in servers_report.values()])
+        print(f"\n{fc.CYAN}Total reclaimable:{fc.RESET} {fc.WHITE}{convert_size(total)}{fc.RESET}\n")
+
+        largest_groups = sorted(duplicate_groups, key=lambda files: -files[0]["size"] * (len(files) - 1))[:top]
+        for files in largest_groups:
+            print(f"{fc.CYAN}{convert_size(files[0]['size'])} x {len(files)}{fc.RESET}")
+            for f in files:
+                print(f"  {f['volume']['server']}:{f['volume']['mounted_at']}/{f['relative_path']}")
+
+    @staticmethod
+    def hardlink_duplicates(duplicate_groups):
+        linked_files = 0
+        linked_bytes = 0
+        for files in duplicate_groups:
+            host_files = [f for f in files if f["volume"]["type"] == "host folder"]
+            if len(host_files) < 2:
+                continue
+            keeper_path = SinaraVolumeDedupe.get_host_path(host_files[0])
+            try:
+                keeper_stat = os.stat(keeper_path)
+            except OSError:
+                continue
+            # the kept copy must be unchanged since the scan as well, its content replaces all duplicates
+            if keeper_stat.st_size != host_files[0]["size"] or abs(keeper_stat.st_mtime - host_files[0]["mtime"]) > 1:
+                continue
+            try:
+                if compute_md5(keeper_path) != host_files[0]["md5"]:
+                    continue
+            except OSError:
+                continue
+            for f in host_files[1:]:
+                dup_path = SinaraVolumeDedupe.get_host_path(f)
+                try:
+                    dup_stat = os.stat(dup_path)
+                    # hardlinks work only within one filesystem, skip files changed since the scan
+                    if dup_stat.st_dev != keeper_stat.st_dev or dup_stat.st_ino == keeper_stat.st_ino:
+                        continue
+                    if dup_stat.st_size != f["size"] or abs(dup_stat.st_mtime - f["mtime"]) > 1:
+                        continue
+                    tmp_path = f"{dup_path}.sinara-dedupe"
+                    os.link(keeper_path, tmp_path)
+                    os.replace(tmp_path, dup_path)
+                    linked_files += 1
+                    linked_bytes += f["size"]
+                except OSError as e:
+                    print(f"{fc.YELLOW}Cannot hardlink {dup_path}: {e}{fc.RESET}")
+        print(f"Hardlinked {linked_files} files, reclaimed {convert_size(linked_bytes)}")
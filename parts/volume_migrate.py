@@ -0,0 +1,137 @@
+import os
+import re
+from tabulate import tabulate
+
+from .docker_utils import docker_container_exists, \
+                          docker_container_running, \
+                          docker_container_stop, \
+                          docker_container_start, \
+                          docker_container_run, \
+                          docker_get_container_mounts, \
+                          ensure_docker_volume
+from .common_utils import get_expanded_path, get_cli_version
+from .config_manager import SinaraServerConfigManager
+from .server import SinaraServer
+from .volume import SinaraVolume
+
+class SinaraVolumeMigrateException(Exception):
+    pass
+
+class SinaraVolumeMigrate:
+
+    # tmp is cleaned on every server start, it is only remounted
+    copied_mounts = ["data", "work", "raw"]
+
+    # every mount is copied in background, top level entries of a mount are copied
+    # by parallel tar pipes, then both trees are checksummed and compared
+    migrate_script = """
+for m in {mounts}; do
+  (
+    if [ -n "$(ls -A /dst/$m)" ]; then echo "$m failed target_is_not_empty"; exit 0; fi
+    cd /src/$m
+    find . -mindepth 1 -maxdepth 1 -printf '%P\\0' | M=$m xargs -0 -r -P $(nproc) -n 1 sh -c 'tar -C /src/$M -cf - -- "$1" | tar -C /dst/$M -xpf -' _ || touch /tmp/$m.failed
+    if [ -f /tmp/$m.failed ]; then echo "$m failed copy_error"; exit 0; fi
+    find . -type f -print0 | xargs -0 -r -P $(nproc) -n 64 md5sum | sort -k 2 > /tmp/$m.src.md5
+    cd /dst/$m
+    find . -type f -print0 | xargs -0 -r -P $(nproc) -n 64 md5sum | sort -k 2 > /tmp/$m.dst.md5
+    if cmp -s /tmp/$m.src.md5 /tmp/$m.dst.md5; then echo "$m ok $(wc -l < /tmp/$m.src.md5)"; else echo "$m failed checksum_mismatch"; fi
+  ) &
+done
+wait
+"""
+
+    @staticmethod
+    def get_target_volumes(server_name, jovyan_root_path):
+        target_volumes = {}
+        volume_placement = SinaraServer.get_volume_placement()
+        for mount in SinaraVolume.mounts_by_name:
+            if jovyan_root_path:
+                folder = os.path.join(jovyan_root_path, mount)
+                os.makedirs(folder, exist_ok=True)
+                target_volumes[mount] = folder
+            else:
+                volume_name = f"jovyan-{mount}-{server_name}"
+                # volumes are created as server create does, in the placement folder of the mount if there is one
+                ensure_docker_volume(volume_name, already_exists_msg=f"Docker volume {volume_name} is found",
+                                     driver_opts=SinaraServer.get_volume_driver_opts(volume_placement, mount, volume_name))
+                target_volumes[mount] = volume_name
+        return target_volumes
+
+    @staticmethod
+    def get_calculated_args(calculated_args, jovyan_root_path):
+        calculated_args = re.sub(r" --(runMode|jovyanRootPath|jovyanDataPath|jovyanWorkPath|jovyanTmpPath|jovyanRawPath)=[^\s]+", "", calculated_args)
+        calculated_args = re.sub(r" --useCustomFolders(?=\s|$)", "", calculated_args)
+        if jovyan_root_path:
+            return f"{calculated_args} --runMode=b --jovyanRootPath={jovyan_root_path}"
+        return f"{calculated_args} --runMode=q"
+
+    @staticmethod
+    def copy_volumes(source_volumes, target_volumes):
+        mounts = [m for m in SinaraVolumeMigrate.copied_mounts if m in source_volumes]
+        docker_volumes = [f"{source_volumes[m]}:/src/{m}:ro" for m in mounts] + \
+                         [f"{target_volumes[m]}:/dst/{m}" for m in mounts]
+        m_image = SinaraVolume._get_maintenance_image()
+        migrate_cmd = SinaraVolumeMigrate.migrate_script.format(mounts=" ".join(mounts))
+        output = docker_container_run(m_image, ["sh", "-c", migrate_cmd], volumes=docker_volumes, remove=True)
+        results = {}
+        for line in output.decode("utf-8").splitlines():
+            mount, status, detail = line.split(" ", 2)
+            results[mount] = (status, detail)
+        return results
+
+    @staticmethod
+    def migrate(args):
+        container_name = args.instanceName
+        if not docker_container_exists(container_name):
+            raise SinaraVolumeMigrateException(f"Sinara server with name {container_name} doesn't exist")
+        cm = SinaraServerConfigManager(container_name, ensure_folders=False)
+        if not cm.server_config_exist():
+            raise SinaraVolumeMigrateException(f"Config of sinara server {container_name} is not found, migration is only possible for servers created by sinara cli")
+
+        jovyan_root_path = get_expanded_path(args.jovyanRootPath) if args.jovyanRootPath else None
+        source_volumes = {}
+        for mount in docker_get_container_mounts(container_name):
+            mount_key = [k for k, v in SinaraVolume.mounts_by_name.items() if v == mount["Destination"]]
+            if mount_key:
+                source_volumes[mount_key[0]] = mount["Name"] if mount["Type"] == "volume" else mount["Source"]
+        already_migrated = all([(os.sep in v) == bool(jovyan_root_path) for v in source_volumes.values()])
+        if already_migrated:
+            print(f"Sinara server {container_name} already uses {'host folders' if jovyan_root_path else 'docker volumes'}")
+            return
+
+        target_volumes = SinaraVolumeMigrate.get_target_volumes(container_name, jovyan_root_path)
+        was_running = docker_container_running(container_name)
+        if was_running:
+            print(f"Stopping sinara server {container_name} to copy its volumes...")
+            docker_container_stop(container_name)
+
+        results = SinaraVolumeMigrate.copy_volumes(source_volumes, target_volumes)
+        print(tabulate([[m, source_volumes[m], target_volumes[m], status, detail.replace("_", " ")] for m, (status, detail) in results.items()],
+                       ["volume", "from", "to", "status", "details"]))
+        failed = [m for m, (status, detail) in results.items() if status != "ok"]
+        if failed:
+            if was_running:
+                docker_container_start(container_name)
+            raise SinaraVolumeMigrateException(f"Failed to migrate {', '.join(failed)} volumes of sinara server {container_name}, the server is left unchanged")
+
+        server_config = cm.load_server_config()
+        server_params = dict(server_config["container"])
+        mount_points = list(SinaraVolume.mounts_by_name.values())
+        server_params["volumes"] = [v for v in server_params["volumes"] if v.split(":")[-1] not in mount_points] + \
+                                   [f"{target_volumes[m]}:{mount_point}" for m, mount_point in SinaraVolume.mounts_by_name.items()]
+        server_params["ports"] = SinaraServer.get_container_ports_mapping(container_name)
+        server_params["device_requests"] = SinaraServer.get_device_requests(server_params.get("device_requests"))
+        server_params["labels"] = dict(server_params["labels"], **{"sinaraml.cli.version": str(get_cli_version())})
+
+        print(f"Recreating sinara server {container_name} container with new volumes...")
+        SinaraServer.replace_container(container_name, server_params, was_running)
+        if not was_running:
+            docker_container_stop(container_name)
+
+        server_config["cmd"]["calculated_args"] = SinaraVolumeMigrate.get_calculated_args(server_config["cmd"]["calculated_args"], jovyan_root_path)
+        server_config["container"] = server_params
+        cm.save_server_config(server_config)
+
+        old_volumes = "\n".join([source_volumes[m] for m in source_volumes])
+        print(f"Sinara server {container_name} migrated to {'host folders' if jovyan_root_path else 'docker volumes'}\n" \
+              f"Previous volumes are kept, remove them when no longer needed:\n{old_volumes}")
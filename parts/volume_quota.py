@@ -0,0 +1,208 @@
+import json
+import os
+import time
+from pathlib import Path
+from tabulate import tabulate
+
+from .docker_utils import docker_list_containers
+from .common_utils import convert_size, get_folder_size, platform_is_wsl, fc
+from .config_manager import SinaraGlobalConfigManager, SinaraServerConfigManager
+from .volume import SinaraVolume
+
+class SinaraVolumeQuota:
+
+    total_key = "total"
+    history_max_samples = 500
+    # samples closer than this are merged, keeps the history compact for frequent watch runs
+    history_min_interval = 600
+    # docker volumes are measured by a du container, their sizes are reused for this long between watch ticks
+    docker_volume_size_ttl = 1800
+
+    @staticmethod
+    def get_quotas(server_name):
+        cm = SinaraServerConfigManager(server_name, ensure_folders=False)
+        if not cm.server_config_exist():
+            return {}
+        return cm.load_server_config().get("volume_quotas", {})
+
+    @staticmethod
+    def set_quota(server_name, mount_key, quota):
+        cm = SinaraServerConfigManager(server_name, ensure_folders=False)
+        if not cm.server_config_exist():
+            raise Exception(f"Config of sinara server {server_name} is not found, quotas can only be set for servers created by sinara cli")
+        server_config = cm.load_server_config()
+        quotas = server_config.get("volume_quotas", {})
+        if quota:
+            quotas[mount_key] = quota
+        else:
+            quotas.pop(mount_key, None)
+        server_config["volume_quotas"] = quotas
+        cm.save_server_config(server_config)
+
+    @staticmethod
+    def _get_docker_volume_sizes_path():
+        gcm = SinaraGlobalConfigManager()
+        return Path(gcm.cache_folder) / "volume_usage" / "docker_volumes.json"
+
+    @staticmethod
+    def load_docker_volume_sizes():
+        try:
+            with open(SinaraVolumeQuota._get_docker_volume_sizes_path(), "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    @staticmethod
+    def save_docker_volume_sizes(volume_sizes):
+        sizes_path = SinaraVolumeQuota._get_docker_volume_sizes_path()
+        sizes_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_sizes_path = sizes_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_sizes_path, "w") as f:
+            json.dump(volume_sizes, f)
+        os.replace(tmp_sizes_path, sizes_path)
+
+    @staticmethod
+    def get_docker_volume_sizes(volume_names):
+        # cached sizes: {volume name: [timestamp, bytes]}, only volumes measured longer than ttl ago are measured again
+        now = time.time()
+        cached_sizes = SinaraVolumeQuota.load_docker_volume_sizes()
+        stale_volume_names = [name for name in volume_names
+                              if name not in cached_sizes or now - cached_sizes[name][0] >= SinaraVolumeQuota.docker_volume_size_ttl]
+        if stale_volume_names:
+            volume_sizes = SinaraVolume.measure_docker_volumes(stale_volume_names)
+            for name in stale_volume_names:
+                cached_sizes[name] = [now, volume_sizes.get(name, 0)]
+            SinaraVolumeQuota.save_docker_volume_sizes(cached_sizes)
+        return {name: cached_sizes[name][1] for name in volume_names}
+
+    @staticmethod
+    def forget_docker_volume_sizes(volume_names):
+        cached_sizes = SinaraVolumeQuota.load_docker_volume_sizes()
+        if any(name in cached_sizes for name in volume_names):
+            for name in volume_names:
+                cached_sizes.pop(name, None)
+            SinaraVolumeQuota.save_docker_volume_sizes(cached_sizes)
+
+    @staticmethod
+    def get_usage(sinara_container):
+        # docker volumes are measured with du and cached for a while, host folders are walked without the folder
+        # size cache, it misses files growing in place
+        usage = {}
+        docker_volumes = {}
+        for mount in sinara_container.attrs["Mounts"]:
+            mount_key = [k for k, v in SinaraVolume.mounts_by_name.items() if v == mount["Destination"]]
+            if not mount_key:
+                continue
+            if mount["Type"] == "volume":
+                docker_volumes[mount["Name"]] = mount_key[0]
+            elif mount["Type"] == "bind":
+                source = mount["Source"]
+                if platform_is_wsl():
+                    source = SinaraVolume._get_bind_vol_wsl_source(sinara_container, mount["Destination"])
+                usage[mount_key[0]] = get_folder_size(source, use_cache=False) if os.path.exists(source) else 0
+        volume_sizes = SinaraVolumeQuota.get_docker_volume_sizes(list(docker_volumes.keys()))
+        for volume_name, mount_key in docker_volumes.items():
+            usage[mount_key] = volume_sizes.get(volume_name, 0)
+        usage[SinaraVolumeQuota.total_key] = sum(usage.values())
+        return usage
+
+    @staticmethod
+    def _get_history_path(server_name):
+        gcm = SinaraGlobalConfigManager()
+        return Path(gcm.cache_folder) / "volume_usage" / f"{server_name}.json"
+
+    @staticmethod
+    def load_history(server_name):
+        try:
+            with open(SinaraVolumeQuota._get_history_path(server_name), "r") as f:
+                return json.load(f)
+        except Exception:
+            return []
+
+    @staticmethod
+    def add_history_sample(server_name, usage, timestamp):
+        history = SinaraVolumeQuota.load_history(server_name)
+        # history samples: [timestamp, {mount: bytes}]
+        if history and timestamp - history[-1][0] < SinaraVolumeQuota.history_min_interval:
+            history[-1] = [timestamp, usage]
+        else:
+            history.append([timestamp, usage])
+        history = history[-SinaraVolumeQuota.history_max_samples:]
+        history_path = SinaraVolumeQuota._get_history_path(server_name)
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(history_path, "w") as f:
+            json.dump(history, f)
+        return history
+
+    @staticmethod
+    def get_growth_per_day(history, mount_key, window=7 * 86400):
+        samples = [(t, u[mount_key]) for t, u in history if mount_key in u and t >= history[-1][0] - window]
+        if len(samples) < 2 or samples[-1][0] <= samples[0][0]:
+            return None
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0]) * 86400
+
+    @staticmethod
+    def check_server(server_name, sinara_container, quotas, dry_run=False):
+        usage = SinaraVolumeQuota.get_usage(sinara_container)
+        history = SinaraVolumeQuota.add_history_sample(server_name, usage, time.time())
+
+        rows = []
+        for mount_key, quota in quotas.items():
+            used = usage.get(mount_key, 0)
+            ratio = used / quota["limit"] if quota["limit"] else 0
+            growth = SinaraVolumeQuota.get_growth_per_day(history, mount_key)
+            days_to_full = (quota["limit"] - used) / growth if growth and growth > 0 and used < quota["limit"] else None
+            status = "ok"
+            if ratio >= 1:
+                status = f"{fc.RED}over quota{fc.RESET}"
+            elif ratio >= quota["warn_ratio"]:
+                status = f"{fc.YELLOW}warning{fc.RESET}"
+            rows.append([mount_key, convert_size(used), convert_size(quota["limit"]), f"{round(ratio * 100, 1)}%",
+                         "N/A" if growth is None else f"{'-' if growth < 0 else ''}{convert_size(abs(int(growth)))}/day",
+                         "N/A" if days_to_full is None else round(days_to_full, 1),
+                         status])
+
+            if ratio >= quota["warn_ratio"] and quota.get("auto_clean") and mount_key != SinaraVolumeQuota.total_key:
+                SinaraVolumeQuota.auto_clean(server_name, mount_key, quota["auto_clean"], dry_run)
+
+        print(f"{fc.CYAN}Server:{fc.RESET} {fc.WHITE}{server_name}{fc.RESET}")
+        print(tabulate(rows, ["volume", "used", "quota", "usage", "growth", "days to full", "status"]))
+        print()
+
+    @staticmethod
+    def auto_clean(server_name, mount_key, clean_policy, dry_run=False):
+        active_server_volumes, _ = SinaraVolume.get_servers_volumes(size_source="none")
+        volumes = [v for v in active_server_volumes.get(server_name, {}).get("volumes", [])
+                   if v["mounted_at"] == SinaraVolume.mounts_by_name[mount_key]]
+        if not volumes:
+            return
+        print(f"{'Checking' if dry_run else 'Running'} clean policy for {mount_key} volume of sinara server {server_name}")
+        results = SinaraVolume.clean_files(volumes, clean_policy.get("days_keep", SinaraVolume.days_to_keep),
+                                           clean_policy.get("min_size"), clean_policy.get("patterns"), dry_run)
+        for volume, files_count, files_size in results:
+            print(f"{volume['name']}: {files_count} files, {convert_size(files_size)} {'reclaimable' if dry_run else 'reclaimed'}")
+        if not dry_run:
+            # cleaned volumes are measured again on the next check
+            SinaraVolumeQuota.forget_docker_volume_sizes([volume["name"] for volume in volumes])
+
+    @staticmethod
+    def check(server_name=None, dry_run=False):
+        sinara_containers = docker_list_containers("sinaraml.platform")
+        for sinara_container in sinara_containers:
+            container_name = sinara_container.attrs["Names"][0][1:]
+            if server_name and container_name != server_name:
+                continue
+            quotas = SinaraVolumeQuota.get_quotas(container_name)
+            if quotas:
+                SinaraVolumeQuota.check_server(container_name, sinara_container, quotas, dry_run)
+
+    @staticmethod
+    def watch(interval_minutes, server_name=None, dry_run=False):
+        try:
+            while True:
+                SinaraVolumeQuota.check(server_name, dry_run)
+                if not interval_minutes:
+                    break
+                time.sleep(interval_minutes * 60)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,170 @@
+import os
+import time
+import stat
+import shlex
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+from .docker_utils import docker_container_create, \
+                          docker_container_remove, \
+                          docker_container_run, \
+                          docker_put_archive
+from .common_utils import get_expanded_path, convert_size, fc
+from .volume import SinaraVolume
+
+class SinaraVolumeSeedException(Exception):
+    pass
+
+class SinaraVolumeSeed:
+
+    seed_root = "/seed"
+    # files up to this size are read whole by the reader pool, larger ones are streamed in chunks
+    prefetch_size = 8 * 1024 * 1024
+    chunk_size = 4 * 1024 * 1024
+    # jovyan:users in sinara server images
+    owner_uid = 1000
+    owner_gid = 100
+
+    @staticmethod
+    def get_existing_files(volume_source, dest):
+        m_image = SinaraVolume._get_maintenance_image()
+        dest_path = shlex.quote(f"{SinaraVolumeSeed.seed_root}/{dest}")
+        list_cmd = f"mkdir -p {dest_path} && cd {dest_path} && find . -type f -printf '%P\\t%s\\t%T@\\n'"
+        output = docker_container_run(m_image, ["sh", "-c", list_cmd], volumes=[f"{volume_source}:{SinaraVolumeSeed.seed_root}"], remove=True)
+        existing = {}
+        for line in output.decode("utf-8", "surrogateescape").splitlines():
+            path, size, mtime = line.rsplit("\t", 2)
+            existing[path] = (int(size), int(float(mtime)))
+        return existing
+
+    @staticmethod
+    def scan_source(src_root, existing):
+        entries = []
+        skipped = 0
+        folders = [""]
+        while folders:
+            folder = folders.pop()
+            with os.scandir(os.path.join(src_root, folder)) as it:
+                for entry in it:
+                    rel_path = os.path.join(folder, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((rel_path, entry.stat(follow_symlinks=False)))
+                        folders.append(rel_path)
+                    elif entry.is_symlink():
+                        entries.append((rel_path, entry.stat(follow_symlinks=False)))
+                    elif entry.is_file():
+                        st = entry.stat()
+                        if existing.get(rel_path) == (st.st_size, int(st.st_mtime)):
+                            skipped += 1
+                            continue
+                        entries.append((rel_path, st))
+        return entries, skipped
+
+    @staticmethod
+    def get_tarinfo(src_root, dest, rel_path, st):
+        info = tarfile.TarInfo(os.path.join(dest, rel_path))
+        info.mode = st.st_mode & 0o7777
+        info.mtime = int(st.st_mtime)
+        info.uid = SinaraVolumeSeed.owner_uid
+        info.gid = SinaraVolumeSeed.owner_gid
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(os.path.join(src_root, rel_path))
+        else:
+            info.size = st.st_size
+        return info
+
+    @staticmethod
+    def read_file(path, size):
+        if size > SinaraVolumeSeed.prefetch_size:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def generate_tar(src_root, dest, entries, stats):
+        # small files are read ahead by a pool of readers while earlier ones are sent
+        pending = deque()
+        max_pending = cpu_count() * 4
+        entries_iter = iter(entries)
+        with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+            def fill():
+                while len(pending) < max_pending:
+                    try:
+                        rel_path, st = next(entries_iter)
+                    except StopIteration:
+                        return
+                    info = SinaraVolumeSeed.get_tarinfo(src_root, dest, rel_path, st)
+                    future = executor.submit(SinaraVolumeSeed.read_file, os.path.join(src_root, rel_path), info.size) if info.isreg() else None
+                    pending.append((rel_path, info, future))
+
+            fill()
+            while pending:
+                rel_path, info, future = pending.popleft()
+                fill()
+                data = future.result() if future else None
+                if info.isreg() and data is not None and len(data) != info.size:
+                    # file changed while reading, send what was read
+                    info.size = len(data)
+                yield info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+                if not info.isreg():
+                    continue
+                sent = 0
+                if data is not None:
+                    yield data
+                    sent = len(data)
+                else:
+                    with open(os.path.join(src_root, rel_path), "rb") as f:
+                        while sent < info.size:
+                            chunk = f.read(min(SinaraVolumeSeed.chunk_size, info.size - sent))
+                            if not chunk:
+                                break
+                            yield chunk
+                            sent += len(chunk)
+                    if sent < info.size:
+                        # file shrank while reading, the tar entry size is already sent
+                        yield tarfile.NUL * (info.size - sent)
+                        sent = info.size
+                padding = -sent % tarfile.BLOCKSIZE
+                if padding:
+                    yield tarfile.NUL * padding
+                stats["files"] += 1
+                stats["bytes"] += sent
+        yield tarfile.NUL * tarfile.BLOCKSIZE * 2
+
+    @staticmethod
+    def seed(args):
+        src_root = get_expanded_path(args.src)
+        if not os.path.isdir(src_root):
+            raise SinaraVolumeSeedException(f"Source folder {src_root} is not found")
+        volume = SinaraVolume.get_server_volume(args.instanceName, SinaraVolume.mounts_by_name[args.mount])
+        volume_source = SinaraVolume.get_volume_mount_source(volume)
+        dest = (args.dest or "").strip("/")
+
+        print(f"Comparing {src_root} with {args.mount} volume {volume['name']}...")
+        existing = SinaraVolumeSeed.get_existing_files(volume_source, dest)
+        entries, skipped = SinaraVolumeSeed.scan_source(src_root, existing)
+        if not [st for rel_path, st in entries if not stat.S_ISDIR(st.st_mode)]:
+            print(f"Nothing to seed, {skipped} files are already present in {volume['name']}")
+            return
+
+        m_image = SinaraVolume._get_maintenance_image()
+        seed_container = f"sinara-seed-{args.instanceName}"
+        docker_container_remove(seed_container)
+        docker_container_create(m_image, name=seed_container, volumes=[f"{volume_source}:{SinaraVolumeSeed.seed_root}"])
+        stats = {"files": 0, "bytes": 0}
+        start_time = time.time()
+        try:
+            docker_put_archive(seed_container, SinaraVolumeSeed.seed_root, SinaraVolumeSeed.generate_tar(src_root, dest, entries, stats))
+        finally:
+            docker_container_remove(seed_container)
+        elapsed = max(time.time() - start_time, 0.001)
+
+        print(f"Seeded {stats['files']} files ({convert_size(stats['bytes'])}) into {volume['name']} in {round(elapsed, 1)}s, " \
+              f"{convert_size(int(stats['bytes'] / elapsed))}/s")
+        if skipped:
+            print(f"{fc.CYAN}Skipped {skipped} files already present with the same size and modification time{fc.RESET}")
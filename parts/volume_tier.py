@@ -0,0 +1,131 @@
+import shlex
+import datetime
+from tabulate import tabulate
+
+from .docker_utils import docker_container_run, ensure_docker_volume
+from .common_utils import convert_size, fc
+from .volume import SinaraVolume
+
+class SinaraVolumeTier:
+
+    archive_volume = "sinara-archive"
+    # index.tsv lines: <path relative to the volume root>\t<archive run>/<archive part>
+    archive_index = "index.tsv"
+    # index lines of the path itself or of files below it, p is the path relative to the volume root
+    path_match = '$1 == p || index($1, p "/") == 1 || p == ""'
+
+    # archive runs in the maintenance container: the cold file list is split into one
+    # part per cpu, parts are compressed in parallel, originals are removed only if all
+    # parts succeeded and only if they were not modified while archiving
+    tier_script = """
+set -e
+cd /src
+run_dir=/archive/{archive_dir}/{run}
+mkdir -p $run_dir
+find . -type f {find_expr} -print | sed 's|^\\./||' | sort > $run_dir/files.txt
+if [ ! -s $run_dir/files.txt ]; then rm -rf $run_dir; echo 0 0; exit 0; fi
+parts=$(nproc)
+if [ $parts -gt 32 ]; then parts=32; fi
+split -n l/$parts -d $run_dir/files.txt $run_dir/part.
+for part in $run_dir/part.??; do
+  ( (tar -cf - --verbatim-files-from -T $part || touch $part.failed) | gzip -1 > $part.tar.gz || touch $part.failed ) &
+done
+wait
+if ls $run_dir/*.failed > /dev/null 2>&1; then echo "archiving failed, no files removed" >&2; exit 1; fi
+find . -type f ! -newer $run_dir/files.txt -print | sed 's|^\\./||' | sort | comm -12 $run_dir/files.txt - > $run_dir/removed.txt
+for part in $run_dir/part.??; do
+  comm -12 $part $run_dir/removed.txt | sed "s|\\$|\\t{run}/$(basename $part).tar.gz|" >> /archive/{archive_dir}/{index}
+done
+xargs -d '\\n' -r rm -f -- < $run_dir/removed.txt
+echo $(wc -l < $run_dir/removed.txt) $(du -sb $run_dir | cut -f1)
+rm -f $run_dir/part.?? $run_dir/files.txt
+"""
+
+    # files present in the volume are kept, they are newer than their archived copies; restored files are
+    # removed from the index, so a later untier never overwrites them with stale copies
+    restore_script = """
+set -e
+cd /src
+index_path=/archive/{archive_dir}/{index}
+awk -F'\\t' -v p={path_filter} '{path_match}' $index_path > /tmp/matches.txt
+: > /tmp/restored.txt
+: > /tmp/skipped.txt
+for part in $(awk -F'\\t' '{{print $2}}' /tmp/matches.txt | sort -u); do
+  awk -F'\\t' -v part="$part" '$2 == part {{print $1}}' /tmp/matches.txt | while IFS= read -r f; do
+    if [ -e "$f" ] || [ -L "$f" ]; then echo "$f" >> /tmp/skipped.txt; else echo "$f"; fi
+  done > /tmp/restore.txt
+  if [ -s /tmp/restore.txt ]; then
+    tar -xzf /archive/{archive_dir}/$part --skip-old-files --verbatim-files-from -T /tmp/restore.txt
+    sed "s|\\$|\\t$part|" /tmp/restore.txt >> /tmp/restored.txt
+  fi
+done
+if [ -s /tmp/restored.txt ]; then
+  awk 'NR == FNR {{restored[$0]; next}} !($0 in restored)' /tmp/restored.txt $index_path > $index_path.tmp
+  mv $index_path.tmp $index_path
+fi
+echo $(wc -l < /tmp/restored.txt) $(wc -l < /tmp/skipped.txt)
+"""
+
+    @staticmethod
+    def get_archive_mount(args):
+        if args.archivePath:
+            return args.archivePath
+        ensure_docker_volume(SinaraVolumeTier.archive_volume, already_exists_msg="Docker volume with sinara archives is found")
+        return SinaraVolumeTier.archive_volume
+
+    @staticmethod
+    def get_find_expression(days):
+        return f"-atime +{days} -mtime +{days}"
+
+    @staticmethod
+    def tier(args):
+        volume = SinaraVolume.get_server_volume(args.instanceName, SinaraVolume.mounts_by_name[args.mount])
+        find_expr = SinaraVolumeTier.get_find_expression(args.days)
+        m_image = SinaraVolume._get_maintenance_image()
+        source = SinaraVolume.get_volume_mount_source(volume)
+
+        if args.dryRun:
+            count_cmd = f"cd /src && find . -type f {find_expr} -printf '%s\\n' | awk '{{n++; s+=$1}} END {{printf \"%d %.0f\\n\", n, s}}'"
+            output = docker_container_run(m_image, ["sh", "-c", count_cmd], volumes=[f"{source}:/src:ro"], remove=True)
+            files_count, files_size = output.decode("utf-8").split()
+            print(f"{files_count} files ({convert_size(int(files_size))}) in {volume['name']} were not accessed or modified for {args.days} days")
+            return
+
+        archive_mount = SinaraVolumeTier.get_archive_mount(args)
+        run = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        tier_cmd = SinaraVolumeTier.tier_script.format(archive_dir=f"{args.instanceName}/{args.mount}", run=run,
+                                                       find_expr=find_expr, index=SinaraVolumeTier.archive_index)
+        print(f"Archiving files of {volume['name']} not accessed or modified for {args.days} days...")
+        output = docker_container_run(m_image, ["sh", "-c", tier_cmd],
+                                      volumes=[f"{source}:/src", f"{archive_mount}:/archive"], remove=True)
+        files_count, archive_size = output.decode("utf-8").split()[-2:]
+        print(f"Archived {files_count} files of {volume['name']} into {archive_mount} ({convert_size(int(archive_size))} compressed)\n" \
+              f"To restore them use command:\nsinara volume untier --instanceName {args.instanceName} --mount {args.mount} --path <path>")
+
+    @staticmethod
+    def untier(args):
+        volume = SinaraVolume.get_server_volume(args.instanceName, SinaraVolume.mounts_by_name[args.mount])
+        m_image = SinaraVolume._get_maintenance_image()
+        source = SinaraVolume.get_volume_mount_source(volume)
+        archive_mount = args.archivePath or SinaraVolumeTier.archive_volume
+        archive_dir = f"{args.instanceName}/{args.mount}"
+        # paths are relative to the volume root, a folder path restores everything below it
+        path_filter = args.path.strip("/")
+        if args.list:
+            list_cmd = f"awk -F'\\t' -v p={shlex.quote(path_filter)} '{SinaraVolumeTier.path_match}' /archive/{archive_dir}/{SinaraVolumeTier.archive_index} 2>/dev/null || true"
+            output = docker_container_run(m_image, ["sh", "-c", list_cmd], volumes=[f"{archive_mount}:/archive:ro"], remove=True)
+            rows = [line.split("\t") for line in output.decode("utf-8").splitlines() if line]
+            print(tabulate(rows, ["path", "archive"]))
+            return
+
+        restore_cmd = SinaraVolumeTier.restore_script.format(archive_dir=archive_dir, index=SinaraVolumeTier.archive_index,
+                                                             path_filter=shlex.quote(path_filter), path_match=SinaraVolumeTier.path_match)
+        output = docker_container_run(m_image, ["sh", "-c", restore_cmd],
+                                      volumes=[f"{source}:/src", f"{archive_mount}:/archive"], remove=True)
+        restored, skipped = [int(count) for count in output.decode("utf-8").split()[-2:]]
+        if not restored and not skipped:
+            print(f"{fc.YELLOW}No archived files matching '{args.path}' found for {volume['name']}{fc.RESET}")
+        else:
+            print(f"Restored {restored} files into {volume['name']}")
+        if skipped:
+            print(f"{fc.YELLOW}Skipped {skipped} archived files which already exist in {volume['name']}{fc.RESET}")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# parts modules are imported as the 'parts' package of the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,21 @@
+import argparse
+
+from parts.command_handler import CommandHandler
+
+
+def test_get_requested_subject():
+    assert CommandHandler.get_requested_subject(["sinara", "volume", "list"]) == "volume"
+    assert CommandHandler.get_requested_subject(["sinara", "--verbose", "server", "create"]) == "server"
+    assert CommandHandler.get_requested_subject(["sinara", "--foo", "bar", "model", "list"]) == "model"
+    assert CommandHandler.get_requested_subject(["sinara", "--help"]) is None
+
+
+def test_add_command_handlers_loads_only_requested_subject(monkeypatch):
+    monkeypatch.setattr("sys.argv", ["sinara", "--foo", "bar", "volume", "list"])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--foo")
+    subject_parser = parser.add_subparsers(title='subject', dest='subject')
+    CommandHandler.add_command_handlers(parser, subject_parser)
+    args = parser.parse_args(["--foo", "bar", "volume", "list"])
+    assert args.subject == "volume" and args.action == "list" and callable(args.func)
+    assert sorted(subject_parser.choices) == ["model", "server", "volume"]
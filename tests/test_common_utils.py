@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from parts import common_utils
+from parts.common_utils import trash_folder_contents, purge_folders_in_background, get_purge_statuses
+from parts.config_manager import SinaraGlobalConfigManager
+
+
+def wait_for(condition, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def test_trash_folder_contents_keeps_folder(tmp_path):
+    folder = tmp_path / "data"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "sub" / "a.txt").write_text("a")
+    trash_path = trash_folder_contents(folder)
+    assert folder.is_dir() and not any(folder.iterdir())
+    assert (Path(trash_path) / "sub" / "a.txt").read_text() == "a"
+
+
+def test_purge_folders_in_background(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    folder = tmp_path / "data"
+    for i in range(50):
+        (folder / f"d{i}").mkdir(parents=True)
+        (folder / f"d{i}" / "f.txt").write_text("x")
+    trash_path = trash_folder_contents(folder)
+    purge_folders_in_background([trash_path])
+    assert wait_for(lambda: not os.path.exists(trash_path))
+    assert wait_for(lambda: not get_purge_statuses())
+    assert folder.is_dir()
+
+
+def test_interrupted_purge_is_resumed(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    trash_path = tmp_path / ".sinara-trash-data"
+    (trash_path / "sub").mkdir(parents=True)
+    (trash_path / "sub" / "a.txt").write_text("a")
+    finished = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    status_folder = SinaraGlobalConfigManager().purge_status_folder
+    status_folder.mkdir(parents=True)
+    with open(status_folder / "interrupted.json", "w") as f:
+        json.dump({"pid": int(finished.stdout), "paths": [str(trash_path)], "deleted_files": 0}, f)
+
+    purge_folders_in_background([])
+    assert wait_for(lambda: not trash_path.exists())
+    assert not (status_folder / "interrupted.json").exists()
+
+
+def test_purge_with_reused_pid_is_not_alive():
+    status = {"pid": os.getpid(), "start_time": common_utils._get_process_start_time(os.getpid())}
+    assert common_utils._purge_is_alive(status)
+    if status["start_time"] is not None:
+        assert not common_utils._purge_is_alive(dict(status, start_time=status["start_time"] - 1))
+
+
+def test_get_folder_size(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    root = tmp_path / "data"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "a" / "b" / "f1").write_bytes(b"x" * 100)
+    (root / "f2").write_bytes(b"x" * 10)
+    (root / ".hidden").mkdir()
+    (root / ".hidden" / "f3").write_bytes(b"x" * 1000)
+    assert common_utils.get_folder_size(root) == 110
+
+    # new entries change the folder mtime and are seen through the cache
+    (root / "a" / "f4").write_bytes(b"x" * 5)
+    assert common_utils.get_folder_size(root) == 115
+
+    # files growing in place are only seen without the cache
+    with open(root / "a" / "b" / "f1", "ab") as f:
+        f.write(b"x" * 100)
+    assert common_utils.get_folder_size(root) == 115
+    assert common_utils.get_folder_size(root, use_cache=False) == 215
+
+
+def test_parse_size():
+    assert common_utils.parse_size(None) is None
+    assert common_utils.parse_size(1024) == 1024
+    assert common_utils.parse_size("512") == 512
+    assert common_utils.parse_size("512m") == 512 * 1024**2
+    assert common_utils.parse_size("8g") == 8 * 1024**3
+    assert common_utils.parse_size("2GB") == 2 * 1024**3
+    assert common_utils.parse_size(" 1.5 t ") == int(1.5 * 1024**4)
+
+
+def test_parse_size_rejects_invalid_values():
+    for size in ["", "g", "8x", "-1g", "1 0g"]:
+        with pytest.raises(ValueError):
+            common_utils.parse_size(size)
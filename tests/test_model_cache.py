@@ -0,0 +1,122 @@
+import io
+import os
+import json
+import tarfile
+import zipfile
+import hashlib
+
+import pytest
+
+from parts import model_cache
+from parts.model_cache import SinaraModelCache
+
+
+def make_zip(files):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return data.getvalue()
+
+
+def make_archive(folder_name, files):
+    # docker archives start with the basename of the copied folder
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(f"{folder_name}/{name}")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+@pytest.fixture
+def container(tmp_path, monkeypatch):
+    # bentoservices of a fake sinara server container: {bentoservice path: {file name: content}}
+    monkeypatch.setenv("HOME", str(tmp_path))
+    bentoservices = {}
+
+    def docker_read_file(container_name, file_path):
+        folder, name = file_path.rsplit("/", 1)
+        return bentoservices.get(folder, {}).get(name)
+
+    def docker_get_archive(container_name, src_path):
+        data = make_archive(src_path.rstrip("/").split("/")[-1], bentoservices[src_path])
+        return iter([data[i:i + 1000] for i in range(0, len(data), 1000)])
+
+    monkeypatch.setattr(model_cache, "docker_read_file", docker_read_file)
+    monkeypatch.setattr(model_cache, "docker_get_archive", docker_get_archive)
+    return bentoservices
+
+
+def make_bentoservice(run_id, artifacts):
+    return {"_SUCCESS": b"", "save_info.txt": f"run {run_id}".encode(), "Dockerfile": b"FROM base",
+            "model.zip": make_zip({f"Svc/artifacts/{name}": content for name, content in artifacts.items()})}
+
+
+def test_get_key(container):
+    container["/runs/1/bento"] = make_bentoservice(1, {})
+    container["/runs/2/bento"] = make_bentoservice(2, {})
+    container["/runs/3/bento"] = {"model.zip": b""}
+    key = SinaraModelCache.get_key("s", "/runs/1/bento")
+    assert key == SinaraModelCache.get_key("s", "/runs/1/bento")
+    assert key != SinaraModelCache.get_key("s", "/runs/2/bento")
+    assert SinaraModelCache.get_key("s", "/runs/3/bento") is None
+
+
+def test_get_entry_reuses_unchanged_objects(container, capsys):
+    container["/runs/1/bento"] = make_bentoservice(1, {"model.onnx": b"weights", "vocab.txt": b"words"})
+    container["/runs/2/bento"] = make_bentoservice(2, {"model.onnx": b"new weights", "vocab.txt": b"words"})
+
+    entry_dir = SinaraModelCache.get_entry("s", "/runs/1/bento")
+    assert (entry_dir / "Svc" / "artifacts" / "model.onnx").read_bytes() == b"weights"
+    assert (entry_dir / "Dockerfile").read_bytes() == b"FROM base"
+    assert not (entry_dir / "model.zip").exists()
+    assert "2 new files stored" in capsys.readouterr().out
+
+    assert SinaraModelCache.get_entry("s", "/runs/1/bento") == entry_dir
+    assert "Using cached bentoservice" in capsys.readouterr().out
+
+    other_dir = SinaraModelCache.get_entry("s", "/runs/2/bento")
+    assert "1 new files stored" in capsys.readouterr().out
+    vocab, other_vocab = entry_dir / "Svc" / "artifacts" / "vocab.txt", other_dir / "Svc" / "artifacts" / "vocab.txt"
+    assert os.stat(vocab).st_ino == os.stat(other_vocab).st_ino
+
+    # objects are named by the sha256 of their content
+    manifest = json.loads((other_dir / SinaraModelCache.manifest_name).read_text())
+    assert os.path.basename(manifest["Svc/artifacts/model.onnx"]) == hashlib.sha256(b"new weights").hexdigest()
+    assert SinaraModelCache.get_content_digests(other_dir, ["Svc/artifacts/model.onnx", "Dockerfile"]) == {
+        "Svc/artifacts/model.onnx": f"sha256:{hashlib.sha256(b'new weights').hexdigest()}",
+        "Dockerfile": f"md5:{hashlib.md5(b'FROM base').hexdigest()}"}
+
+
+def test_get_files_digests_cached_only(container):
+    container["/runs/1/bento"] = make_bentoservice(1, {"model.onnx": b"weights"})
+    entry_dir = SinaraModelCache.get_entry("s", "/runs/1/bento")
+    names = ["Svc/artifacts/model.onnx"]
+    assert SinaraModelCache.get_files_digests(entry_dir, names, ("md5",), cached_only=True) == {}
+    SinaraModelCache.save_files_digests(entry_dir, {"Svc/artifacts/model.onnx": {"md5": "streamed"}})
+    assert SinaraModelCache.get_files_digests(entry_dir, names, ("md5",), cached_only=True) == \
+        {"Svc/artifacts/model.onnx": {"md5": "streamed"}}
+
+
+def test_evict_removes_least_recently_used_entries(container, monkeypatch):
+    for run_id in range(3):
+        container[f"/runs/{run_id}/bento"] = make_bentoservice(run_id, {"model.onnx": bytes([run_id]) * 1000, "shared.bin": b"s" * 1000})
+    entry_dirs = [SinaraModelCache.get_entry("s", f"/runs/{run_id}/bento") for run_id in range(3)]
+    for i, entry_dir in enumerate(entry_dirs):
+        os.utime(entry_dir, (1000 + i, 1000 + i))
+    cache_folder = SinaraModelCache.get_cache_folder()
+    # hardlinked objects are counted once
+    full_size = SinaraModelCache.get_cache_size(cache_folder)
+    assert full_size < 3 * 2 * 1000 + 3 * 200
+
+    monkeypatch.setattr(SinaraModelCache, "get_size_limit", staticmethod(lambda: full_size - 1))
+    SinaraModelCache.evict(keep_entry_dirs=[entry_dirs[0]])
+    assert [entry_dir.exists() for entry_dir in entry_dirs] == [True, False, True]
+    assert len(list((cache_folder / "objects").glob("*/*"))) == 3
+
+    monkeypatch.setattr(SinaraModelCache, "get_size_limit", staticmethod(lambda: 0))
+    SinaraModelCache.evict()
+    assert not any(entry_dir.exists() for entry_dir in entry_dirs)
+    assert not list((cache_folder / "objects").glob("*/*"))
@@ -0,0 +1,88 @@
+import io
+import hashlib
+import tarfile
+
+from parts.model_context import SinaraModelContext
+
+
+def make_entries(files):
+    entries = {}
+    for name, data in files.items():
+        SinaraModelContext.set_entry_data(entries, name, data)
+    return entries
+
+
+def read_context(entries, *args, **kwargs):
+    data = b"".join(SinaraModelContext.generate_context_tar(entries, *args, **kwargs))
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tar:
+        return {member.name: tar.extractfile(member).read() if member.isfile() else None for member in tar}
+
+
+def test_get_context_entries_skips_model_zip(tmp_path):
+    (tmp_path / "Svc" / "artifacts").mkdir(parents=True)
+    (tmp_path / "Svc" / "artifacts" / "model.onnx").write_bytes(b"weights")
+    (tmp_path / "model.zip").write_bytes(b"zip")
+    (tmp_path / "_SUCCESS").write_bytes(b"")
+    (tmp_path / "Dockerfile").write_bytes(b"FROM base")
+    entries = SinaraModelContext.get_context_entries(tmp_path)
+    assert sorted(entries) == ["Dockerfile", "Svc/artifacts/model.onnx"]
+    assert SinaraModelContext.read_entry(entries, "Svc/artifacts/model.onnx") == b"weights"
+
+
+def test_generate_context_tar_hashes_artifacts_while_streaming():
+    entries = make_entries({"Dockerfile": b"FROM base", "Svc/artifacts/model.onnx": b"weights", "Svc/artifacts/vocab.txt": b"words"})
+    artifacts_digests = {}
+    files = read_context(entries, "registry/model:run1", ("md5",), artifacts_digests)
+
+    assert files["Svc/artifacts/model.onnx"] == b"weights"
+    assert files["Svc/artifacts/checksum/artifacts_list.txt"] == b"model\nvocab\n"
+    assert files["Svc/artifacts/checksum/model.md5"] == hashlib.md5(b"weights").hexdigest().encode()
+    assert files["Svc/artifacts/checksum/docker_image_info.txt"] == b"registry/model:run1"
+    assert "Svc" in files and files["Svc"] is None
+    assert artifacts_digests == {"Svc/artifacts/model.onnx": {"md5": hashlib.md5(b"weights").hexdigest()},
+                                 "Svc/artifacts/vocab.txt": {"md5": hashlib.md5(b"words").hexdigest()}}
+
+
+def test_generate_context_tar_uses_known_digests():
+    entries = make_entries({"Dockerfile": b"FROM base", "Svc/artifacts/model.onnx": b"weights",
+                            "Svc/artifacts/checksum/model.md5": b"stale"})
+    files = read_context(entries, "registry/model:run1", ("md5", "blake2b"),
+                         {"Svc/artifacts/model.onnx": {"md5": "known-md5", "blake2b": "known-blake2b"}})
+    assert files["Svc/artifacts/checksum/model.md5"] == b"known-md5"
+    assert files["Svc/artifacts/checksum/model.blake2b"] == b"known-blake2b"
+
+
+def test_generate_context_tar_applies_dockerignore():
+    entries = make_entries({"Dockerfile": b"FROM base", ".dockerignore": b"# comment\n*.log\n",
+                            "train.log": b"log"})
+    files = read_context(entries, "registry/model:run1")
+    assert "train.log" not in files
+    assert "Dockerfile" in files
+
+
+def get_fingerprint(entries, content_digests=None, image_tag="registry/model:run1", base_image_digest="sha256:base", algorithms=("md5",)):
+    return SinaraModelContext.get_fingerprint(entries, content_digests or {}, image_tag, base_image_digest, algorithms)
+
+
+def test_get_fingerprint():
+    entries = make_entries({"Dockerfile": b"FROM base", ".dockerignore": b"*.log\n", "train.log": b"log"})
+    entries["Svc/artifacts/model.onnx"] = {"size": 7, "mtime": 0, "open": None}
+    digests = {"Svc/artifacts/model.onnx": "sha256:weights"}
+    fingerprint = get_fingerprint(entries, digests)
+    assert fingerprint == get_fingerprint(dict(entries), dict(digests))
+
+    # inputs of the image change the fingerprint
+    assert fingerprint != get_fingerprint(entries, {"Svc/artifacts/model.onnx": "sha256:other"})
+    assert fingerprint != get_fingerprint(entries, digests, image_tag="registry/model:run2")
+    assert fingerprint != get_fingerprint(entries, digests, base_image_digest="sha256:newer")
+    assert fingerprint != get_fingerprint(entries, digests, algorithms=("md5", "blake2b"))
+    changed = dict(entries)
+    SinaraModelContext.set_entry_data(changed, "Dockerfile", b"FROM other")
+    assert fingerprint != get_fingerprint(changed, digests)
+
+    # files excluded by .dockerignore and mtimes are not a part of the image
+    ignored = dict(entries)
+    SinaraModelContext.set_entry_data(ignored, "train.log", b"other log")
+    assert fingerprint == get_fingerprint(ignored, digests)
+    touched = dict(entries, **{"Svc/artifacts/model.onnx": dict(entries["Svc/artifacts/model.onnx"], mtime=1)})
+    assert fingerprint == get_fingerprint(touched, digests)
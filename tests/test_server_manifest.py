@@ -0,0 +1,97 @@
+import json
+import argparse
+from types import SimpleNamespace
+
+import pytest
+
+from parts import server_manifest
+from parts.config_manager import SinaraServerConfigManager
+from parts.server import SinaraServer
+from parts.server_manifest import SinaraServerManifest, SinaraServerManifestException
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    if SinaraServer.create_parser is None:
+        parser = argparse.ArgumentParser()
+        SinaraServer.add_command_handlers(parser, parser.add_subparsers(dest="subject"))
+    return tmp_path
+
+
+def write_manifest(tmp_path, manifest):
+    manifest_path = tmp_path / "servers.json"
+    manifest_path.write_text(json.dumps(manifest))
+    return manifest_path
+
+
+def save_server_config(name, image="buslovaev/sinara-notebook", **config):
+    container = {"image": image, "volumes": [f"jovyan-data-{name}:/data"], "mem_limit": "8g",
+                 "nano_cpus": 4000000000, "shm_size": "512m", "device_requests": [],
+                 "labels": {"sinaraml.serverType": "ml", "sinaraml.platform": "personal"}}
+    SinaraServerConfigManager(name).save_server_config(dict({"container": container}, **config))
+
+
+def test_load_merges_profiles(tmp_path):
+    manifest = SinaraServerManifest.load(write_manifest(tmp_path, {
+        "name": "team",
+        "profiles": {"small": {"memLimit": "8g", "cpuLimit": 4}, "ml": {"serverType": "ml"}},
+        "servers": [{"instanceName": "s1", "profiles": ["small", "ml"], "cpuLimit": 2}]
+    }))
+    assert manifest["name"] == "team"
+    assert manifest["servers"] == [{"memLimit": "8g", "cpuLimit": 2, "serverType": "ml", "instanceName": "s1"}]
+
+
+@pytest.mark.parametrize("server, message", [
+    ({"instanceName": "s1", "serverType": "ml", "unknown": 1}, "Unsupported keys unknown"),
+    ({"serverType": "ml"}, "must have instanceName"),
+    ({"instanceName": "s1"}, "must have serverType"),
+    ({"instanceName": "s1", "serverType": "ml", "profiles": "missing"}, "Profile 'missing' is not defined"),
+    ({"instanceName": "s1", "serverType": "ml", "runMode": "b"}, "must have jovyanRootPath"),
+    ({"instanceName": "s1", "serverType": "ml", "runMode": "b", "useCustomFolders": True, "jovyanDataPath": "/d"},
+     "must have jovyanWorkPath, jovyanTmpPath, jovyanRawPath"),
+])
+def test_load_rejects_invalid_specs(tmp_path, server, message):
+    with pytest.raises(SinaraServerManifestException, match=message):
+        SinaraServerManifest.load(write_manifest(tmp_path, {"servers": [server]}))
+
+
+def test_load_rejects_duplicates(tmp_path):
+    servers = [{"instanceName": "s1", "serverType": "ml"}, {"instanceName": "s1", "serverType": "cv"}]
+    with pytest.raises(SinaraServerManifestException, match="Duplicate servers s1"):
+        SinaraServerManifest.load(write_manifest(tmp_path, {"servers": servers}))
+
+
+def test_diff():
+    save_server_config("s1")
+    assert SinaraServerManifest.diff({"instanceName": "s1", "serverType": "ml", "memLimit": "8g", "cpuLimit": 4}) == []
+    assert SinaraServerManifest.diff({"instanceName": "s1", "serverType": "ml", "memLimit": "16g", "experimental": True}) == \
+        ["image: buslovaev/sinara-notebook -> buslovaev/sinara-notebook-exp", "memLimit: 8g -> 16g"]
+    assert SinaraServerManifest.diff({"instanceName": "s1", "serverType": "cv"}) == \
+        ["image: buslovaev/sinara-notebook -> buslovaev/sinara-cv", "serverType: ml -> cv", "gpuEnabled: n -> y"]
+    assert SinaraServerManifest.diff({"instanceName": "s2", "serverType": "ml"}) == ["server config is not found"]
+
+
+def test_diff_compares_frozen_servers_with_base_image():
+    save_server_config("s1", image="sinara-frozen-s1:1", base_image="buslovaev/sinara-notebook", frozen_image="sinara-frozen-s1:1")
+    assert SinaraServerManifest.diff({"instanceName": "s1", "serverType": "ml"}) == []
+    assert SinaraServerManifest.diff({"instanceName": "s1", "serverType": "ml", "memLimit": "16g"}) == \
+        ["memLimit: 8g -> 16g", "frozen image sinara-frozen-s1:1 is not kept"]
+
+
+def test_plan(monkeypatch):
+    save_server_config("s1")
+    save_server_config("s2")
+    monkeypatch.setattr(server_manifest, "docker_container_exists", lambda name: name in ["s1", "s2", "old"])
+    monkeypatch.setattr(server_manifest, "docker_volume_exists", lambda name: name == "jovyan-data-new")
+    monkeypatch.setattr(server_manifest, "docker_image_exists", lambda image: True)
+    monkeypatch.setattr(server_manifest, "docker_list_containers",
+                        lambda label: [SimpleNamespace(attrs={"Names": [f"/{name}"]}) for name in ["s1", "old"]])
+    manifest = {"name": "team", "servers": [{"instanceName": "s1", "serverType": "ml"},
+                                            {"instanceName": "s2", "serverType": "ml", "memLimit": "16g"},
+                                            {"instanceName": "new", "serverType": "ml"}]}
+    changes = {c["server"]: c for c in SinaraServerManifest.plan(manifest)}
+    assert {name: c["action"] for name, c in changes.items()} == {"s1": "unchanged", "s2": "update", "new": "create", "old": "remove"}
+    assert changes["s2"]["calls"][0] == "DELETE /containers/s2?force=true"
+    assert changes["new"]["calls"] == ["POST /volumes/create name=jovyan-work-new", "POST /volumes/create name=jovyan-tmp-new",
+                                       "POST /volumes/create name=jovyan-raw-new", "POST /containers/create name=new image=buslovaev/sinara-notebook"]
@@ -0,0 +1,130 @@
+import io
+import os
+import csv
+import json
+import argparse
+import subprocess
+
+import pytest
+
+from parts import volume
+from parts.volume import SinaraVolume
+
+
+def run_locally(root):
+    # maintenance container stand-in: runs the command with container paths mapped into root
+    def docker_container_run(image, command, volumes=None, remove=False):
+        script = command[-1].replace("/clean/", f"{root}/clean/")
+        return subprocess.run(["sh", "-c", script], capture_output=True, check=True).stdout
+    return docker_container_run
+
+
+@pytest.fixture
+def clean_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(volume, "docker_container_run", run_locally(tmp_path))
+    monkeypatch.setattr(SinaraVolume, "_get_maintenance_image", staticmethod(lambda: "ubuntu:22.04"))
+    return tmp_path
+
+
+def make_file(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(size)
+    old = 1_000_000_000
+    os.utime(path, (old, old))
+
+
+def test_get_clean_find_expression():
+    assert SinaraVolume.get_clean_find_expression(0) == "-type f"
+    assert SinaraVolume.get_clean_find_expression(7, "100M", ["*.ckpt", "my file"]) == \
+        "-type f -mtime +7 -size +100M \\( -name '*.ckpt' -o -name 'my file' \\)"
+
+
+def test_get_clean_find_expression_rejects_invalid_size():
+    with pytest.raises(ValueError):
+        SinaraVolume.get_clean_find_expression(7, "1; rm -rf /")
+
+
+def test_clean_files_reports_totals_above_2gib(clean_root):
+    # sparse files, find reports their apparent size
+    make_file(clean_root / "clean" / "0" / "big1.bin", 2 * 1024**3)
+    make_file(clean_root / "clean" / "0" / "nested" / "big2.bin", 3 * 1024**3)
+    make_file(clean_root / "clean" / "1" / "small.bin", 10)
+    volumes = [{"name": "jovyan-data-s", "type": "docker volume"}, {"name": "jovyan-work-s", "type": "docker volume"}]
+
+    dry_run_results = SinaraVolume.clean_files(volumes, 0, dry_run=True)
+    assert [(files_count, files_size) for _, files_count, files_size in dry_run_results] == [(2, 5 * 1024**3), (1, 10)]
+    assert (clean_root / "clean" / "0" / "big1.bin").exists()
+
+    results = SinaraVolume.clean_files(volumes, 0)
+    assert [(files_count, files_size) for _, files_count, files_size in results] == [(2, 5 * 1024**3), (1, 10)]
+    assert not (clean_root / "clean" / "0" / "big1.bin").exists()
+
+
+def test_clean_files_keeps_recent_files(clean_root):
+    make_file(clean_root / "clean" / "0" / "old.bin", 100)
+    (clean_root / "clean" / "0" / "new.bin").write_bytes(b"x")
+    results = SinaraVolume.clean_files([{"name": "jovyan-tmp-s", "type": "docker volume"}], 1)
+    assert [(files_count, files_size) for _, files_count, files_size in results] == [(1, 100)]
+    assert (clean_root / "clean" / "0" / "new.bin").exists()
+
+
+def test_prune_pkg_cache_removes_whole_units(tmp_path, monkeypatch):
+    def docker_container_run(image, command, volumes=None, remove=False):
+        script = command[-1].replace("/cache", f"{tmp_path}/cache")
+        return subprocess.run(["sh", "-c", script], capture_output=True, check=True).stdout
+    monkeypatch.setattr(volume, "docker_container_run", docker_container_run)
+
+    cache = tmp_path / "cache"
+    mb = 1024**2
+    old_files = [cache / "conda" / "numpy-1.0-0" / "lib" / "a.so", cache / "conda" / "numpy-1.0-0" / "info" / "index.json",
+                 cache / "conda" / "numpy-1.0-0.conda", cache / "pip" / "http-v2" / "a" / "b" / "0abc",
+                 cache / "pip" / "http-v2" / "a" / "b" / "0abc.body"]
+    new_files = [cache / "conda" / "pandas-2.0-0" / "lib" / "b.so", cache / "conda" / "pandas-2.0-0" / "info" / "index.json",
+                 cache / "conda" / "pandas-2.0-0.tar.bz2", cache / "pip" / "wheels" / "c" / "d" / "e" / "x-1.0-py3-none-any.whl"]
+    for path in old_files:
+        make_file(path, 10 * mb)
+    for path in new_files:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.truncate(10 * mb)
+    (cache / "conda" / "urls.txt").write_text("https://conda.anaconda.org/numpy-1.0-0.conda\n")
+    for folder in (cache / "conda" / "numpy-1.0-0").rglob("*"):
+        os.utime(folder, (1_000_000_000, 1_000_000_000))
+    os.utime(cache / "conda" / "numpy-1.0-0", (1_000_000_000, 1_000_000_000))
+
+    SinaraVolume.prune_pkg_cache("ubuntu:22.04", [], 45 * mb)
+    assert not any(path.exists() for path in old_files)
+    assert not (cache / "conda" / "numpy-1.0-0").exists()
+    assert all(path.exists() for path in new_files)
+    assert (cache / "conda" / "urls.txt").exists()
+
+
+def list_volumes(monkeypatch, capsys, servers, **args):
+    monkeypatch.setattr(SinaraVolume, "iter_servers_volumes", staticmethod(lambda size_source, include_removed: iter(servers)))
+    list_args = {"format": "json", "sort": None, "top": None, "sizeSource": "du", "all": True, **args}
+    SinaraVolume.list(argparse.Namespace(**list_args))
+    return capsys.readouterr().out
+
+
+def volume_row(name, used_bytes):
+    return {"name": name, "used": f"{used_bytes} B", "used_bytes": used_bytes, "type": "docker volume",
+            "mounted_at": "/data", "source": name}
+
+
+def test_list_sorts_and_limits_volumes(monkeypatch, capsys):
+    servers = [("one", "active", [volume_row("one-data", 10), volume_row("one-work", None)]),
+               ("two", "removed", [volume_row("two-data", 30)])]
+
+    output = list_volumes(monkeypatch, capsys, servers)
+    assert [json.loads(line)["name"] for line in output.splitlines()] == ["one-data", "one-work", "two-data"]
+
+    output = list_volumes(monkeypatch, capsys, servers, top=2)
+    rows = [json.loads(line) for line in output.splitlines()]
+    assert [(row["server"], row["status"], row["name"]) for row in rows] == [("two", "removed", "two-data"), ("one", "active", "one-data")]
+
+    output = list_volumes(monkeypatch, capsys, servers, format="csv", sort="name")
+    rows = list(csv.DictReader(io.StringIO(output)))
+    assert list(rows[0].keys()) == SinaraVolume.list_columns
+    assert [row["name"] for row in rows] == ["one-data", "one-work", "two-data"]
+    assert rows[1]["used_bytes"] == ""
@@ -0,0 +1,82 @@
+import os
+import subprocess
+from argparse import Namespace
+
+import pytest
+
+from parts import volume_tier
+from parts.volume import SinaraVolume
+from parts.volume_tier import SinaraVolumeTier
+
+
+@pytest.fixture
+def tier_root(tmp_path, monkeypatch):
+    # maintenance container stand-in: /src and /archive are folders of tmp_path
+    def docker_container_run(image, command, volumes=None, remove=False):
+        script = command[-1].replace("/src", f"{tmp_path}/src").replace("/archive/", f"{tmp_path}/archive/")
+        return subprocess.run(["sh", "-c", script], capture_output=True, check=True).stdout
+    monkeypatch.setattr(volume_tier, "docker_container_run", docker_container_run)
+    monkeypatch.setattr(SinaraVolume, "_get_maintenance_image", staticmethod(lambda: "ubuntu:22.04"))
+    monkeypatch.setattr(SinaraVolume, "get_server_volume", staticmethod(lambda server_name, mount_point: {"name": "jovyan-data-s"}))
+    monkeypatch.setattr(SinaraVolume, "get_volume_mount_source", staticmethod(lambda volume: volume["name"]))
+    (tmp_path / "src").mkdir()
+    (tmp_path / "archive").mkdir()
+    return tmp_path
+
+
+def make_file(path, content=b"", size=None, age_days=100):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+        if size:
+            f.truncate(size)
+    old = path.stat().st_mtime - age_days * 86400
+    os.utime(path, (old, old))
+
+
+def get_args(**kwargs):
+    return Namespace(**dict({"instanceName": "s", "mount": "data", "days": 30, "archivePath": "archive",
+                             "dryRun": False, "path": "", "list": False}, **kwargs))
+
+
+def test_tier_dry_run_reports_sizes_above_2gib(tier_root, capsys):
+    make_file(tier_root / "src" / "big.bin", size=3 * 1024**3)
+    SinaraVolumeTier.tier(get_args(dryRun=True))
+    assert "1 files (3.0 GB)" in capsys.readouterr().out
+
+
+def test_untier_matches_path_boundaries(tier_root, capsys):
+    make_file(tier_root / "src" / "exp1" / "a.txt", b"a")
+    make_file(tier_root / "src" / "exp1" / "sub" / "b.txt", b"b")
+    make_file(tier_root / "src" / "exp10" / "c.txt", b"c")
+    make_file(tier_root / "src" / "exp1_old" / "d.txt", b"d")
+    make_file(tier_root / "src" / "recent.txt", b"r", age_days=0)
+    SinaraVolumeTier.tier(get_args())
+    assert [p.name for p in (tier_root / "src").rglob("*") if p.is_file()] == ["recent.txt"]
+
+    capsys.readouterr()
+    SinaraVolumeTier.untier(get_args(path="exp1", list=True))
+    assert sorted(line.split()[0] for line in capsys.readouterr().out.splitlines()[2:]) == ["exp1/a.txt", "exp1/sub/b.txt"]
+
+    SinaraVolumeTier.untier(get_args(path="/exp1/"))
+    assert "Restored 2 files" in capsys.readouterr().out
+    assert (tier_root / "src" / "exp1" / "sub" / "b.txt").read_bytes() == b"b"
+    assert not (tier_root / "src" / "exp10" / "c.txt").exists()
+    index = (tier_root / "archive" / "s" / "data" / SinaraVolumeTier.archive_index).read_text()
+    assert sorted(line.split("\t")[0] for line in index.splitlines()) == ["exp10/c.txt", "exp1_old/d.txt"]
+
+    SinaraVolumeTier.untier(get_args(path="exp1/a.txt"))
+    assert "No archived files matching" in capsys.readouterr().out
+
+    SinaraVolumeTier.untier(get_args())
+    assert "Restored 2 files" in capsys.readouterr().out
+    assert (tier_root / "src" / "exp1_old" / "d.txt").read_bytes() == b"d"
+
+
+def test_untier_keeps_existing_files(tier_root, capsys):
+    make_file(tier_root / "src" / "exp1" / "a.txt", b"archived")
+    SinaraVolumeTier.tier(get_args())
+    make_file(tier_root / "src" / "exp1" / "a.txt", b"newer", age_days=0)
+    SinaraVolumeTier.untier(get_args(path="exp1"))
+    assert "Skipped 1 archived files" in capsys.readouterr().out
+    assert (tier_root / "src" / "exp1" / "a.txt").read_bytes() == b"newer"